@@ -0,0 +1,396 @@
+"""
+Startup and command-latency benchmarks for the bot's cogs.
+
+The real cogs are loaded into an in-process fake bot (see `fakes.py`) with fake
+guilds, channels and threads, so nothing touches the network. State files are
+written to a temporary directory.
+
+Usage (from the repository root):
+    python benchmarks/bench_bot.py [--sizes 10 100 1000] [--iterations 50] [--json out.json]
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+REPO_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import utils.JsonTools as JsonTools  # noqa: E402
+from discord.ext import commands  # noqa: E402
+from fakes import (  # noqa: E402
+    REST_CALLS,
+    FakeBot,
+    FakeConfirmationView,
+    FakeContext,
+    FakeEmoji,
+    FakeReactionPayload,
+    make_bot_dir,
+)
+
+COG_MODULES: List[str] = [
+    "cogs.CourseThreads",
+    "cogs.ThreadManager",
+    "cogs.RoleDistributor",
+    "cogs.FaqManager",
+    "cogs.Repl",
+    "cogs.PrequisiteChecker",
+]
+
+DEPARTMENTS: List[str] = ["CPEN", "ELEC", "CPSC", "MATH", "PHYS", "APSC"]
+
+# Fraction of threads that are archived on each refresher tick
+ARCHIVED_FRACTION: float = 0.01
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered: List[float] = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+async def measure(
+    factory: Callable[[], Awaitable[Any]], iterations: int
+) -> Dict[str, float]:
+    samples: List[float] = []
+    for _ in range(iterations):
+        start: float = time.perf_counter()
+        await factory()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def course_names(count: int) -> List[str]:
+    """Deterministic, unique course names spread over year levels 1-5."""
+    names: List[str] = []
+    for i in range(count):
+        dept: str = DEPARTMENTS[i % len(DEPARTMENTS)]
+        level: int = 1 + (i // len(DEPARTMENTS)) % 5
+        number: int = (i // (len(DEPARTMENTS) * 5)) % 100
+        suffix: str = "" if i < 3000 else chr(ord("A") + (i // 3000) % 26)
+        names.append(f"{dept} {level}{number:02d}{suffix}")
+    return names
+
+
+async def populate_course_threads(
+    bot: FakeBot, cog: Any, guild: Any, count: int
+) -> None:
+    from cogs.CourseThreads import BASE_CHANNEL_KEY, CURRENT_COURSES_KEY
+
+    await cog.load_guild(guild.id)
+    course_mappings: Dict[str, Any] = cog.course_mappings[guild.id]
+    for name in course_names(count):
+        level: str = name.split()[1][0]
+        if level not in course_mappings:
+            channel = guild.add_text_channel(f"{level}xx-courses")
+            course_mappings[level] = {
+                BASE_CHANNEL_KEY: channel.id,
+                CURRENT_COURSES_KEY: {},
+            }
+        base = bot.get_channel(course_mappings[level][BASE_CHANNEL_KEY])
+        thread = guild.add_thread(base, name)
+        course_mappings[level][CURRENT_COURSES_KEY][name] = thread.id
+
+
+def archive_some(bot: FakeBot, thread_ids: List[int]) -> None:
+    step: int = max(1, int(1 / ARCHIVED_FRACTION))
+    for thread_id in thread_ids[::step]:
+        bot.get_channel(thread_id).archived = True
+
+
+async def bench_startup(bot: FakeBot, secrets_dir: str) -> Dict[str, Any]:
+    results: Dict[str, Any] = {"import_ms": {}, "setup_ms": {}}
+    for module_name in COG_MODULES:
+        start: float = time.perf_counter()
+        module = importlib.import_module(module_name)
+        results["import_ms"][module_name] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        module.setup(bot)
+        results["setup_ms"][module_name] = (time.perf_counter() - start) * 1000
+
+    # Keep the cogs that don't use JsonTools away from the real secrets directory
+    bot.cogs["Repl"].repl_file = os.path.join(secrets_dir, "repl_endpoint.txt")
+
+    start = time.perf_counter()
+    await bot.dispatch_ready()
+    results["ready_to_state_loaded_ms"] = (time.perf_counter() - start) * 1000
+    results["state_ms"] = {
+        name: phases["state"] * 1000
+        for name, phases in bot.startup_report.timings.items()
+        if "state" in phases
+    }
+    return results
+
+
+async def bench_refreshers(
+    bot: FakeBot, sizes: List[int], iterations: int
+) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    course_threads = bot.cogs["CourseThreads"]
+    thread_manager = bot.cogs["ThreadManager"]
+    for size in sizes:
+        guild = bot.add_guild(f"refresher-{size}")
+        await populate_course_threads(bot, course_threads, guild, size)
+        course_thread_ids: List[int] = [
+            thread_id
+            for metadata in course_threads.course_mappings[guild.id].values()
+            for thread_id in metadata["current_courses"].values()
+        ]
+        await thread_manager.load_guild(guild.id)
+        thread_manager.thread_mappings[guild.id]["pinned_threads"] = list(
+            course_thread_ids
+        )
+
+        async def course_tick():
+            archive_some(bot, course_thread_ids)
+            await course_threads._refresh_threads()
+
+        async def manager_tick():
+            archive_some(bot, course_thread_ids)
+            await thread_manager._refresh_threads()
+
+        results[f"course_threads_tick@{size}"] = await measure(course_tick, iterations)
+        results[f"thread_manager_tick@{size}"] = await measure(manager_tick, iterations)
+        # Like a guild on another shard, so the next size is measured on its own
+        await course_threads.unload_guild(guild.id)
+        await thread_manager.unload_guild(guild.id)
+    return results
+
+
+async def bench_reaction_roles(bot: FakeBot, events: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    cog = bot.cogs["RoleDistributor"]
+    guild = bot.add_guild("reaction-roles")
+    channel = guild.add_text_channel("roles")
+    emojis: List[FakeEmoji] = [FakeEmoji(e) for e in "🍎🍌🍒🍇🍉"]
+    members = [guild.add_member(f"member-{i}") for i in range(100)]
+    await cog.load_guild(guild.id)
+
+    for unique in (False, True):
+        message = await channel.send("React for roles")
+        cog.role_mapping[guild.id][str(message.id)] = {
+            "mapping": {
+                str(emoji): str(guild.add_role(f"role-{emoji}").id) for emoji in emojis
+            },
+            "unique": unique,
+        }
+        payloads: List[FakeReactionPayload] = [
+            FakeReactionPayload(
+                message=message,
+                member=members[i % len(members)],
+                emoji=emojis[i % len(emojis)],
+            )
+            for i in range(events)
+        ]
+        start: float = time.perf_counter()
+        for payload in payloads:
+            await cog.on_raw_reaction_add(payload)
+        for payload in payloads:
+            await cog.on_raw_reaction_remove(payload)
+        elapsed: float = time.perf_counter() - start
+        results[f"reaction_events_per_s(unique={unique})"] = (2 * events) / elapsed
+
+    # Updating a 20-role menu where two of the emojis changed
+    menu_emojis: List[str] = [chr(0x1F600 + i) for i in range(22)]
+    message = await channel.send("Pick your roles")
+    for emoji in menu_emojis[:20]:
+        await message.add_reaction(emoji)
+    cog.role_collector[guild.id] = {
+        "message": message,
+        "mapping": {
+            emoji: str(guild.add_role(f"menu-{emoji}").id) for emoji in menu_emojis[2:]
+        },
+        "unique": False,
+    }
+    ctx = FakeContext(bot, author=bot.owner, guild=guild, channel=channel)
+    calls_before: int = sum(REST_CALLS.values())
+    await cog.finalize_role_mapping.callback(cog, ctx)
+    results["role_menu_update_rest_calls"] = sum(REST_CALLS.values()) - calls_before
+    return results
+
+
+async def bench_course_commands(
+    bot: FakeBot, sizes: List[int], iterations: int
+) -> Dict[str, Any]:
+    from utils.Converters import Course
+
+    results: Dict[str, Any] = {}
+    cog = bot.cogs["CourseThreads"]
+    for size in sizes:
+        guild = bot.add_guild(f"commands-{size}")
+        await populate_course_threads(bot, cog, guild, size)
+        channel = guild.add_text_channel("bot-commands")
+        ctx = FakeContext(bot, author=guild.add_member(), guild=guild, channel=channel)
+
+        results[f"course_search@{size}"] = await measure(
+            lambda: cog.search_courses.callback(cog, ctx, "CPEN"), iterations
+        )
+        results[f"course_list@{size}"] = await measure(
+            lambda: cog.list_courses.callback(cog, ctx), iterations
+        )
+        # Repeated joins are answered from the thread membership cache
+        join_course: Course = Course.parse(course_names(size)[0])
+        results[f"course_join_repeat@{size}"] = await measure(
+            lambda: cog.join_course.callback(cog, ctx, join_course), iterations
+        )
+        results[f"course_mine@{size}"] = await measure(
+            lambda: cog.my_courses.callback(cog, ctx), iterations
+        )
+
+        # The membership stage of `!course import` for a typical schedule
+        schedule: List[Course] = [Course.parse(name) for name in course_names(size)[:8]]
+        results[f"import_membership_add@{size}"] = await measure(
+            lambda: cog._add_user_to_courses(guild.id, ctx.author, schedule),
+            iterations,
+        )
+    return results
+
+
+async def bench_bulk_create(bot: FakeBot, sizes: List[int]) -> Dict[str, Any]:
+    """Times a term rollover with `!ct bulk_create`; the catalogue is pre-populated."""
+    import cogs.CourseThreads as CourseThreads
+
+    CourseThreads.ConfirmationView = FakeConfirmationView
+    cog = bot.cogs["CourseThreads"]
+    catalogue = bot.cogs["PrerequisiteChecker"].catalogue
+    results: Dict[str, Any] = {}
+    for size in sizes:
+        guild = bot.add_guild(f"bulk-{size}")
+        await cog.load_guild(guild.id)
+        cog.course_mappings[guild.id].update(
+            {
+                str(level): {
+                    "base_channel": guild.add_text_channel(f"{level}xx-courses").id,
+                    "current_courses": {},
+                }
+                for level in range(1, 6)
+            }
+        )
+        names: List[str] = course_names(size)
+        catalogue.update({name: {} for name in names})
+        channel = guild.add_text_channel("admin-commands")
+        ctx = FakeContext(bot, author=guild.add_member(), guild=guild, channel=channel)
+        start: float = time.perf_counter()
+        await cog.bulk_create_threads.callback(cog, ctx, courses=" ".join(names))
+        results[f"bulk_create@{size}_ms"] = (time.perf_counter() - start) * 1000
+    return results
+
+
+async def bench_faq(bot: FakeBot, iterations: int) -> Dict[str, Any]:
+    cog = bot.cogs["FaqManager"]
+    guild = bot.add_guild("faq")
+    channel = guild.add_text_channel("general")
+    ctx = FakeContext(bot, author=guild.add_member(), guild=guild, channel=channel)
+    ctx.invoked_with = "leet"
+    error = commands.errors.CommandNotFound()
+    return {
+        "faq_dispatch": await measure(
+            lambda: cog.on_command_error(ctx, error), iterations
+        ),
+        "faq_search": await measure(
+            lambda: cog.search_faqs.callback(cog, ctx, terms="leetcode guide"),
+            iterations,
+        ),
+    }
+
+
+async def bench_courseinfo(bot: FakeBot, iterations: int) -> Dict[str, Any]:
+    """Times building the `!courseinfo` embed; the scraper is stubbed out."""
+    import cogs.PrequisiteChecker as PrequisiteChecker
+    from utils.Converters import Course
+
+    async def fake_scrape(course):
+        return {
+            "url": "https://example.invalid",
+            "name": f"{course} Fake Course",
+            "description": "A course.",
+            "prerequisites": "None",
+            "corequisites": "None",
+            "credits": "4",
+            "footer": "Source: benchmark",
+        }
+
+    PrequisiteChecker.scrape_course_info = fake_scrape
+    cog = bot.cogs["PrerequisiteChecker"]
+    guild = bot.add_guild("courseinfo")
+    channel = guild.add_text_channel("general")
+    ctx = FakeContext(bot, author=guild.add_member(), guild=guild, channel=channel)
+    course = Course.parse("CPEN331")
+    return {
+        "courseinfo_render": await measure(
+            lambda: cog.courseinfo.callback(cog, ctx, course), iterations
+        )
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        secrets_dir: str = os.path.join(tmp, "secrets")
+        os.makedirs(secrets_dir)
+        JsonTools.SECRETS_PATH = secrets_dir
+        # An empty catalogue would be refreshed from the calendar once loaded
+        JsonTools.write_json("course_catalogue.json", {"CPEN 211": {}})
+        bot = FakeBot(make_bot_dir(tmp, REPO_DIR))
+
+        results: Dict[str, Any] = {"startup": await bench_startup(bot, secrets_dir)}
+        results["refreshers"] = await bench_refreshers(bot, args.sizes, args.iterations)
+        results["reaction_roles"] = await bench_reaction_roles(bot, args.events)
+        results["course_commands"] = await bench_course_commands(
+            bot, args.sizes, args.iterations
+        )
+        results["bulk_create"] = await bench_bulk_create(bot, args.sizes)
+        results["faq"] = await bench_faq(bot, args.iterations)
+        results["courseinfo"] = await bench_courseinfo(bot, args.iterations)
+        results["simulated_rest_calls"] = dict(REST_CALLS)
+        return results
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for section, values in results.items():
+        print(f"== {section}")
+        for name, value in values.items():
+            if isinstance(value, dict) and "mean_ms" in value:
+                print(
+                    f"  {name:<40} mean {value['mean_ms']:9.3f}ms  "
+                    + f"p50 {value['p50_ms']:9.3f}ms  p95 {value['p95_ms']:9.3f}ms"
+                )
+            elif isinstance(value, dict):
+                for sub_name, sub_value in value.items():
+                    print(f"  {name + '.' + sub_name:<40} {sub_value:12.3f}")
+            elif isinstance(value, float):
+                print(f"  {name:<40} {value:12.3f}")
+            else:
+                print(f"  {name:<40} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument(
+        "--events", type=int, default=1000, help="Reaction events per scenario"
+    )
+    parser.add_argument("--json", help="Also write the raw results to this file")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = asyncio.run(run(args))
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
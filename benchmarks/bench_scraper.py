@@ -0,0 +1,257 @@
+"""
+Offline benchmark and regression check for the UBC course info scraper.
+
+The fixture corpus (see `ubc_corpus.py`) is served by a local HTTP server that
+stands in for the UBC calendar, and every available parser backend is measured on
+fetch+parse latency, parse-only peak memory and correctness of the extracted
+records. Finally, the scraper's own backend selection is run over the corpus.
+
+Usage (from the repository root):
+    python benchmarks/bench_scraper.py [--iterations 5] [--stride 10] [--json out.json]
+"""
+import argparse
+import asyncio
+import http.server
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+REPO_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import utils.UBCCourseInfo as UBCCourseInfo  # noqa: E402
+from utils.Converters import Course  # noqa: E402
+from ubc_corpus import EXPECTED_FIELDS, load_corpus, load_saved_expected  # noqa: E402
+
+# Courses near the end of the page are the worst case for extractors that scan
+SAMPLES_PER_DEPARTMENT: int = 4
+
+# Label for the default lookup mode, which streams the response
+STREAMING_FETCH: str = "streaming fetch"
+
+
+def serve_pages(pages: Dict[str, str]) -> Tuple[http.server.HTTPServer, str]:
+    """Serves the pages at /<slug> on a local port; returns the server and base URL."""
+    encoded: Dict[str, bytes] = {
+        f"/{slug}": page.encode("utf-8") for slug, page in pages.items()
+    }
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body: Optional[bytes] = encoded.get(self.path)
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def pick_samples(expected: Dict[str, Optional[Dict[str, str]]]) -> List[str]:
+    by_department: Dict[str, List[str]] = {}
+    for course in expected:
+        by_department.setdefault(course.split()[0], []).append(course)
+    samples: List[str] = []
+    for courses in by_department.values():
+        found: List[str] = [c for c in courses if expected[c] is not None]
+        missing: List[str] = [c for c in courses if expected[c] is None]
+        samples.extend(found[-(SAMPLES_PER_DEPARTMENT - 1) :] + missing[:1])
+    return samples
+
+
+def matches(result: Optional[Dict[str, str]], expected: Optional[Dict[str, str]]):
+    if result is None or expected is None:
+        return result is expected
+    return all(result.get(field) == expected[field] for field in EXPECTED_FIELDS)
+
+
+def check_correctness(
+    backend: str,
+    pages: Dict[str, str],
+    expected: Dict[str, Optional[Dict[str, str]]],
+    stride: int,
+) -> List[str]:
+    """
+    Parses every `stride`-th course of the corpus (every saved course is always
+    checked); returns the courses that came out wrong.
+    """
+    saved_courses: Set[str] = set(load_saved_expected())
+    failures: List[str] = []
+    for index, (course_str, expected_record) in enumerate(expected.items()):
+        if course_str not in saved_courses and index % stride:
+            continue
+        course: Course = Course.parse(course_str)
+        page: str = pages[f"{course.dept.lower()}v"]
+        result = UBCCourseInfo.parse_course_info(page, course, backend=backend)
+        if not matches(result, expected_record):
+            failures.append(course_str)
+    return failures
+
+
+def peak_parse_memory(backend: str, page: str, course: Course) -> int:
+    tracemalloc.start()
+    try:
+        UBCCourseInfo.parse_course_info(page, course, backend=backend)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+async def peak_fetch_parse_memory(course: Course) -> int:
+    tracemalloc.start()
+    try:
+        await UBCCourseInfo.scrape_course_info(course)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+async def bench_backend(
+    backend: Optional[str],
+    pages: Dict[str, str],
+    expected: Dict[str, Optional[Dict[str, str]]],
+    samples: List[str],
+    iterations: int,
+    stride: int,
+) -> Dict[str, Any]:
+    UBCCourseInfo.set_parser_backend(backend)
+    results: Dict[str, Any] = {}
+    for course_str in samples:
+        course: Course = Course.parse(course_str)
+        page: str = pages[f"{course.dept.lower()}v"]
+        latencies: List[float] = []
+        correct: bool = True
+        for _ in range(iterations):
+            start: float = time.perf_counter()
+            result = await UBCCourseInfo.scrape_course_info(course)
+            latencies.append(time.perf_counter() - start)
+            correct = correct and matches(result, expected[course_str])
+        results[course_str] = {
+            "fetch_parse_mean_ms": statistics.mean(latencies) * 1000,
+            "fetch_parse_peak_kib": await peak_fetch_parse_memory(course) / 1024,
+            "parse_peak_kib": peak_parse_memory(backend or "stream", page, course)
+            / 1024,
+            "correct": correct,
+        }
+    results["corpus_failures"] = check_correctness(
+        backend or "stream", pages, expected, stride
+    )
+    return results
+
+
+async def bench_bulk(
+    departments: List[str], iterations: int
+) -> Dict[str, Dict[str, float]]:
+    """Times fetching and parsing every department at once with each executor kind."""
+    results: Dict[str, Dict[str, float]] = {}
+    for kind in ("inline", "thread", "process"):
+        await UBCCourseInfo.configure_parser_executor(kind)
+        # Warm the pool up so that worker startup isn't counted; fewer departments
+        # would be parsed in a thread
+        await UBCCourseInfo.scrape_departments(departments)
+        latencies: List[float] = []
+        for _ in range(iterations):
+            start: float = time.perf_counter()
+            await UBCCourseInfo.scrape_departments(departments)
+            latencies.append(time.perf_counter() - start)
+        results[kind] = {"bulk_mean_ms": statistics.mean(latencies) * 1000}
+    await UBCCourseInfo.configure_parser_executor()
+    return results
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    pages, expected = load_corpus()
+    server, base_url = serve_pages(pages)
+    UBCCourseInfo.COURSE_DESCRIPTIONS_URL = base_url
+    samples: List[str] = pick_samples(expected)
+    try:
+        results: Dict[str, Any] = {
+            "page_sizes_kib": {slug: len(page) / 1024 for slug, page in pages.items()},
+            "backends": {},
+        }
+        # `None` is the default mode, which streams the response instead of buffering it
+        for backend in UBCCourseInfo.available_parser_backends() + [None]:
+            results["backends"][backend or STREAMING_FETCH] = await bench_backend(
+                backend, pages, expected, samples, args.iterations, args.stride
+            )
+
+        results["bulk"] = await bench_bulk(
+            [slug[:-1] for slug in pages], args.iterations
+        )
+
+        # The scraper compares backends against the reference backend's full record
+        selection_samples = []
+        for course_str in samples:
+            course: Course = Course.parse(course_str)
+            page: str = pages[f"{course.dept.lower()}v"]
+            reference = UBCCourseInfo.parse_course_info(
+                page, course, backend=UBCCourseInfo.DEFAULT_PARSER_BACKEND
+            )
+            selection_samples.append((page, course, reference))
+        results["selected_backend"] = UBCCourseInfo.select_parser_backend(
+            selection_samples
+        )
+        return results
+    finally:
+        await UBCCourseInfo.shutdown_parser_executor()
+        server.shutdown()
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print("== page sizes")
+    for slug, size in results["page_sizes_kib"].items():
+        print(f"  {slug:<12} {size:10.1f} KiB")
+    for backend, backend_results in results["backends"].items():
+        print(f"== {backend}")
+        for course, values in backend_results.items():
+            if course == "corpus_failures":
+                continue
+            print(
+                f"  {course:<10} fetch+parse {values['fetch_parse_mean_ms']:9.3f}ms  "
+                + f"peak {values['fetch_parse_peak_kib']:10.1f} KiB  "
+                + f"parse peak {values['parse_peak_kib']:10.1f} KiB  "
+                + ("ok" if values["correct"] else "WRONG")
+            )
+        failures: List[str] = backend_results["corpus_failures"]
+        print(
+            f"  corpus: {'all correct' if not failures else 'wrong: ' + ', '.join(failures)}"
+        )
+    print("== bulk fetch+parse of every department")
+    for kind, values in results["bulk"].items():
+        print(f"  {kind:<10} {values['bulk_mean_ms']:9.3f}ms")
+    print(f"== selected backend: {results['selected_backend']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument(
+        "--stride",
+        type=int,
+        default=10,
+        help="Check every n-th generated course for correctness (1 checks all)",
+    )
+    parser.add_argument("--json", help="Also write the raw results to this file")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = asyncio.run(run(args))
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
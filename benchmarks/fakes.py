@@ -0,0 +1,416 @@
+"""
+In-process stand-ins for the parts of discord.py the cogs touch, so that the real
+cogs can be driven without a gateway connection or any network access.
+Every REST-backed coroutine is a no-op that yields to the loop once, and counts
+the call so that benchmarks can report how many API calls a path would make.
+"""
+import asyncio
+import itertools
+import os
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import discord
+
+from utils.RestBudget import RestBudget
+from utils.Scheduler import Scheduler
+from utils.Startup import StartupReport
+
+_snowflakes = itertools.count(100000000000000000)
+
+
+def snowflake() -> int:
+    return next(_snowflakes)
+
+
+# Counts of simulated REST calls, keyed by a short route name
+REST_CALLS: Counter = Counter()
+
+
+async def _rest(route: str) -> None:
+    REST_CALLS[route] += 1
+    await asyncio.sleep(0)
+
+
+class FakeResponse:
+    """The parts of an HTTP response that discord.py's HTTP errors read."""
+
+    def __init__(self, status: int, reason: str):
+        self.status: int = status
+        self.reason: str = reason
+
+
+class FakeUser:
+    def __init__(self, name: str = "user", user_id: Optional[int] = None):
+        self.id: int = user_id if user_id is not None else snowflake()
+        self.name: str = name
+        self.bot: bool = False
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeRole:
+    def __init__(self, name: str):
+        self.id: int = snowflake()
+        self.name: str = name
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeMember(FakeUser):
+    def __init__(self, guild: "FakeGuild", name: str = "member"):
+        super().__init__(name)
+        self.guild: FakeGuild = guild
+        self.roles: List[FakeRole] = []
+        self.guild_permissions = discord.Permissions.all()
+
+    async def add_roles(self, *roles: FakeRole, **_):
+        await _rest("add_roles")
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles: FakeRole, **_):
+        await _rest("remove_roles")
+        self.roles = [role for role in self.roles if role not in roles]
+
+
+class FakeReaction:
+    def __init__(self, emoji: Any, me: bool = False):
+        self.emoji: Any = emoji
+        self.me: bool = me
+
+    def __str__(self) -> str:
+        return str(self.emoji)
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeTextChannel", content: str = "", author=None):
+        self.id: int = snowflake()
+        self.channel: FakeTextChannel = channel
+        self.guild: Optional[FakeGuild] = channel.guild
+        self.content: str = content
+        self.author = author
+        self.attachments: List[Any] = []
+        self.reactions: List[FakeReaction] = []
+
+    async def create_thread(self, *, name: str, **_) -> "FakeThread":
+        await _rest("create_thread")
+        return self.channel.guild.add_thread(self.channel, name)
+
+    async def add_reaction(self, emoji: Any):
+        await _rest("add_reaction")
+        self.reactions.append(FakeReaction(emoji, me=True))
+
+    async def remove_reaction(self, emoji: Any, member: Any):
+        await _rest("remove_reaction")
+
+    async def clear_reaction(self, emoji: Any):
+        await _rest("clear_reaction")
+        self.reactions = [r for r in self.reactions if str(r.emoji) != str(emoji)]
+
+    async def clear_reactions(self):
+        await _rest("clear_reactions")
+        self.reactions = []
+
+    async def edit(self, *args, **kwargs):
+        await _rest("edit_message")
+        return self
+
+    async def delete(self):
+        await _rest("delete_message")
+
+
+class FakeTextChannel:
+    def __init__(self, guild: "FakeGuild", name: str):
+        self.id: int = snowflake()
+        self.guild: FakeGuild = guild
+        self.name: str = name
+        self.messages: Dict[int, FakeMessage] = {}
+
+    @property
+    def mention(self) -> str:
+        return f"<#{self.id}>"
+
+    async def send(self, content: str = "", **_) -> FakeMessage:
+        await _rest("send_message")
+        message = FakeMessage(self, content)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await _rest("fetch_message")
+        return self.messages[message_id]
+
+    async def set_permissions(self, *args, **kwargs):
+        await _rest("set_permissions")
+
+
+class FakeThread(FakeTextChannel):
+    def __init__(self, guild: "FakeGuild", parent: FakeTextChannel, name: str):
+        super().__init__(guild, name)
+        self.parent_id: int = parent.id
+        self.archived: bool = False
+        self.locked: bool = False
+        self.member_ids: set = set()
+
+    @property
+    def parent(self) -> Optional[FakeTextChannel]:
+        return self.guild.get_channel(self.parent_id)
+
+    async def edit(self, *, archived: bool = None, locked: bool = None, **_):
+        await _rest("edit_thread")
+        if archived is not None:
+            self.archived = archived
+        if locked is not None:
+            self.locked = locked
+        return self
+
+    async def fetch_members(self) -> List["FakeThreadMember"]:
+        await _rest("fetch_thread_members")
+        return [FakeThreadMember(member_id, self.id) for member_id in self.member_ids]
+
+    async def add_user(self, user: Any):
+        await _rest("add_thread_member")
+        self.member_ids.add(user.id)
+
+    async def remove_user(self, user: Any):
+        await _rest("remove_thread_member")
+        self.member_ids.discard(user.id)
+
+
+class FakeThreadMember:
+    def __init__(self, user_id: int, thread_id: int):
+        self.id: int = user_id
+        self.thread_id: int = thread_id
+
+
+class FakeGuild:
+    def __init__(self, client: "FakeBot", name: str = "guild"):
+        self.id: int = snowflake()
+        self.name: str = name
+        self.client: FakeBot = client
+        self.roles: List[FakeRole] = []
+        self.channels: Dict[int, FakeTextChannel] = {}
+        self.members: Dict[int, FakeMember] = {}
+        self.default_role: FakeRole = FakeRole("@everyone")
+        self.unavailable: bool = False
+
+    def __str__(self) -> str:
+        return self.name
+
+    def add_text_channel(self, name: str) -> FakeTextChannel:
+        channel = FakeTextChannel(self, name)
+        self.channels[channel.id] = self.client.channels[channel.id] = channel
+        return channel
+
+    def add_thread(self, parent: FakeTextChannel, name: str) -> FakeThread:
+        thread = FakeThread(self, parent, name)
+        self.channels[thread.id] = self.client.channels[thread.id] = thread
+        return thread
+
+    def add_role(self, name: str) -> FakeRole:
+        role = FakeRole(name)
+        self.roles.append(role)
+        return role
+
+    def add_member(self, name: str = "member") -> FakeMember:
+        member = FakeMember(self, name)
+        self.members[member.id] = member
+        return member
+
+    def get_member(self, member_id: int) -> Optional[FakeMember]:
+        return self.members.get(member_id)
+
+    async def fetch_member(self, member_id: int) -> FakeMember:
+        await _rest("fetch_member")
+        return self.members[member_id]
+
+    def get_channel(self, channel_id: int) -> Optional[FakeTextChannel]:
+        return self.channels.get(channel_id)
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return discord.utils.get(self.roles, id=role_id)
+
+
+class FakeBot:
+    """
+    Stand-in for `commands.Bot`. Only what the cogs use is implemented: channel,
+    guild and emoji caches, cog/command registration and readiness.
+    """
+
+    def __init__(self, bot_dir: str):
+        self.bot_dir: str = bot_dir
+        self.startup_report: StartupReport = StartupReport()
+        # Never throttles, since the fake REST calls don't return rate limit headers
+        self.rest_budget: RestBudget = RestBudget()
+        self.shard_id: Optional[int] = None
+        self.shard_store: Optional[Any] = None
+        # Set by `dispatch_ready`, like the gateway's READY
+        self._ready: bool = False
+        # Never started; the benchmarks run the jobs one at a time
+        self.scheduler: Scheduler = Scheduler()
+        self.user: FakeUser = FakeUser("bot")
+        self.owner: FakeUser = FakeUser("owner")
+        self.channels: Dict[int, FakeTextChannel] = {}
+        self._guilds: Dict[int, FakeGuild] = {}
+        self.emojis: List[Any] = []
+        self.cogs: Dict[str, Any] = {}
+        self.commands: Dict[str, Any] = {}
+
+    def add_guild(self, name: str = "guild") -> FakeGuild:
+        guild = FakeGuild(self, name)
+        self._guilds[guild.id] = guild
+        return guild
+
+    @property
+    def guilds(self) -> List[FakeGuild]:
+        return list(self._guilds.values())
+
+    def add_cog(self, cog: Any):
+        self.cogs[cog.qualified_name] = cog
+
+    def remove_cog(self, name: str) -> Optional[Any]:
+        cog: Optional[Any] = self.cogs.pop(name, None)
+        if cog is not None:
+            cog.cog_unload()
+        return cog
+
+    def get_cog(self, name: str) -> Optional[Any]:
+        return self.cogs.get(name)
+
+    def add_command(self, command: Any):
+        self.commands[command.name] = command
+
+    def remove_command(self, name: str):
+        return self.commands.pop(name, None)
+
+    def get_command(self, name: str):
+        return self.commands.get(name)
+
+    def is_ready(self) -> bool:
+        return self._ready
+
+    async def wait_until_ready(self):
+        return
+
+    async def is_owner(self, user: Any) -> bool:
+        return user.id == self.owner.id
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id: int):
+        await _rest("fetch_channel")
+        if channel_id not in self.channels:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), "Unknown Channel")
+        return self.channels[channel_id]
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return self._guilds.get(guild_id)
+
+    def get_emoji(self, emoji_id: int):
+        return discord.utils.get(self.emojis, id=emoji_id)
+
+    async def dispatch_ready(self):
+        """Fires the cogs' `on_ready` listeners, like the gateway would."""
+        self._ready = True
+        listeners = [
+            listener()
+            for cog in self.cogs.values()
+            for name, listener in cog.get_listeners()
+            if name == "on_ready"
+        ]
+        await asyncio.gather(*listeners)
+
+
+class FakeContext:
+    """Stand-in for `commands.Context`; replies are recorded rather than sent."""
+
+    def __init__(
+        self,
+        bot: FakeBot,
+        *,
+        author: Any,
+        guild: Optional[FakeGuild] = None,
+        channel: Optional[FakeTextChannel] = None,
+        content: str = "",
+    ):
+        self.bot: FakeBot = bot
+        self.author: Any = author
+        self.guild: Optional[FakeGuild] = guild
+        self.channel: Optional[FakeTextChannel] = channel
+        self.message: FakeMessage = FakeMessage(channel, content, author)
+        self.clean_prefix: str = "!"
+        self.invoked_with: Optional[str] = None
+        self.sent: List[Dict[str, Any]] = []
+
+    async def send(self, content: str = None, **kwargs) -> FakeMessage:
+        await _rest("send_message")
+        self.sent.append({"content": content, **kwargs})
+        return FakeMessage(self.channel, content or "")
+
+    reply = send
+
+
+class FakeConfirmationView:
+    """Stand-in for `ConfirmationView` that the invoking user confirms straight away."""
+
+    def __init__(self, invoking_user: Any, timeout: int = 60):
+        self.invoking_user: Any = invoking_user
+        self.interacted: bool = True
+        self.intr_continue: bool = True
+        self.followup_webhook: Any = None
+
+    async def wait(self):
+        return
+
+    def add_item(self, item: Any):
+        pass
+
+    def remove_item(self, item: Any):
+        pass
+
+
+class FakeEmoji:
+    """A reaction emoji, unicode unless an ID is given."""
+
+    def __init__(self, name: str, emoji_id: Optional[int] = None):
+        self.name: str = name
+        self.id: Optional[int] = emoji_id
+
+    def is_unicode_emoji(self) -> bool:
+        return self.id is None
+
+    def __str__(self) -> str:
+        return self.name if self.id is None else f"<:{self.name}:{self.id}>"
+
+
+class FakeReactionPayload:
+    """Stand-in for `discord.RawReactionActionEvent`."""
+
+    def __init__(self, *, message: FakeMessage, member: FakeMember, emoji: FakeEmoji):
+        self.message_id: int = message.id
+        self.channel_id: int = message.channel.id
+        self.guild_id: int = message.guild.id
+        self.user_id: int = member.id
+        self.member: FakeMember = member
+        self.emoji: FakeEmoji = emoji
+
+
+def make_bot_dir(root: str, repo_dir: str) -> str:
+    """Creates a bot directory with a copy of the assets the cogs read."""
+    assets_dir: str = os.path.join(root, "assets")
+    os.makedirs(assets_dir, exist_ok=True)
+    with open(os.path.join(repo_dir, "assets", "default_commands.json")) as src:
+        with open(os.path.join(assets_dir, "default_commands.json"), "w") as dst:
+            dst.write(src.read())
+    return root
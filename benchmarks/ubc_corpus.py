@@ -0,0 +1,164 @@
+"""
+Fixture corpus for the UBC course description scraper.
+
+`fixtures/ubc` holds hand-written department pages (with edge cases such as
+entities, suffixed course codes and courses mentioned in earlier blocks) and the
+expected results in `expected.json`. Large departments are generated
+deterministically so the corpus doesn't need megabytes of HTML checked in; the
+generated pages mirror the structure of the saved ones.
+"""
+import html
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+FIXTURES_DIR: str = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fixtures", "ubc"
+)
+
+# Expected records only cover the fields that come from the page itself
+EXPECTED_FIELDS: List[str] = [
+    "name",
+    "credits",
+    "prerequisites",
+    "corequisites",
+    "description",
+]
+
+# Rough sizes of the largest departments
+GENERATED_DEPARTMENTS: Dict[str, int] = {"MATH": 350, "CPSC": 250}
+
+_WORDS: List[str] = (
+    "analysis algebra systems design theory methods applications introduction "
+    "advanced topics linear differential equations probability statistics "
+    "numerical computation structures algorithms networks software hardware "
+    "models optimization graphs logic proofs signals control data"
+).split()
+
+_PAGE_HEADER: str = """<!DOCTYPE html>
+<html lang="en" dir="ltr">
+  <head>
+    <meta charset="utf-8" />
+    <title>{dept} | UBC Academic Calendar</title>
+    <link rel="stylesheet" media="all" href="/themes/custom/calendar/css/style.css" />
+  </head>
+  <body class="path-course-descriptions">
+    <header role="banner"><nav aria-label="Main"><ul class="menu">{menu}</ul></nav></header>
+    <main role="main">
+      <div class="region region-content">
+        <h1 class="page-title">{dept}</h1>
+        <div class="view-content">
+"""
+
+_PAGE_FOOTER: str = """        </div>
+      </div>
+    </main>
+    <footer role="contentinfo"><p>&copy; The University of British Columbia</p></footer>
+  </body>
+</html>
+"""
+
+_COURSE_BLOCK: str = """          <article class="node node--type-course">
+            <div class="clearfix text-formatted field field--name-body field--type-text-with-summary">
+              <h3 id="{anchor}">{title}</h3>
+              <p>{body}</p>
+            </div>
+          </article>
+"""
+
+
+def load_saved_pages() -> Dict[str, str]:
+    """Returns the saved pages keyed by their URL slug (eg. `cpenv`)."""
+    pages: Dict[str, str] = {}
+    for filename in sorted(os.listdir(FIXTURES_DIR)):
+        if filename.endswith(".html"):
+            with open(os.path.join(FIXTURES_DIR, filename), encoding="utf-8") as f:
+                pages[filename[: -len(".html")]] = f.read()
+    return pages
+
+
+def load_saved_expected() -> Dict[str, Optional[Dict[str, str]]]:
+    """Returns the expected records for the saved pages keyed by course (eg. `CPEN 211`)."""
+    with open(os.path.join(FIXTURES_DIR, "expected.json"), encoding="utf-8") as f:
+        by_department: Dict[str, Dict[str, Optional[Dict[str, str]]]] = json.load(f)
+    return {
+        course: expected
+        for courses in by_department.values()
+        for course, expected in courses.items()
+    }
+
+
+def _phrase(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(count))
+
+
+def generate_department_page(
+    dept: str, course_count: int, seed: int = 0
+) -> Tuple[str, Dict[str, Optional[Dict[str, str]]]]:
+    """Generates a department page and the expected record for every course on it."""
+    rng: random.Random = random.Random(f"{dept}-{seed}")
+    numbers: List[int] = sorted(rng.sample(range(100, 600), course_count))
+    expected: Dict[str, Optional[Dict[str, str]]] = {}
+    blocks: List[str] = []
+    for index, number in enumerate(numbers):
+        course: str = f"{dept} {number}"
+        credits: str = str(rng.choice([1, 2, 3, 4, 6]))
+        name: str = _phrase(rng, 3).title()
+        description: str = (
+            f"{_phrase(rng, rng.randint(15, 60)).capitalize()} & more. "
+            + f"[{rng.randint(1, 3)}-{rng.randint(0, 3)}-0]"
+        )
+        earlier: List[str] = [f"{dept} {n}" for n in numbers[:index] if n < number]
+        prerequisites: str = "None"
+        corequisites: str = "None"
+        body: str = html.escape(description, quote=False)
+        if earlier and rng.random() < 0.7:
+            prerequisites = (
+                "One of " + ", ".join(rng.sample(earlier, min(3, len(earlier)))) + "."
+            )
+            body += f"<br /><em>Prerequisite: {prerequisites}</em>"
+        if earlier and rng.random() < 0.2:
+            corequisites = rng.choice(earlier) + "."
+            body += f" <em>Corequisite: {corequisites}</em>"
+        if rng.random() < 0.1:
+            body += "<br />This course is not eligible for Credit/D/Fail grading."
+        blocks.append(
+            _COURSE_BLOCK.format(
+                anchor=f"{dept.lower()}-{number}",
+                title=f"{course} ({credits}) {name}",
+                body=body,
+            )
+        )
+        expected[course] = {
+            "name": f"{course} {name}",
+            "credits": credits,
+            "prerequisites": prerequisites,
+            "corequisites": corequisites,
+            "description": description,
+        }
+    # A course that isn't on the page
+    expected[f"{dept} 999"] = None
+
+    # Real pages carry a large navigation menu before the content
+    menu: str = "".join(
+        f'<li><a href="/course-descriptions/subject/{_phrase(rng, 1)}v">{_phrase(rng, 2)}</a></li>'
+        for _ in range(400)
+    )
+    page: str = (
+        _PAGE_HEADER.format(dept=dept, menu=menu) + "".join(blocks) + _PAGE_FOOTER
+    )
+    return page, expected
+
+
+def load_corpus(
+    departments: Dict[str, int] = GENERATED_DEPARTMENTS,
+) -> Tuple[Dict[str, str], Dict[str, Optional[Dict[str, str]]]]:
+    """Returns all pages keyed by URL slug, and all expected records keyed by course."""
+    pages: Dict[str, str] = load_saved_pages()
+    expected: Dict[str, Optional[Dict[str, str]]] = load_saved_expected()
+    for dept, course_count in departments.items():
+        page, page_expected = generate_department_page(dept, course_count)
+        pages[f"{dept.lower()}v"] = page
+        expected.update(page_expected)
+    return pages, expected
@@ -1,32 +1,145 @@
 """
 Client for the ECESS server
 Please ensure `secrets/token.txt` contains the bot's token.
+Run with `--shards N` to run N shards, each in its own process (see `utils.Sharding`),
+or with `--auto-shard` to run all the shards Discord recommends in this process.
+`--cache-profile` picks how much discord.py caches (see `utils.CacheProfile`).
 """
+import argparse
+import asyncio
 import discord
 import os
+import sys
+import time
 import traceback
 import logging
+from typing import List, Optional
 from discord.ext import commands
 
+from utils.CacheProfile import CACHE_PROFILES, DEFAULT_CACHE_PROFILE
 from utils.FancyHelp import FancyHelp
+from utils.Lifecycle import Lifecycle, ShuttingDown
+from utils.LogPipeline import LOG_FILENAME, setup_logging
+from utils.Metrics import discord_http_trace
+from utils.Paginator import Paginator
+from utils.Profiler import DEFAULT_SLOW_CALLBACK_MS, DEFAULT_STALL_MS, EventLoopProfiler
+from utils.RestBudget import RestBudget
+from utils.Scheduler import Job, Scheduler
+from utils.Sharding import (
+    SHARD_LOG_FILENAME,
+    SUPERVISOR_LOG_FILENAME,
+    ShardStore,
+    ShardSupervisor,
+    send_heartbeats,
+)
+from utils.Startup import (
+    SETUP_PHASE,
+    DeferredStateCog,
+    StartupReport,
+    StateNotLoaded,
+)
+
+# Longer command messages (eg. code for `!repl`) are truncated in the log
+MAX_LOGGED_CONTENT_LENGTH: int = 200
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Runs the ECESS bot.")
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument(
+        "--shards",
+        type=int,
+        help="Run this many shards, each in its own process, under a supervisor",
+    )
+    # Per-guild state is loaded for the guilds each shard brings up (see
+    # `GuildStateCog`)
+    sharding.add_argument(
+        "--auto-shard",
+        action="store_true",
+        help="Run one gateway shard per ~1000 guilds in this process, as Discord "
+        "recommends",
+    )
+    parser.add_argument(
+        "--cache-profile",
+        choices=sorted(CACHE_PROFILES),
+        default=DEFAULT_CACHE_PROFILE,
+        help="How much of the guilds' members and messages to keep in memory",
+    )
+    # Passed to the shard processes by the supervisor
+    parser.add_argument("--shard-id", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--shard-count", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def supervise(shard_count: int, cache_profile: str):
+    """Runs the shard processes until the supervisor is stopped."""
+    log_listener = setup_logging(SUPERVISOR_LOG_FILENAME)
+
+    def shard_command(shard_id: int) -> List[str]:
+        return [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--shard-id",
+            str(shard_id),
+            "--shard-count",
+            str(shard_count),
+            "--cache-profile",
+            cache_profile,
+        ]
+
+    try:
+        ShardSupervisor(shard_count, shard_command, ShardStore()).run()
+    finally:
+        log_listener.stop()
 
 
 def main():
-    logging.basicConfig(
-        format="(%(levelname)s) [%(asctime)s] %(message)s",
-        level=logging.INFO,
-        filename="bot_info.log",
-        filemode="a",
+    args = parse_args()
+    if args.shards is not None:
+        return supervise(args.shards, args.cache_profile)
+    is_shard: bool = args.shard_id is not None
+
+    # Log records are written to `bot_info.log` (one file per shard process) by a
+    # background thread
+    log_listener = setup_logging(
+        SHARD_LOG_FILENAME.format(shard_id=args.shard_id) if is_shard else LOG_FILENAME
     )
 
     # Enable privileged intents
-    # Certain methods (eg. `guild.get_members`) require privileged intents
+    # Certain methods (eg. `guild.get_members`) require privileged intents; the
+    # cache profile decides how many members are kept (see `utils.CacheProfile`)
     intents = discord.Intents.default()
     intents.members = True
+    client_options = CACHE_PROFILES[args.cache_profile].client_options(intents)
 
-    # Initialize the client
-    client = commands.Bot(intents=intents, command_prefix="!")
+    # Initialize the client; REST requests are counted per route (see `Stats`), and
+    # their rate limit headers feed the budget that background jobs throttle on
+    http_trace = discord_http_trace()
+    rest_budget = RestBudget()
+    rest_budget.attach(http_trace)
+    if is_shard:
+        # Shard processes run the one shard they were given
+        client = commands.Bot(
+            command_prefix="!",
+            http_trace=http_trace,
+            shard_id=args.shard_id,
+            shard_count=args.shard_count,
+            **client_options,
+        )
+    else:
+        bot_class = commands.AutoShardedBot if args.auto_shard else commands.Bot
+        client = bot_class(command_prefix="!", http_trace=http_trace, **client_options)
+    # Shared with the supervisor and the other shard processes
+    client.shard_store = ShardStore() if is_shard else None
+    client.rest_budget = rest_budget
     client.bot_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    client.startup_report = StartupReport()
+    client.profiler = EventLoopProfiler(client)
+    # Cogs add their background jobs as they load their state
+    client.scheduler = Scheduler()
+    # Stops the bot gracefully on SIGTERM; commands are refused meanwhile
+    client.lifecycle = Lifecycle(client)
+    client.add_check(client.lifecycle.check)
 
     @client.event
     async def on_ready():
@@ -35,11 +148,38 @@ def main():
         Primarily for debugging purposes
         """
         logging.info("Bot is ready!")
+        if client.startup_report.ready_at is not None:
+            return
+        client.startup_report.mark_ready()
+        client.scheduler.start()
+        if client.shard_store is not None:
+            asyncio.ensure_future(send_heartbeats(client, client.shard_store))
+
+        # Cogs load their state in the background once we're ready; report
+        # the startup timings after they're all done
+        await asyncio.gather(
+            *[
+                cog.wait_for_state()
+                for cog in client.cogs.values()
+                if isinstance(cog, DeferredStateCog)
+            ],
+            # Failures were logged by the cogs
+            return_exceptions=True,
+        )
+        for line in client.startup_report.format():
+            logging.info(f"Startup timing: {line}")
 
     @client.event
     async def on_command_error(ctx, error):
         if isinstance(error, commands.errors.CommandNotFound):
             pass
+        elif isinstance(error, ShuttingDown):
+            await ctx.send("The bot is restarting. Try again in a minute.")
+        elif isinstance(error, StateNotLoaded):
+            await ctx.send(
+                "This command is unavailable since its data couldn't be loaded. "
+                "Ask the owner to check the logs."
+            )
         elif isinstance(error, commands.errors.CommandOnCooldown):
             await ctx.send("This command is on cooldown.")
         elif isinstance(error, commands.errors.CheckFailure):
@@ -83,22 +223,161 @@ def main():
         """
         client.unload_extension(f"cogs.{extension}")
 
+    @client.group()
+    @commands.is_owner()
+    async def profile(ctx: commands.Context):
+        """
+        Profile the event loop to find out what's stalling the bot.
+        """
+        if ctx.invoked_subcommand is None:
+            raise commands.errors.BadArgument
+
+    @profile.command(name="start")
+    async def profile_start(
+        ctx: commands.Context,
+        slow_callback_ms: int = DEFAULT_SLOW_CALLBACK_MS,
+        stall_ms: int = DEFAULT_STALL_MS,
+    ):
+        """
+        Starts profiling. Callbacks that block the event loop for longer than
+        `slow_callback_ms` are recorded, and the loop's stack is sampled whenever it's
+        been stalled for longer than `stall_ms`. Listeners and scheduled jobs are timed.
+
+        **Example(s)**
+          `[p]profile start` - starts profiling with the default thresholds
+          `[p]profile start 50 200` - reports callbacks over 50ms, samples stalls over 200ms
+        """
+        if client.profiler.running:
+            return await ctx.send("The profiler is already running.")
+        client.profiler.start(slow_callback_ms, stall_ms)
+        await ctx.send("Profiling started. Use `!profile stop` to see the results.")
+
+    @profile.command(name="stop")
+    async def profile_stop(ctx: commands.Context):
+        """
+        Stops profiling and shows the top offenders.
+
+        **Example(s)**
+          `[p]profile stop` - stops profiling and shows the report
+        """
+        if not client.profiler.running:
+            return await ctx.send("The profiler isn't running.")
+        await Paginator(
+            title="Profile", entries=client.profiler.stop(), entries_per_page=8
+        ).paginate(ctx)
+
+    @client.group()
+    @commands.is_owner()
+    async def jobs(ctx: commands.Context):
+        """
+        Manage the scheduled background jobs (eg. the thread refreshers).
+        """
+        if ctx.invoked_subcommand is None:
+            raise commands.errors.BadArgument
+
+    @jobs.command(name="list")
+    async def jobs_list(ctx: commands.Context):
+        """
+        Lists the jobs with their schedules, runs and next run.
+
+        **Example(s)**
+          `[p]jobs list` - lists every job
+        """
+        now: float = time.time()
+        await Paginator(
+            title="Jobs",
+            entries=[
+                f"**{job.name}** ({job.trigger}): {job.runs} runs, "
+                f"{job.skipped} skipped, "
+                + (
+                    "paused"
+                    if job.paused
+                    else f"next in {max(0.0, job.next_run_at - now):.0f}s"
+                )
+                + (" (running)" if job.running is not None else "")
+                + (f"\nLast error: `{job.last_error}`" if job.last_error else "")
+                for job in client.scheduler.jobs()
+            ]
+            or ["No jobs."],
+        ).paginate(ctx)
+
+    async def _find_job(ctx: commands.Context, name: str) -> Optional[Job]:
+        job: Optional[Job] = client.scheduler.get_job(name)
+        if job is None:
+            await ctx.send(f"There's no job named `{name}`. See `!jobs list`.")
+        return job
+
+    @jobs.command(name="pause")
+    async def jobs_pause(ctx: commands.Context, name: str):
+        """
+        Stops running a job until it's resumed; a run in progress finishes.
+
+        **Example(s)**
+          `[p]jobs pause course_threads.refresh` - stops unarchiving course threads
+        """
+        if await _find_job(ctx, name) is not None:
+            client.scheduler.pause(name)
+            await ctx.send(f"Paused `{name}`.")
+
+    @jobs.command(name="resume")
+    async def jobs_resume(ctx: commands.Context, name: str):
+        """
+        Resumes a paused job from its next scheduled time.
+
+        **Example(s)**
+          `[p]jobs resume course_threads.refresh` - unarchives course threads again
+        """
+        if await _find_job(ctx, name) is not None:
+            client.scheduler.resume(name)
+            await ctx.send(f"Resumed `{name}`.")
+
+    @jobs.command(name="run")
+    async def jobs_run(ctx: commands.Context, name: str):
+        """
+        Runs a job now, out of its schedule, unless it's already running.
+
+        **Example(s)**
+          `[p]jobs run prereq.catalogue_refresh` - refreshes the course catalogue now
+        """
+        if await _find_job(ctx, name) is None:
+            return
+        if client.scheduler.run_now(name):
+            await ctx.send(f"Started `{name}`.")
+        else:
+            await ctx.send(f"`{name}` is already running.")
+
     @client.before_invoke
     async def before_command_invoke(ctx: commands.Context):
         """
         Command logging.
         """
+        # Commands in progress get to finish if the bot is stopped
+        client.lifecycle.track(asyncio.current_task())
+        content: str = ctx.message.content
+        if len(content) > MAX_LOGGED_CONTENT_LENGTH:
+            content = content[:MAX_LOGGED_CONTENT_LENGTH] + "..."
         logging.info(
-            f"Command invoked: {ctx.command} by {ctx.author} with message {ctx.message.content}"
+            "Command invoked: %s by %s",
+            ctx.command,
+            ctx.author,
+            extra={
+                "command": ctx.command.qualified_name,
+                "author_id": ctx.author.id,
+                "guild_id": ctx.guild.id if ctx.guild else None,
+                "content": content,
+            },
         )
 
     # Parent directory of the bot repo; constructed as parentDir(fileDir(file))
     bot_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
     # Load extensions inside of `cogs` directory
-    for filename in os.listdir(os.path.join(bot_dir, "src/cogs")):
+    # Cogs defer reading their state until the bot is ready, so this only covers
+    # importing the module and registering the commands
+    for filename in sorted(os.listdir(os.path.join(bot_dir, "src/cogs"))):
         if filename.endswith(".py"):
-            client.load_extension(f"cogs.{filename[:-3]}")
+            with client.startup_report.measure(filename[:-3], SETUP_PHASE):
+                client.load_extension(f"cogs.{filename[:-3]}")
 
     # Read the bot token within `secrets`
     token_file = open(os.path.join(bot_dir, "src/secrets/token.txt"))
@@ -107,8 +386,22 @@ def main():
     # Inject a custom help
     client.help_command = FancyHelp()
 
+    async def run_client():
+        # Installed before connecting so that a signal during startup or a reconnect
+        # also stops the bot gracefully; `client.run` would install its own, which
+        # stop the loop without persisting anything
+        client.lifecycle.install_signal_handlers()
+        try:
+            await client.start(token)
+        finally:
+            if not client.is_closed():
+                await client.close()
+
     # Run the client
-    client.run(token)
+    try:
+        asyncio.get_event_loop().run_until_complete(run_client())
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -1,18 +1,40 @@
 import asyncio
 import logging
-from typing import Dict, Any, Optional, Set, Tuple, Union, List
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 import discord
-from io import BytesIO
-from discord.ext import commands, tasks
+from discord.ext import commands
 from utils.Components import ConfirmationView
-from utils.UBCCourseInfo import scrape_course_info
+from utils.UBCCourseInfo import scrape_departments
 from utils.Converters import Course
-from utils.JsonTools import read_json, write_json
+from utils.CacheProfile import get_or_fetch_member
+from utils.IcsParser import (
+    MAX_ICS_BYTES,
+    IcsError,
+    IcsTooLargeError,
+    read_attachment_courses,
+)
+from utils.GuildState import GuildStateCog, GuildStateStore
+from utils.KeyedLocks import KeyedLocks
+from utils.Metrics import COURSE_LOOKUPS
 from utils.Checks import ban_members_check
 from utils.Paginator import Paginator
+from utils.Scheduler import IntervalTrigger
+from utils.ThreadMembers import ThreadMembershipCache
 
 """
-The JSON schema of this file should be:
+Each guild has its own file (see `GuildStateStore`). The JSON schema of this file
+should be:
 {
     "<year_level: str>": {
         "base_channel": <channel_id: int>,
@@ -29,23 +51,167 @@ CURRENT_COURSES_KEY: str = "current_courses"
 BASE_CHANNEL_KEY: str = "base_channel"
 
 AUTO_ARCHIVE_DURATION: int = 1440
+# How often archived course threads are looked for (see `_refresh_threads`)
+REFRESH_INTERVAL: float = 1.0
+REFRESH_JOB: str = "course_threads.refresh"
 
-ICS_PARSING_PREFIX: str = "SUMMARY:"
 MAX_COURSES_PER_ICS: int = 15
 
+MAX_MESSAGE_LENGTH: int = 2000
 
-class CourseThreads(commands.Cog):
+# Thread member adds that `import` runs at the same time
+MEMBER_ADD_CONCURRENCY: int = 5
+# Threads whose member lists are loaded at the same time on startup
+MEMBER_LOAD_CONCURRENCY: int = 2
+
+# Base channels that `bulk_create` creates threads in at the same time
+BULK_CREATE_WORKERS: int = 4
+BULK_CREATE_RETRIES: int = 3
+BULK_CREATE_BACKOFF: float = 2.0
+BULK_CREATE_PROGRESS_INTERVAL: float = 5.0
+
+
+class CourseThreads(GuildStateCog):
     """
     Cog for course threads. Note that this entire cog is built upon the idea that
     all threads will be immutable and persistent -- that is, we do not expect threads
     to be deleted; hence, the bot metadata is append-only.
+    This cog is multi-tenant; each guild registers its own base channels.
     """
 
     def __init__(self, client: commands.Bot):
-        self.client: commands.Bot = client
-        self.course_mappings: Dict[str, Any] = read_json(THREADS_CONFIG_FILENAME)
-        self.course_modification_lock = asyncio.Lock()
-        self.thread_refresher_task.start()
+        super().__init__(client)
+        # Guild ID -> year level -> metadata; only the loaded guilds are in memory
+        self.course_mappings: GuildStateStore = GuildStateStore(THREADS_CONFIG_FILENAME)
+        self.guild_stores = [self.course_mappings]
+        # Registering a year level takes its lock exclusively, while course operations
+        # share it and take the course's own lock; see `_course_lock`
+        self.year_level_locks: KeyedLocks = KeyedLocks()
+        self.course_locks: KeyedLocks = KeyedLocks()
+        # Fed by the thread member events; see `_prime_thread_members`
+        self.thread_members: ThreadMembershipCache = ThreadMembershipCache()
+        # Guilds whose thread members have all been loaded
+        self.thread_members_loaded: Set[int] = set()
+        self._thread_member_loaders: Dict[int, asyncio.Future] = {}
+
+    async def load_state(self):
+        await super().load_state()
+        self.client.scheduler.add_job(
+            REFRESH_JOB, self._refresh_threads, IntervalTrigger(REFRESH_INTERVAL)
+        )
+
+    def cog_unload(self):
+        self.client.scheduler.remove_job(REFRESH_JOB)
+        super().cog_unload()
+
+    async def shutdown(self):
+        # Thread member lists are fetched again on startup
+        for loader in self._thread_member_loaders.values():
+            loader.cancel()
+
+    async def migrate_legacy_state(self):
+        await asyncio.get_event_loop().run_in_executor(
+            None,
+            self.course_mappings.migrate_legacy,
+            THREADS_CONFIG_FILENAME,
+            self._split_legacy_mappings,
+        )
+
+    def _split_legacy_mappings(
+        self, mappings: Dict[str, Any]
+    ) -> Dict[Optional[int], Dict[str, Any]]:
+        # Year levels belong to the guild of their base channel
+        payloads: Dict[Optional[int], Dict[str, Any]] = {}
+        for year_level, year_metadata in mappings.items():
+            base_channel: Optional[discord.TextChannel] = self.client.get_channel(
+                year_metadata[BASE_CHANNEL_KEY]
+            )
+            guild_id: Optional[int] = (
+                base_channel.guild.id if base_channel is not None else None
+            )
+            payloads.setdefault(guild_id, {})[year_level] = year_metadata
+        return payloads
+
+    async def guild_state_loaded(self, guild_id: int):
+        self._thread_member_loaders[guild_id] = asyncio.ensure_future(
+            self._prime_thread_members(guild_id)
+        )
+
+    async def guild_state_unloaded(self, guild_id: int):
+        loader: Optional[asyncio.Future] = self._thread_member_loaders.pop(
+            guild_id, None
+        )
+        if loader is not None:
+            loader.cancel()
+        self.thread_members_loaded.discard(guild_id)
+        for year_metadata in self.course_mappings[guild_id].values():
+            for thread_id in year_metadata[CURRENT_COURSES_KEY].values():
+                self.thread_members.forget(thread_id)
+
+    async def _prime_thread(self, thread: discord.Thread) -> None:
+        members: List[discord.ThreadMember] = await thread.fetch_members()
+        self.thread_members.prime(thread.id, [member.id for member in members])
+
+    async def _prime_thread_members(self, guild_id: int):
+        """
+        Loads the initial member list of every course thread of the guild in the
+        background, a few threads at a time; after that the gateway events keep the
+        cache current.
+        """
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(MEMBER_LOAD_CONCURRENCY)
+
+        async def prime(thread_id: int):
+            async with semaphore:
+                if self.thread_members.is_primed(thread_id):
+                    return
+                try:
+                    thread: Optional[discord.Thread] = self.client.get_channel(
+                        thread_id
+                    )
+                    if thread is None:
+                        async with self.client.rest_budget.throttle(
+                            "GET", f"/channels/{thread_id}"
+                        ):
+                            thread = await self.client.fetch_channel(thread_id)
+                    async with self.client.rest_budget.throttle(
+                        "GET", f"/channels/{thread_id}/thread-members"
+                    ):
+                        await self._prime_thread(thread)
+                except discord.HTTPException as e:
+                    logging.warning(f"Failed to load members of {thread_id}: {e}")
+
+        await asyncio.gather(
+            *[
+                prime(thread_id)
+                for year_metadata in self.course_mappings[guild_id].values()
+                for thread_id in year_metadata[CURRENT_COURSES_KEY].values()
+            ]
+        )
+        self.thread_members_loaded.add(guild_id)
+        self._thread_member_loaders.pop(guild_id, None)
+
+    async def _is_thread_member(
+        self, thread: discord.Thread, user: discord.abc.User
+    ) -> Optional[bool]:
+        """Membership from the cache, loading the thread's members if needed."""
+        if not self.thread_members.is_primed(thread.id):
+            try:
+                await self._prime_thread(thread)
+            except discord.HTTPException as e:
+                logging.warning(f"Failed to load members of {thread.name}: {e}")
+        return self.thread_members.is_member(thread.id, user.id)
+
+    @commands.Cog.listener()
+    async def on_thread_member_join(self, member: discord.ThreadMember):
+        self.thread_members.add(member.thread_id, member.id)
+
+    @commands.Cog.listener()
+    async def on_thread_member_remove(self, member: discord.ThreadMember):
+        self.thread_members.remove(member.thread_id, member.id)
+
+    @commands.Cog.listener()
+    async def on_thread_delete(self, thread: discord.Thread):
+        self.thread_members.forget(thread.id)
 
     @commands.group(aliases=["ct"])
     @commands.guild_only()
@@ -70,15 +236,16 @@ class CourseThreads(commands.Cog):
         **Example(s)**
           `[p]ct register 1 #some-channel` - registers #some-channel as the base thread for all 1xx level courses
         """
-        async with self.course_modification_lock:
+        course_mappings: Dict[str, Any] = self.course_mappings[ctx.guild.id]
+        async with self.year_level_locks.exclusive((ctx.guild.id, year_level)):
             try:
                 int(year_level)
             except ValueError:
                 return await ctx.reply(
                     f"`{year_level}` isn't a valid integer. This should map to the first digit of the course code."
                 )
-            if year_level in self.course_mappings and len(
-                self.course_mappings[year_level][CURRENT_COURSES_KEY]
+            if year_level in course_mappings and len(
+                course_mappings[year_level][CURRENT_COURSES_KEY]
             ):
                 return await ctx.reply(
                     "There are already courses mapped to this year level; changing this is destructive, thus is manual. Exiting."
@@ -91,11 +258,11 @@ class CourseThreads(commands.Cog):
                 send_messages_in_threads=True,
                 manage_threads=False,
             )
-            self.course_mappings[year_level] = {
+            course_mappings[year_level] = {
                 BASE_CHANNEL_KEY: channel.id,
                 CURRENT_COURSES_KEY: {},
             }
-            write_json(THREADS_CONFIG_FILENAME, self.course_mappings)
+            self.course_mappings.write(ctx.guild.id)
             return await ctx.reply(
                 f"Done! Added {channel.mention} as the base for year level: `{year_level}`."
             )
@@ -110,12 +277,202 @@ class CourseThreads(commands.Cog):
         **Example(s)**
           `[p]ct create CPEN331` - creates a new thread for CPEN331
         """
-        async with self.course_modification_lock:
+        async with self._course_lock(ctx.guild.id, course):
             create_result: Tuple[
                 Optional[str], Optional[discord.Thread]
-            ] = await self._create_course_thread(course)
+            ] = await self._create_course_thread(ctx.guild.id, course)
             return await ctx.reply(create_result[0])
 
+    @course_threads.command(name="bulk_create", aliases=["bulk"])
+    @commands.guild_only()
+    @commands.check(ban_members_check)
+    async def bulk_create_threads(self, ctx: commands.Context, *, courses: str = ""):
+        """
+        Creates threads for many courses at once, eg. at the start of a term. Courses can be
+        listed in the message and/or attached as a text or `.ics` file. All courses are
+        validated up front, threads are created a few base channels at a time, and the
+        mappings are saved once at the end.
+
+        **Example(s)**
+          `[p]ct bulk_create CPEN211 CPEN221 ELEC201` - creates threads for the three courses
+          `[p]ct bulk_create` (with attachment) - creates threads for the attached courses
+        """
+        requested_courses: List[Course] = Course.find_all(courses)
+        for attachment in ctx.message.attachments:
+            try:
+                requested_courses += await self._read_course_list(attachment)
+            except IcsTooLargeError:
+                return await ctx.reply(
+                    f"The file is too large. Course lists are at most {MAX_ICS_BYTES // 1024} KiB."
+                )
+            except IcsError:
+                return await ctx.reply(
+                    "Failed to parse the file. Is it an `.ics` or text file?"
+                )
+        requested_courses = list(dict.fromkeys(requested_courses))
+        if not requested_courses:
+            return await ctx.reply("No courses found.")
+
+        guild_id: int = ctx.guild.id
+        course_mappings: Dict[str, Any] = self.course_mappings[guild_id]
+        existing_courses: List[Course] = []
+        unregistered_courses: List[Course] = []
+        new_courses: List[Course] = []
+        for course in requested_courses:
+            if self._does_course_exist(guild_id, course)[1]:
+                existing_courses.append(course)
+            elif course.year_level not in course_mappings:
+                unregistered_courses.append(course)
+            else:
+                new_courses.append(course)
+        valid_courses, invalid_courses = await self._validate_courses(
+            guild_id, new_courses
+        )
+        courses_to_create: List[Course] = [
+            course for course in new_courses if course in valid_courses
+        ]
+
+        def course_list(courses: Iterable[Course]) -> str:
+            return ", ".join(f"`{course}`" for course in courses) or "`None`"
+
+        summary: str = (
+            f"**Threads to create ({len(courses_to_create)})**\n"
+            + course_list(courses_to_create)
+            + f"\n**Already exist ({len(existing_courses)})**\n"
+            + course_list(existing_courses)
+            + f"\n**No base channel for the year level ({len(unregistered_courses)})**\n"
+            + course_list(unregistered_courses)
+            + f"\n**Not found in UBC's course schedule ({len(invalid_courses)})**\n"
+            + course_list(sorted(invalid_courses))
+        )
+        if not courses_to_create:
+            return await ctx.reply(summary[:MAX_MESSAGE_LENGTH])
+
+        confirmation_view: ConfirmationView = ConfirmationView(ctx.author)
+        status_message: discord.Message = await ctx.reply(
+            summary[:MAX_MESSAGE_LENGTH], view=confirmation_view
+        )
+        await confirmation_view.wait()
+        if not confirmation_view.interacted:
+            return await status_message.edit(
+                content="Timed out. Cancelling.", view=confirmation_view
+            )
+        if not confirmation_view.intr_continue:
+            return await status_message.edit(
+                content="Interaction cancelled.", view=confirmation_view
+            )
+
+        created_courses: List[Course] = []
+        failed_courses: List[Course] = []
+
+        def progress() -> str:
+            return (
+                f"Created {len(created_courses)} of {len(courses_to_create)} threads"
+                + (f" ({len(failed_courses)} failed)" if failed_courses else "")
+                + "..."
+            )
+
+        async def create_with_retries(course: Course) -> bool:
+            base_message: Optional[discord.Message] = None
+            base_channel_id: int = course_mappings[course.year_level][BASE_CHANNEL_KEY]
+            for attempt in range(BULK_CREATE_RETRIES):
+                try:
+                    # Don't resend the base message if only the thread failed
+                    if base_message is None:
+                        async with self.client.rest_budget.throttle(
+                            "POST", f"/channels/{base_channel_id}/messages"
+                        ):
+                            base_message = await self._send_base_message(
+                                guild_id, course
+                            )
+                    async with self.client.rest_budget.throttle(
+                        "POST",
+                        f"/channels/{base_message.channel.id}/messages"
+                        f"/{base_message.id}/threads",
+                    ):
+                        await self._start_course_thread(guild_id, course, base_message)
+                    return True
+                except discord.HTTPException as e:
+                    logging.warning(
+                        f"Failed to create a thread for {course} (attempt {attempt + 1}): {e}"
+                    )
+                    # Client errors other than rate limits won't succeed on a retry
+                    if e.status < 500 and e.status != 429:
+                        return False
+                    await asyncio.sleep(BULK_CREATE_BACKOFF * 2 ** attempt)
+            return False
+
+        # Message and thread creation are rate limited per channel, so courses that
+        # share a base channel are created one after another, and the base channels
+        # are worked through in parallel
+        workers: asyncio.Semaphore = asyncio.Semaphore(BULK_CREATE_WORKERS)
+
+        async def create_for_base_channel(courses: List[Course]):
+            async with workers:
+                for course in courses:
+                    async with self._course_lock(guild_id, course):
+                        # Someone may have created it while we were waiting
+                        if self._does_course_exist(guild_id, course)[1]:
+                            continue
+                        if await create_with_retries(course):
+                            created_courses.append(course)
+                        else:
+                            failed_courses.append(course)
+
+        async def report_progress():
+            while True:
+                await asyncio.sleep(BULK_CREATE_PROGRESS_INTERVAL)
+                await status_message.edit(content=progress(), view=None)
+
+        by_year_level: Dict[str, List[Course]] = {}
+        for course in courses_to_create:
+            by_year_level.setdefault(course.year_level, []).append(course)
+        await status_message.edit(content=progress(), view=None)
+        reporter: asyncio.Task = asyncio.ensure_future(report_progress())
+        try:
+            await asyncio.gather(
+                *[
+                    create_for_base_channel(year_courses)
+                    for year_courses in by_year_level.values()
+                ]
+            )
+        finally:
+            reporter.cancel()
+            # All of the new mappings are saved at once
+            self.course_mappings.write(guild_id)
+
+        logging.info(
+            f"Bulk created {len(created_courses)} threads, {len(failed_courses)} failed"
+        )
+        await status_message.edit(
+            content=(
+                f"Done! Created {len(created_courses)} threads."
+                + (
+                    f"\n**Failed ({len(failed_courses)})**\n"
+                    + course_list(failed_courses)
+                    + "\nThis is likely a bot error -- try these again later."
+                    if failed_courses
+                    else ""
+                )
+            )[:MAX_MESSAGE_LENGTH],
+            view=None,
+        )
+
+    @staticmethod
+    async def _read_course_list(attachment: discord.Attachment) -> List[Course]:
+        """Reads the courses from an `.ics` file, or any course codes in a text file."""
+        if attachment.filename.lower().endswith(".ics"):
+            return [
+                course
+                for course in map(
+                    Course.parse, await read_attachment_courses(attachment)
+                )
+                if course is not None
+            ]
+        if attachment.size > MAX_ICS_BYTES:
+            raise IcsTooLargeError(f"The file is larger than {MAX_ICS_BYTES} bytes.")
+        return Course.find_all((await attachment.read()).decode("utf-8", "replace"))
+
     @course_threads.command(aliases=["delete", "del"])
     @commands.guild_only()
     @commands.check(ban_members_check)
@@ -126,68 +483,134 @@ class CourseThreads(commands.Cog):
         **Example(s)**
           `[p]ct delete CPEN331` - removes the thread mapping for CPEN331 and locks the thread
         """
-        async with self.course_modification_lock:
-            pre_check: Tuple[str, bool] = self._does_course_exist(course)
+        async with self._course_lock(ctx.guild.id, course):
+            pre_check: Tuple[str, bool] = self._does_course_exist(ctx.guild.id, course)
             if not pre_check[1]:
                 return await ctx.reply(pre_check[0])
+            current_courses: Dict[str, int] = self.course_mappings[ctx.guild.id][
+                course.year_level
+            ][CURRENT_COURSES_KEY]
             course_thread: discord.Thread = self.client.get_channel(
-                self.course_mappings[course.year_level][CURRENT_COURSES_KEY][
-                    str(course)
-                ]
+                current_courses[str(course)]
             )
             await course_thread.edit(locked=True, archived=True)
-            del self.course_mappings[course.year_level][CURRENT_COURSES_KEY][
-                str(course)
-            ]
-            write_json(THREADS_CONFIG_FILENAME, self.course_mappings)
+            del current_courses[str(course)]
+            self.course_mappings.write(ctx.guild.id)
             await ctx.send(
                 f"Done! Locked {course_thread.mention} and removed the mapping."
             )
 
-    def _does_course_exist(self, course: Course) -> Tuple[str, bool]:
+    @asynccontextmanager
+    async def _course_lock(self, guild_id: int, course: Course) -> AsyncIterator[None]:
+        """
+        Makes operations on a guild's course atomic. Courses in different year levels
+        or guilds, and different courses in the same year level, don't wait on each
+        other; only registering the course's year level in the guild does.
+        """
+        async with self.year_level_locks.shared((guild_id, course.year_level)):
+            async with self.course_locks.exclusive((guild_id, str(course))):
+                yield
+
+    def _does_course_exist(self, guild_id: int, course: Course) -> Tuple[str, bool]:
+        course_mappings: Dict[str, Any] = self.course_mappings.get(guild_id) or {}
         if (
-            course.year_level in self.course_mappings
-            and str(course)
-            in self.course_mappings[course.year_level][CURRENT_COURSES_KEY]
+            course.year_level in course_mappings
+            and str(course) in course_mappings[course.year_level][CURRENT_COURSES_KEY]
         ):
             return ("", True)
         else:
             return (f"A thread for `{course}` doesn't exist.", False)
 
-    async def _get_course_thread(self, course: Course) -> discord.Thread:
-        thread_id: int = self.course_mappings[course.year_level][CURRENT_COURSES_KEY][
-            str(course)
-        ]
+    async def _get_course_thread(self, guild_id: int, course: Course) -> discord.Thread:
+        thread_id: int = self.course_mappings[guild_id][course.year_level][
+            CURRENT_COURSES_KEY
+        ][str(course)]
         thread: Optional[discord.Thread] = self.client.get_channel(thread_id)
         if thread is None:
             thread = await self.client.fetch_channel(thread_id)
         return thread
 
     async def _create_course_thread(
-        self, course: Course
+        self, guild_id: int, course: Course
     ) -> Tuple[str, Optional[discord.Thread]]:
-        if course.year_level not in self.course_mappings:
+        course_mappings: Dict[str, Any] = self.course_mappings[guild_id]
+        if course.year_level not in course_mappings:
             return (
                 f"Base channel for year level (`{course.year_level}`) doesn't exist. Initialize it with `register_base_channel`.",
                 None,
             )
 
-        if str(course) in self.course_mappings[course.year_level][CURRENT_COURSES_KEY]:
+        if str(course) in course_mappings[course.year_level][CURRENT_COURSES_KEY]:
             return (f"Course `{course}` already exists.", None)
 
-        base_channel_id: int = self.course_mappings[course.year_level][BASE_CHANNEL_KEY]
-        base_channel: discord.TextChannel = self.client.get_channel(base_channel_id)
-        base_message: discord.Message = await base_channel.send(
-            f"Thread for `{course}`"
+        base_message: discord.Message = await self._send_base_message(guild_id, course)
+        created_thread: discord.Thread = await self._start_course_thread(
+            guild_id, course, base_message
         )
+        self.course_mappings.write(guild_id)
+        return (f"Done! Created thread here: {created_thread.mention}", created_thread)
+
+    async def _send_base_message(
+        self, guild_id: int, course: Course
+    ) -> discord.Message:
+        base_channel_id: int = self.course_mappings[guild_id][course.year_level][
+            BASE_CHANNEL_KEY
+        ]
+        base_channel: discord.TextChannel = self.client.get_channel(base_channel_id)
+        return await base_channel.send(f"Thread for `{course}`")
+
+    async def _start_course_thread(
+        self, guild_id: int, course: Course, base_message: discord.Message
+    ) -> discord.Thread:
+        """Creates the thread on the base message and maps it; the caller persists."""
         created_thread: discord.Thread = await base_message.create_thread(
             name=str(course)
         )
-        self.course_mappings[course.year_level][CURRENT_COURSES_KEY][
+        self.course_mappings[guild_id][course.year_level][CURRENT_COURSES_KEY][
             str(course)
         ] = created_thread.id
-        write_json(THREADS_CONFIG_FILENAME, self.course_mappings)
-        return (f"Done! Created thread here: {created_thread.mention}", created_thread)
+        return created_thread
+
+    async def _validate_courses(
+        self, guild_id: int, courses: Iterable[Course]
+    ) -> Tuple[Set[Course], Set[Course]]:
+        """
+        Splits the courses into the ones that already have a thread in the guild or
+        are valid UBC courses, and the ones that aren't. The prerequisite checker's
+        cached catalogue is used for the departments it covers; every other
+        department page is only fetched once, and the pages are parsed in parallel.
+        """
+        valid_courses: Set[Course] = set()
+        invalid_courses: Set[Course] = set()
+        unchecked_courses: List[Course] = []
+        for course in courses:
+            if self._does_course_exist(guild_id, course)[1]:
+                valid_courses.add(course)
+            else:
+                unchecked_courses.append(course)
+
+        catalogue: Dict[str, Any] = (
+            getattr(self.client.get_cog("PrerequisiteChecker"), "catalogue", None) or {}
+        )
+        cached_depts: Set[str] = {course_key.split()[0] for course_key in catalogue}
+        departments: Dict[
+            str, Optional[Dict[str, Dict[str, str]]]
+        ] = await scrape_departments(
+            course.dept
+            for course in unchecked_courses
+            if course.dept not in cached_depts
+        )
+        for course in unchecked_courses:
+            COURSE_LOOKUPS.inc(
+                source="catalogue" if course.dept in cached_depts else "ubc"
+            )
+            if str(course) in catalogue or str(course) in (
+                departments.get(course.dept) or {}
+            ):
+                valid_courses.add(course)
+            else:
+                invalid_courses.add(course)
+        return valid_courses, invalid_courses
 
     @commands.group(aliases=["c"])
     async def courses(self, ctx: commands.Context):
@@ -210,14 +633,16 @@ class CourseThreads(commands.Cog):
         **Example(s)**
           `[p]course join CPEN331` - joins the thread for CPEN331
         """
-        pre_check: Tuple[str, bool] = self._does_course_exist(course)
+        pre_check: Tuple[str, bool] = self._does_course_exist(ctx.guild.id, course)
         if not pre_check[1]:
             return await ctx.reply(pre_check[0])
-        course_thread_id: int = self.course_mappings[course.year_level][
-            CURRENT_COURSES_KEY
-        ][str(course)]
-        course_thread: discord.Thread = self.client.get_channel(course_thread_id)
+        course_thread: discord.Thread = await self._get_course_thread(
+            ctx.guild.id, course
+        )
+        if await self._is_thread_member(course_thread, ctx.author):
+            return await ctx.reply(f"You're already in {course_thread.mention}.")
         await course_thread.add_user(ctx.author)
+        self.thread_members.add(course_thread.id, ctx.author.id)
         return await ctx.reply(
             f"Done! Added you to {course_thread.mention}. You may want to change your notification settings for the thread."
         )
@@ -235,17 +660,43 @@ class CourseThreads(commands.Cog):
         **Example(s)**
           `[p]course leave CPEN331` - leaves the thread for CPEN331
         """
-        pre_check: Tuple[str, bool] = self._does_course_exist(course)
+        pre_check: Tuple[str, bool] = self._does_course_exist(ctx.guild.id, course)
         if not pre_check[1]:
             return await ctx.reply(pre_check[0])
-        course_thread_id: int = self.course_mappings[course.year_level][
-            CURRENT_COURSES_KEY
-        ][str(course)]
-        course_thread: discord.Thread = self.client.get_channel(course_thread_id)
+        course_thread: discord.Thread = await self._get_course_thread(
+            ctx.guild.id, course
+        )
+        if await self._is_thread_member(course_thread, ctx.author) is False:
+            return await ctx.reply(f"You're not in {course_thread.mention}.")
         await course_thread.remove_user(ctx.author)
-        return await ctx.reply(
-            f"Done! Removed you from {course_thread.mention}, whether you were in it or not."
+        self.thread_members.remove(course_thread.id, ctx.author.id)
+        return await ctx.reply(f"Done! Removed you from {course_thread.mention}.")
+
+    @courses.command(name="mine", aliases=["m"])
+    @commands.guild_only()
+    async def my_courses(self, ctx: commands.Context):
+        """
+        Lists the course threads you're in. This is answered from the bot's cache.
+
+        **Example(s)**
+          `[p]course mine` - lists your course threads
+        """
+        thread_ids: Set[int] = self.thread_members.threads_of(ctx.author.id)
+        course_listing: List[str] = sorted(
+            f"`{course}`: <#{thread_id}>"
+            for year_metadata in self.course_mappings[ctx.guild.id].values()
+            for course, thread_id in year_metadata[CURRENT_COURSES_KEY].items()
+            if thread_id in thread_ids
         )
+        if ctx.guild.id not in self.thread_members_loaded:
+            course_listing.append(
+                "_Thread members are still loading, so this may be incomplete._"
+            )
+        if not course_listing:
+            return await ctx.reply("You aren't in any course threads.")
+        await Paginator(
+            title="Your Courses", entries=course_listing, entries_per_page=25
+        ).paginate(ctx)
 
     @courses.command(name="list", aliases=["l"])
     @commands.guild_only()
@@ -257,7 +708,7 @@ class CourseThreads(commands.Cog):
           `[p]course list` - lists all the courses that currently have a thread
         """
         course_listing: List[str] = []
-        for year, year_metadata in self.course_mappings.items():
+        for year, year_metadata in self.course_mappings[ctx.guild.id].items():
             course_listing.append(f"**Level `{year}xx`**")
             for course, channel_id in year_metadata[CURRENT_COURSES_KEY].items():
                 channel: discord.Thread = self.client.get_channel(channel_id)
@@ -284,7 +735,7 @@ class CourseThreads(commands.Cog):
           `[p]course search 331` - returns all threads that have 331 in its title
         """
         search_results: List[str] = []
-        for year_metadata in self.course_mappings.values():
+        for year_metadata in self.course_mappings[ctx.guild.id].values():
             for course, channel_id in year_metadata[CURRENT_COURSES_KEY].items():
                 if (
                     query.lower() in course.lower()
@@ -315,7 +766,7 @@ class CourseThreads(commands.Cog):
         Note that you must leave your old courses manually.
         Response messages will be ephemeral unless you DM the bot.
 
-        The parser iterates through the file to search for `SUMMARY:{DEPT} {CODE}` strings.
+        The parser reads the `SUMMARY:{DEPT} {CODE}` of every event in the file.
 
         **Example**
           `[p]course import` (with attachment) - imports courses from the attachment
@@ -323,6 +774,11 @@ class CourseThreads(commands.Cog):
         logging.info(f"Import invoked by {ctx.author}, in guild: {ctx.guild}")
         required_attachments: int = 1
         is_guild: bool = True if ctx.guild else False
+        guild_id: Optional[int] = await self._import_guild_id(ctx)
+        if guild_id is None:
+            return await ctx.reply(
+                "I couldn't tell which server's course threads to use. Try importing from the server instead."
+            )
         if len(ctx.message.attachments) != required_attachments:
             await ctx.reply(
                 f"Make sure your message has exactly **{required_attachments}** attachment. "
@@ -332,14 +788,27 @@ class CourseThreads(commands.Cog):
                 await ctx.message.delete()
             return
 
-        # Save the file in-memory so we can delete the user's message
-        calendar_file: BytesIO = BytesIO()
-        await ctx.message.attachments[0].save(calendar_file)
+        # Parse the .ics file and find all the raw course strings before we delete the
+        # user's message. Reading stops early once there are too many courses
+        error_message: Optional[str] = None
+        try:
+            found_courses_raw: Set[str] = await read_attachment_courses(
+                ctx.message.attachments[0], max_courses=MAX_COURSES_PER_ICS
+            )
+        except IcsTooLargeError:
+            error_message = f"The file is too large. Schedules are at most {MAX_ICS_BYTES // 1024} KiB."
+        except IcsError:
+            error_message = "Failed to parse the file. Is it an `.ics` or text file?"
+        if error_message is not None:
+            await ctx.reply(error_message)
+            if is_guild:
+                await ctx.message.delete()
+            return
 
         # Use buttons to begin interaction workflow with the user
         confirmation_view: discord.ui.View = ConfirmationView(ctx.author)
         status_message: discord.Message = await ctx.reply(
-            f"Attachment saved{'' if is_guild else ' and deleted your original message'}. "
+            f"Attachment read{'' if is_guild else ' and deleted your original message'}. "
             + "Use the buttons to continue or cancel.",
             view=confirmation_view,
         )
@@ -365,30 +834,11 @@ class CourseThreads(commands.Cog):
             )
         )
 
-        # Parse the .ics file and find all the raw course strings
-        found_courses_raw: Set[str] = set()
-        for line in calendar_file.readlines():
-            try:
-                line: str = line.decode("utf-8")
-                if line.startswith(ICS_PARSING_PREFIX):
-                    # Example of summary line from .ics is SUMMARY:CPEN 491 001
-                    # The section/tutorial number _should_ be at the end, but it shouldn't matter here
-                    found_courses_raw.add(
-                        # Do a little preprocessing in order to make the Course type conversion easier
-                        "".join(
-                            line.replace(ICS_PARSING_PREFIX, "").strip().split()[:2]
-                        )
-                    )
-            except UnicodeDecodeError:
-                return await status_webhook.edit(
-                    "Failed to parse the file. Is it an `.ics` or text file?",
-                )
-
         if len(found_courses_raw) > MAX_COURSES_PER_ICS:
             status_message_str: str = (
                 f"The number of courses found exceeds the **{MAX_COURSES_PER_ICS}** maximum allowed."
                 + "\n"
-                + f"Found {len(found_courses_raw)}: {', '.join([f'`{course}`' for course in found_courses_raw])}"
+                + f"Found at least {len(found_courses_raw)}: {', '.join([f'`{course}`' for course in found_courses_raw])}"
             )
 
             logging.info(status_message_str)
@@ -407,23 +857,10 @@ class CourseThreads(commands.Cog):
             else:
                 unparsed_courses.add(course)
 
-        # Track courses that either aren't valid UBC courses, or its thread creation failed
-        invalid_courses: Set[Course] = set()
-        confirmed_courses: Set[Course] = set()
-
         # Gather the courses that already have a thread or are valid UBC courses
-        for course in parsed_courses:
-            if self._does_course_exist(course)[1]:
-                confirmed_courses.add(course)
-            else:
-                course_from_ubc: Optional[Course] = await scrape_course_info(course)
-                await asyncio.sleep(
-                    0.25
-                )  # Add a slight delay to prevent UBC from rate-limiting us
-                if course_from_ubc is None:
-                    invalid_courses.add(course)
-                else:
-                    confirmed_courses.add(course)
+        confirmed_courses, invalid_courses = await self._validate_courses(
+            guild_id, parsed_courses
+        )
 
         status_message_str: str = (
             (
@@ -457,7 +894,7 @@ class CourseThreads(commands.Cog):
         logging.info(status_message_str)
 
         # At this point, the threads will be created but we'll still give the user the option to cancel
-        # We can afford to wait here since we're no longer holding the modification lock
+        # We can afford to wait here since we aren't holding any locks
         final_confirmation_view: discord.ui.View = ConfirmationView(
             ctx.author, timeout=120
         )
@@ -489,6 +926,7 @@ class CourseThreads(commands.Cog):
             )
 
         # Recreate the Course objects since we can only retrieve primitives from the select
+        # Courses are interned, so this resolves to the objects parsed above
         final_course_list: List[Course] = [
             Course.parse(course) for course in course_selection_view.values
         ]
@@ -504,16 +942,17 @@ class CourseThreads(commands.Cog):
             view=final_confirmation_view,
         )
 
-        # Create the threads that we found were valid earlier
-        async with self.course_modification_lock:
-            for course in final_course_list:
+        # Create the threads that we found were valid earlier. Only the course being
+        # created is locked, so imports from other students aren't held up
+        for course in final_course_list:
+            async with self._course_lock(guild_id, course):
                 # Filter out courses that already have threads
-                if self._does_course_exist(course)[1]:
+                if self._does_course_exist(guild_id, course)[1]:
                     continue
 
                 create_result: Tuple[
                     Optional[str], Optional[discord.Thread]
-                ] = await self._create_course_thread(course)
+                ] = await self._create_course_thread(guild_id, course)
                 if create_result[1] is None:
                     logging.error(f"Failed to create a thread for {course}")
                     return await final_confirmation_view.followup_webhook.send(
@@ -522,34 +961,162 @@ class CourseThreads(commands.Cog):
                     )
 
         # Finally, add the user
-        for course in final_course_list:
-            course_thread: discord.Thread = await self._get_course_thread(course)
-            # Technically, we could run into issues if the thread gets deleted while
-            # we're iterating, but we won't lock this because it's prone to rate limits
+        unadded_courses: List[Course] = await self._add_user_to_courses(
+            guild_id, ctx.author, final_course_list
+        )
+        await final_confirmation_view.followup_webhook.send(
+            "Done. Best of luck!"
+            + (
+                "\nCouldn't find the threads for "
+                + ", ".join(f"`{course}`" for course in unadded_courses)
+                + "; try joining them with `!courses join`."
+                if unadded_courses
+                else ""
+            ),
+            ephemeral=is_guild,
+        )
 
-            # Also, we'll ping to add the user since the message rate limit is much more
-            # generous than the channel edit one (which course_thread.add_user({user}) falls under)
-            await course_thread.send(f"Welcome, {ctx.author.mention}!")
+    async def _import_guild_id(self, ctx: commands.Context) -> Optional[int]:
+        """
+        The guild whose course threads an import is for: the current guild, or in a
+        DM, the user's only mutual guild with course threads (in this process).
+        Membership is checked per guild since the member cache may be off (see
+        `utils.CacheProfile`).
+        """
+        if ctx.guild is not None:
+            return ctx.guild.id
+        guilds: List[discord.Guild] = [
+            self.client.get_guild(guild_id)
+            for guild_id, course_mappings in self.course_mappings.items()
+            if course_mappings and self.client.get_guild(guild_id) is not None
+        ]
+        members: List[Optional[discord.Member]] = await asyncio.gather(
+            *[get_or_fetch_member(guild, ctx.author.id) for guild in guilds]
+        )
+        guild_ids: List[int] = [
+            guild.id for guild, member in zip(guilds, members) if member is not None
+        ]
+        return guild_ids[0] if len(guild_ids) == 1 else None
 
-        await final_confirmation_view.followup_webhook.send(
-            "Done. Best of luck!", ephemeral=is_guild
+    async def _resolve_course_threads(
+        self, guild_id: int, courses: Iterable[Course]
+    ) -> Dict[Course, discord.Thread]:
+        """
+        Looks the courses' threads up in the cache, fetching any misses concurrently.
+        Courses whose thread can't be found are left out.
+        """
+        threads: Dict[Course, discord.Thread] = {}
+        missing: Dict[Course, int] = {}
+        for course in courses:
+            if not self._does_course_exist(guild_id, course)[1]:
+                continue
+            thread_id: int = self.course_mappings[guild_id][course.year_level][
+                CURRENT_COURSES_KEY
+            ][str(course)]
+            thread: Optional[discord.Thread] = self.client.get_channel(thread_id)
+            if thread is None:
+                missing[course] = thread_id
+            else:
+                threads[course] = thread
+        fetched: List[Any] = await asyncio.gather(
+            *[self.client.fetch_channel(thread_id) for thread_id in missing.values()],
+            return_exceptions=True,
         )
+        for course, result in zip(missing, fetched):
+            if isinstance(result, Exception):
+                logging.error(f"Failed to fetch the thread for {course}: {result}")
+            else:
+                threads[course] = result
+        return threads
 
-    @tasks.loop(seconds=1)
-    async def thread_refresher_task(self):
+    async def _add_user_to_courses(
+        self, guild_id: int, user: discord.abc.User, courses: List[Course]
+    ) -> List[Course]:
+        """
+        Adds the user to every course's thread at once and returns the courses whose
+        thread couldn't be found. Thread members are rate limited per thread, so the
+        adds run in parallel (bounded by `MEMBER_ADD_CONCURRENCY`). If an add fails,
+        the user is pinged once per base channel with links to those threads instead
+        of once per thread.
+        """
+        threads: Dict[Course, discord.Thread] = await self._resolve_course_threads(
+            guild_id, courses
+        )
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(MEMBER_ADD_CONCURRENCY)
+
+        async def add_user(thread: discord.Thread) -> bool:
+            async with semaphore:
+                try:
+                    if self.thread_members.is_member(thread.id, user.id):
+                        return True
+                    await thread.add_user(user)
+                    self.thread_members.add(thread.id, user.id)
+                    return True
+                except discord.HTTPException as e:
+                    logging.warning(f"Failed to add {user} to {thread.name}: {e}")
+                    return False
+
+        results: List[bool] = await asyncio.gather(
+            *[add_user(thread) for thread in threads.values()]
+        )
+        failed_by_parent: Dict[int, List[discord.Thread]] = {}
+        for thread, added in zip(threads.values(), results):
+            if not added:
+                failed_by_parent.setdefault(thread.parent_id, []).append(thread)
+
+        async def send_links(parent_id: int, failed_threads: List[discord.Thread]):
+            parent: Optional[discord.TextChannel] = await self._get_base_channel(
+                guild_id, parent_id
+            )
+            if parent is not None:
+                await parent.send(
+                    f"Welcome, {user.mention}! Your course threads: "
+                    + " ".join(thread.mention for thread in failed_threads)
+                )
+
+        await asyncio.gather(
+            *[
+                send_links(parent_id, failed_threads)
+                for parent_id, failed_threads in failed_by_parent.items()
+            ],
+            return_exceptions=True,
+        )
+        return [course for course in courses if course not in threads]
+
+    async def _get_base_channel(
+        self, guild_id: int, channel_id: int
+    ) -> Optional[discord.TextChannel]:
+        """
+        The base channel of a thread; `thread.parent` is None when the channel isn't
+        cached. None if it can't be fetched either.
+        """
+        guild: Optional[discord.Guild] = self.client.get_guild(guild_id)
+        channel: Optional[discord.TextChannel] = (
+            guild.get_channel(channel_id) if guild is not None else None
+        )
+        if channel is None:
+            try:
+                channel = await self.client.fetch_channel(channel_id)
+            except discord.HTTPException as e:
+                logging.warning(f"Failed to fetch base channel {channel_id}: {e}")
+        return channel
+
+    async def _refresh_threads(self):
         """
         Threads automatically archive after inactivity. We'll iterate over all the threads
         and unarchive the ones that are archived. This shouldn't be expensive since it doesn't
         make any API calls unless the thread is archived (which was pushed to us by the gateway).
+        Only the threads of the loaded guilds (ie. this process's shards) are checked.
         """
         try:
             if self.client.is_ready():
-                thread_ids: List[int] = [
-                    channel_id
-                    for year_metadata in self.course_mappings.values()
+                thread_ids: List[Tuple[int, int]] = [
+                    (guild_id, channel_id)
+                    for guild_id, course_mappings in self.course_mappings.items()
+                    for year_metadata in course_mappings.values()
                     for channel_id in year_metadata[CURRENT_COURSES_KEY].values()
                 ]
-                for thread_id in thread_ids:
+                for guild_id, thread_id in thread_ids:
                     thread: Union[discord.Thread, None] = self.client.get_channel(
                         thread_id
                     )
@@ -557,9 +1124,12 @@ class CourseThreads(commands.Cog):
                     # getter will return None and we'll have to make an API call
                     if thread is None:
                         try:
-                            thread: discord.Thread = await self.client.fetch_channel(
-                                thread_id
-                            )
+                            async with self.client.rest_budget.throttle(
+                                "GET", f"/channels/{thread_id}"
+                            ):
+                                thread: discord.Thread = (
+                                    await self.client.fetch_channel(thread_id)
+                                )
                         except discord.errors.NotFound:
                             # Thrown if the thread isn't found, which should only happen
                             # if the thread was manually deleted; clean this thread up
@@ -567,12 +1137,18 @@ class CourseThreads(commands.Cog):
                             # NOTE: this should _rarely_ be called. It's a user error if
                             # we ever get to this catch, but we do this defensively.
                             # Also, since it shouldn't get called at all, it's extremely inefficient
+                            course_mappings: Optional[
+                                Dict[str, Any]
+                            ] = self.course_mappings.get(guild_id)
+                            # The guild may have been unloaded meanwhile
+                            if course_mappings is None:
+                                continue
                             target_year_level: Union[None, str] = None
                             target_course: Union[None, str] = None
                             for (
                                 year_level,
                                 year_metadata,
-                            ) in self.course_mappings.items():
+                            ) in course_mappings.items():
                                 for course, course_thread_id in year_metadata[
                                     CURRENT_COURSES_KEY
                                 ].items():
@@ -582,23 +1158,24 @@ class CourseThreads(commands.Cog):
                                         break
                                 if target_year_level and target_course:
                                     break
-                            del self.course_mappings[target_year_level][
-                                CURRENT_COURSES_KEY
-                            ][target_course]
-                            write_json(
-                                THREADS_CONFIG_FILENAME,
-                                self.course_mappings,
-                            )
+                            del course_mappings[target_year_level][CURRENT_COURSES_KEY][
+                                target_course
+                            ]
+                            self.thread_members.forget(thread_id)
+                            self.course_mappings.write(guild_id)
                             continue
 
                     if thread.archived:
                         logging.info(
                             f"Unarchived thread with thread ID: {thread_id}, name: {thread.name}"
                         )
-                        await thread.edit(
-                            archived=False,
-                            auto_archive_duration=AUTO_ARCHIVE_DURATION,
-                        )
+                        async with self.client.rest_budget.throttle(
+                            "PATCH", f"/channels/{thread_id}"
+                        ):
+                            await thread.edit(
+                                archived=False,
+                                auto_archive_duration=AUTO_ARCHIVE_DURATION,
+                            )
         except Exception as e:
             logging.error(f"Thread refresher error: {e}")
 
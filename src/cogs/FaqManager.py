@@ -1,19 +1,26 @@
 """
 Commands to bring up FAQ resources
 """
+import asyncio
 import os
 import json
+from typing import List, Optional
+import discord
 from discord.ext import commands
 
+from utils.FaqIndex import FaqEntry, FaqIndex
+from utils.Paginator import Paginator
+from utils.Startup import DeferredStateCog, StateNotLoaded
 
-class FaqManager(commands.Cog):
+
+class FaqManager(DeferredStateCog):
     """
     Cog for the FAQ commands
     """
 
     def __init__(self, client):
-        self.client = client
-        default_commands_filepath = os.path.join(
+        super().__init__(client)
+        self.default_commands_filepath = os.path.join(
             client.bot_dir, "assets/default_commands.json"
         )
         self.extra_commands_filepath = os.path.join(
@@ -21,12 +28,23 @@ class FaqManager(commands.Cog):
         )
         self.custom_commands = {}
 
+        # FAQs are resolved through this index rather than being registered as
+        # individual commands on the bot; see `on_command_error` for the dispatch
+        self.faq_index = FaqIndex()
+
+    async def load_state(self):
+        await asyncio.get_event_loop().run_in_executor(None, self._load_faqs)
+
+    def _load_faqs(self):
         # Load the default commands
-        with open(default_commands_filepath, "r") as f:
+        with open(self.default_commands_filepath, "r") as f:
             commands = json.loads(f.read())
             for command, metadata in commands.items():
                 self._faq_command_add(
-                    command, metadata["content"], metadata["description"]
+                    command,
+                    metadata["content"],
+                    metadata["description"],
+                    metadata.get("aliases", []),
                 )
 
         # Load or initialize the custom commands
@@ -38,43 +56,108 @@ class FaqManager(commands.Cog):
                         command,
                         metadata["content"],
                         metadata.get("description", metadata["content"]),
+                        metadata.get("aliases", []),
                     )
         else:
             self._write_json({}, self.extra_commands_filepath)
 
-    def _faq_command_add(self, name, content, description=None):
-        if description is None:
-            description = content
-
-        # We skip registering the command under this cog since it doesn't
-        # play nicely if it doesn't happen at class intiialization (especially
-        # for its interaction with the help menus). Thus it's unbounded.
-        command = commands.command(name=name)(self._faq_command(content, description))
-        return self.client.add_command(command)
+    def _faq_command_add(self, name, content, description=None, aliases=()):
+        entry = FaqEntry(
+            name=name, content=content, description=description, aliases=aliases
+        )
+        self.faq_index.add(entry)
+        return entry
 
     def _faq_command_remove(self, name):
-        return self.client.remove_command(name)
-
-    @staticmethod
-    def _faq_command(content, description):
-        async def command(ctx):
-            await ctx.send(content)
-
-        command.__doc__ = f"{description[:40]}{'...' if len(description) > 40 else ''}"
-        return command
+        return self.faq_index.remove(name)
 
     @staticmethod
     def _write_json(payload, file):
         with open(file, "w") as f:
             json.dump(payload, f)
 
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        """
+        Single dispatch path for FAQs: anything that isn't a registered command is
+        looked up in the FAQ index (names, aliases, then unambiguous prefixes).
+        """
+        if not isinstance(error, commands.errors.CommandNotFound):
+            return
+        if not ctx.invoked_with:
+            return
+        try:
+            await self.wait_for_state()
+        except StateNotLoaded:
+            return
+        entry: Optional[FaqEntry] = self.faq_index.resolve(ctx.invoked_with)
+        if entry is not None:
+            await ctx.send(entry.content)
+
+    @commands.group(invoke_without_command=True)
+    async def faq(self, ctx, name: str = None):
+        """
+        Brings up an FAQ by name, or lists all of them if no name is given.
+        FAQs can also be brought up directly with `[p]<name>`.
+
+        **Example(s)**
+          `[p]faq leetcode` - brings up the leetcode FAQ
+          `[p]faq` - lists all FAQs
+        """
+        if name is None:
+            return await self.list_faqs(ctx)
+        entry: Optional[FaqEntry] = self.faq_index.resolve(name)
+        if entry is not None:
+            return await ctx.send(entry.content)
+        suggestions: List[FaqEntry] = self.faq_index.suggest(name)
+        if suggestions:
+            return await ctx.send(
+                "FAQ not found. Did you mean: "
+                + ", ".join(f"`{entry.name}`" for entry in suggestions)
+            )
+        await ctx.send("FAQ not found.")
+
+    @faq.command(name="list", aliases=["l"])
+    async def list_faqs(self, ctx):
+        """Lists all FAQs."""
+        entries: List[str] = [
+            f"`{entry.name}` - {entry.short_doc}"
+            for entry in sorted(self.faq_index, key=lambda entry: entry.name)
+        ]
+        if not entries:
+            return await ctx.send("No FAQs found.")
+        await Paginator(title="FAQs", entries=entries, entries_per_page=25).paginate(
+            ctx
+        )
+
+    @faq.command(name="search", aliases=["s"])
+    async def search_faqs(self, ctx, *, terms: str):
+        """
+        Searches the names, descriptions and contents of all FAQs.
+
+        **Example(s)**
+          `[p]faq search interview prep` - lists the FAQs that best match "interview prep"
+        """
+        results: List[FaqEntry] = self.faq_index.search(terms)
+        if not results:
+            return await ctx.send(
+                f"No FAQs found for `{terms}`.",
+                allowed_mentions=discord.AllowedMentions.none(),
+            )
+        await Paginator(
+            title=f"FAQs Matching: `{terms}`",
+            entries=[f"`{entry.name}` - {entry.short_doc}" for entry in results],
+        ).paginate(ctx)
+
     @commands.command()
     @commands.is_owner()
     async def add(self, ctx, name, *, content):
         """Adds a custom command."""
+        if self.client.get_command(name) is not None:
+            return await ctx.send("Command name already exists. Try again.")
         try:
             self._faq_command_add(name, content)
-        except commands.errors.CommandRegistrationError:
+        except ValueError:
             return await ctx.send("Command name already exists. Try again.")
 
         # Since we pass the command uniqueness check above, we skip checking
@@ -1,20 +1,92 @@
 """
 Commands to verify prerequisites for ECE/CS courses
 """
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
 import discord
 from discord.ext import commands
 from utils.Converters import Course
 
-from utils.UBCCourseInfo import scrape_course_info
+from utils.JsonTools import read_json_async, write_json
+from utils.Metrics import COURSE_LOOKUPS
+from utils.Paginator import Paginator
+from utils.IcsParser import (
+    MAX_ICS_BYTES,
+    IcsError,
+    IcsTooLargeError,
+    read_attachment_courses,
+)
+from utils.PrerequisiteGraph import PrerequisiteGraph, Requirement
+from utils.Scheduler import CronTrigger
+from utils.Startup import DeferredStateCog
+from utils.UBCCourseInfo import (
+    scrape_course_info,
+    scrape_departments,
+    shutdown_parser_executor,
+)
 
+CATALOGUE_FILENAME: str = "course_catalogue.json"
 
-class PrerequisiteChecker(commands.Cog):
+# Departments fetched by `!prereq refresh` when none are given
+DEFAULT_CATALOGUE_DEPARTMENTS: List[str] = [
+    "APSC",
+    "CPEN",
+    "CPSC",
+    "ELEC",
+    "MATH",
+    "PHYS",
+    "STAT",
+]
+
+# The default departments are refreshed weekly, at a random time in the half hour
+# after Monday 4am, by one process (see `Scheduler`)
+CATALOGUE_REFRESH_JOB: str = "prereq.catalogue_refresh"
+CATALOGUE_REFRESH_CRON: str = "0 4 * * 1"
+CATALOGUE_REFRESH_JITTER: float = 1800.0
+
+
+class PrerequisiteChecker(DeferredStateCog):
     """
     Cog for the prerequisite check commands
     """
 
     def __init__(self, client):
-        self.client = client
+        super().__init__(client)
+        # Course key (eg. "CPEN 211") -> course info, as scraped from the calendar
+        self.catalogue: Dict[str, Dict[str, str]] = {}
+        self.graph: PrerequisiteGraph = PrerequisiteGraph({})
+
+    async def load_state(self):
+        self.catalogue = await read_json_async(CATALOGUE_FILENAME)
+        self.graph = await self._build_graph(self.catalogue)
+        # The catalogue file is shared, so only the first shard refreshes it
+        if not self.client.shard_id:
+            self.client.scheduler.add_job(
+                CATALOGUE_REFRESH_JOB,
+                self._scheduled_refresh,
+                CronTrigger(CATALOGUE_REFRESH_CRON),
+                jitter=CATALOGUE_REFRESH_JITTER,
+            )
+            # On a fresh install, build the catalogue now rather than next Monday
+            if not self.catalogue:
+                self.client.scheduler.run_now(CATALOGUE_REFRESH_JOB)
+
+    def cog_unload(self):
+        self.client.scheduler.remove_job(CATALOGUE_REFRESH_JOB)
+        super().cog_unload()
+
+    async def shutdown(self):
+        # A refresh in progress was drained (and saved the catalogue) by now; stop
+        # the parser processes instead of leaving them to be killed
+        await shutdown_parser_executor()
+
+    @staticmethod
+    async def _build_graph(catalogue: Dict[str, Dict[str, str]]) -> PrerequisiteGraph:
+        # Parsing the requirements and computing closures is CPU bound
+        return await asyncio.get_event_loop().run_in_executor(
+            None, PrerequisiteGraph, catalogue
+        )
 
     @commands.command()
     async def courseinfo(self, ctx, course: Course):
@@ -23,6 +95,12 @@ class PrerequisiteChecker(commands.Cog):
         Make sure the course is in the form of DEPT### (case-insensitive).
         """
         course_info = await scrape_course_info(course)
+        if course_info is None:
+            # Fall back to the cached catalogue if the calendar can't be reached
+            course_info = self.catalogue.get(str(course))
+            COURSE_LOOKUPS.inc(source="catalogue_fallback")
+        else:
+            COURSE_LOOKUPS.inc(source="ubc")
         if course_info is None:
             return await ctx.send("Course not found.")
         em = discord.Embed(title=course_info["name"], url=course_info["url"])
@@ -37,6 +115,201 @@ class PrerequisiteChecker(commands.Cog):
         em.add_field(name="Description", inline=False, value=course_info["description"])
         await ctx.send(embed=em)
 
+    @commands.group(aliases=["pr"])
+    async def prereq(self, ctx: commands.Context):
+        """
+        Command group related to checking prerequisites against the course catalogue.
+        """
+        if ctx.invoked_subcommand is None:
+            raise commands.errors.BadArgument
+
+    @prereq.command(name="needs")
+    async def prereq_needs(self, ctx: commands.Context, course: Course):
+        """
+        Lists every course in the prerequisite chain of a course, in an order they
+        can be taken. Note that alternatives ("one of") are all listed.
+
+        **Example(s)**
+          `[p]prereq needs CPEN391` - lists everything that leads up to CPEN 391
+        """
+        course_key: str = str(course)
+        if course_key not in self.graph:
+            return await ctx.send("Course not found in the catalogue.")
+        requirement: Optional[Requirement] = self.graph.prerequisites.get(course_key)
+        if requirement is None:
+            return await ctx.send(f"`{course_key}` has no prerequisites.")
+        await Paginator(
+            title=f"Before {course_key}",
+            entries=[f"**Requires:** {requirement}"] + self.graph.needs(course_key),
+            entries_per_page=25,
+        ).paginate(ctx)
+
+    @prereq.command(name="unlocks")
+    async def prereq_unlocks(self, ctx: commands.Context, course: Course):
+        """
+        Lists the courses that require a course, directly or further down the chain.
+
+        **Example(s)**
+          `[p]prereq unlocks CPEN211` - lists what CPEN 211 leads to
+        """
+        course_key: str = str(course)
+        direct: List[str] = self.graph.unlocks(course_key)
+        if not direct:
+            return await ctx.send(f"`{course_key}` isn't a prerequisite of any course.")
+        direct_set: Set[str] = set(direct)
+        await Paginator(
+            title=f"Unlocked by {course_key}",
+            entries=[
+                course if course in direct_set else f"{course} (indirectly)"
+                for course in self.graph.unlocks(course_key, transitive=True)
+            ],
+            entries_per_page=25,
+        ).paginate(ctx)
+
+    @prereq.command(name="check")
+    async def prereq_check(
+        self, ctx: commands.Context, course: Course, *completed: Course
+    ):
+        """
+        Checks whether a course can be taken given the courses you've completed.
+        Corequisites are satisfied by courses you've completed.
+
+        **Example(s)**
+          `[p]prereq check CPEN221 CPSC110 CPSC121 CPEN211` - checks CPEN 221 given the rest
+        """
+        course_key: str = str(course)
+        if course_key not in self.graph:
+            return await ctx.send("Course not found in the catalogue.")
+        taken: Set[str] = {str(completed_course) for completed_course in completed}
+        unmet: List[str] = []
+        unverifiable: bool = True
+        for label, requirement in (
+            ("Prerequisites", self.graph.unmet_prerequisites(course_key, taken)),
+            ("Corequisites", self.graph.unmet_corequisites(course_key, taken)),
+        ):
+            if requirement is not None:
+                unmet.append(f"{label}: {requirement}")
+                unverifiable = unverifiable and not requirement.courses()
+        if not unmet:
+            return await ctx.send(f"You can take `{course_key}`.")
+        if unverifiable:
+            return await ctx.send(
+                f"You can take `{course_key}` as long as you also meet:\n"
+                + "\n".join(unmet)
+            )
+        await ctx.send(
+            f"You can't take `{course_key}` yet. Missing:\n" + "\n".join(unmet)
+        )
+
+    @prereq.command(name="plan")
+    async def prereq_plan(self, ctx: commands.Context, *, courses: str = ""):
+        """
+        Checks a whole term of courses against their prerequisites and corequisites.
+        Term courses can come from an `.ics` attachment (like `[p]course import`) or be
+        listed before a `|`; completed courses are listed after it. With an attachment,
+        everything listed is treated as completed.
+
+        **Example(s)**
+          `[p]prereq plan CPEN211 CPEN221 | CPSC110 CPSC121` - checks a term after two courses
+          `[p]prereq plan CPSC110 CPSC121` (with attachment) - checks the schedule
+        """
+        term_text, _, completed_text = courses.partition("|")
+        if ctx.message.attachments and not completed_text:
+            term_text, completed_text = "", term_text
+
+        term: Set[str] = set(map(str, Course.find_all(term_text)))
+        for attachment in ctx.message.attachments:
+            try:
+                found_courses_raw: Set[str] = await read_attachment_courses(attachment)
+            except IcsTooLargeError:
+                return await ctx.send(
+                    f"The file is too large. Schedules are at most {MAX_ICS_BYTES // 1024} KiB."
+                )
+            except IcsError:
+                return await ctx.send(
+                    "Failed to parse the file. Is it an `.ics` or text file?"
+                )
+            term |= {
+                str(course)
+                for course in map(Course.parse, found_courses_raw)
+                if course is not None
+            }
+        if not term:
+            raise commands.errors.BadArgument
+        completed: Set[str] = set(map(str, Course.find_all(completed_text)))
+
+        results = self.graph.check_plan(term, completed)
+        problems: List[str] = []
+        satisfied: List[str] = []
+        for course, (prerequisites, corequisites) in results.items():
+            unmet: List[str] = []
+            if prerequisites is not None:
+                unmet.append(f"missing prerequisites: {prerequisites}")
+            if corequisites is not None:
+                unmet.append(f"missing corequisites: {corequisites}")
+            if unmet:
+                problems.append(f"`{course}` - " + "; ".join(unmet))
+            else:
+                satisfied.append(f"`{course}` - OK")
+        unknown: List[str] = [
+            f"`{course}` - not in the catalogue"
+            for course in sorted(term - set(results))
+        ]
+        await Paginator(
+            title=f"Term Check: {len(satisfied)} of {len(term)} Courses OK",
+            entries=problems + unknown + satisfied,
+        ).paginate(ctx)
+
+    @prereq.command(name="refresh")
+    @commands.is_owner()
+    async def prereq_refresh(self, ctx: commands.Context, *depts: str):
+        """
+        Refreshes the cached course catalogue from the UBC calendar.
+
+        **Example(s)**
+          `[p]prereq refresh` - refreshes the default departments
+          `[p]prereq refresh CPEN ELEC` - refreshes CPEN and ELEC
+        """
+        await ctx.send("Refreshing the course catalogue...")
+        course_count, failed = await self._refresh_catalogue(
+            depts or DEFAULT_CATALOGUE_DEPARTMENTS
+        )
+        message: str = f"Course catalogue refreshed: {course_count} courses."
+        if failed:
+            message += f" Failed to fetch: {', '.join(failed)}."
+        await ctx.send(message)
+
+    async def _scheduled_refresh(self):
+        _, failed = await self._refresh_catalogue(DEFAULT_CATALOGUE_DEPARTMENTS)
+        if failed:
+            logging.warning(f"Scheduled catalogue refresh failed for: {failed}")
+
+    async def _refresh_catalogue(self, depts: List[str]) -> Tuple[int, List[str]]:
+        """
+        Re-scrapes the departments into the catalogue and saves it. Returns the
+        catalogue's course count and the departments that couldn't be fetched.
+        """
+        departments = await scrape_departments(depts)
+        failed: List[str] = [
+            dept for dept, courses in departments.items() if courses is None
+        ]
+        catalogue: Dict[str, Dict[str, str]] = {
+            course_key: course_info
+            for course_key, course_info in self.catalogue.items()
+            # Drop refreshed departments so removed courses don't linger
+            if departments.get(course_key.split()[0]) is None
+        }
+        for courses in departments.values():
+            catalogue.update(courses or {})
+
+        self.graph = await self._build_graph(catalogue)
+        self.catalogue = catalogue
+        await asyncio.get_event_loop().run_in_executor(
+            None, write_json, CATALOGUE_FILENAME, catalogue
+        )
+        logging.info(f"Course catalogue refreshed with {len(catalogue)} courses.")
+        return len(catalogue), failed
+
 
 def setup(client):
     client.add_cog(PrerequisiteChecker(client))
@@ -2,10 +2,12 @@
 Commands to execute random code.
 """
 import aiohttp
+import asyncio
 import os
 import re
 import discord
 from discord.ext import commands
+from utils.Startup import DeferredStateCog
 
 
 MAX_MESSAGE_LENGTH = 2000
@@ -22,19 +24,36 @@ class Code(commands.Converter):
         return match.group(1) if match else None
 
 
-class Repl(commands.Cog):
+class Repl(DeferredStateCog):
     """
     Cog to run an external coderunner.
     """
 
     def __init__(self, client):
-        self.client = client
-        self.session = aiohttp.ClientSession()
+        super().__init__(client)
+        # Created on first use, from the event loop
+        self.session = None
         self.repl_file = f"{os.path.dirname(__file__)}/../secrets/repl_endpoint.txt"
-        self.repl_endpoint = (
-            open(self.repl_file).read() if os.path.exists(self.repl_file) else None
+        self.repl_endpoint = None
+
+    async def load_state(self):
+        self.repl_endpoint = await asyncio.get_event_loop().run_in_executor(
+            None, self._read_repl_endpoint
         )
 
+    def _read_repl_endpoint(self):
+        return open(self.repl_file).read() if os.path.exists(self.repl_file) else None
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def shutdown(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
     @commands.command()
     @commands.max_concurrency(2)
     @commands.guild_only()
@@ -43,7 +62,7 @@ class Repl(commands.Cog):
         Code parameter should be in a code block."""
         if self.repl_endpoint:
             msg = await ctx.send(f"```Running...```")
-            async with self.session.post(
+            async with self._get_session().post(
                 self.repl_endpoint, json={"language": language, "code": code}
             ) as resp:
                 output = await resp.text()
@@ -65,7 +84,9 @@ class Repl(commands.Cog):
                 else:
                     await msg.edit(
                         content=f"{ctx.author.mention}```\n{output or 'No output.'}```",
-                        allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=[ctx.author])
+                        allowed_mentions=discord.AllowedMentions(
+                            everyone=False, roles=False, users=[ctx.author]
+                        ),
                     )
         else:
             return await ctx.send(
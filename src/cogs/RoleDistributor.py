@@ -2,43 +2,59 @@
 Use reactions to add and remove roles.
 Please ensure `secrets/role_msg_id.txt` contains the selected message ID 
 """
-from json.decoder import JSONDecodeError
+import asyncio
 import logging
 import typing
 import discord
-import json
-import os
 from discord.ext import commands
+from utils.CacheProfile import get_or_fetch_member
+from utils.GuildState import GuildStateCog, GuildStateStore
+from utils.Metrics import REACTION_EVENT_LATENCY
 
+# Each guild has its own file (see `GuildStateStore`), mapping role message IDs to
+# {"mapping": {"<emoji>": "<role_id>", ...}, "unique": <bool>}
+ROLE_MAPPINGS_FILENAME = "role_mappings.json"
 
-class RoleDistributor(commands.Cog):
+
+class RoleDistributor(GuildStateCog):
     """
     Cog for distributing roles (eg. 2nd Year)
     """
 
     def __init__(self, client):
-        self.client = client
+        super().__init__(client)
 
-        # Parent directory of the bot repo; constructed as parentDir(srcDir(fileDir(file)))
-        bot_dir = os.path.dirname(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        )
+        # Role message ID to be receiving reacts, per guild
+        self.role_mapping = GuildStateStore(ROLE_MAPPINGS_FILENAME)
+        self.guild_stores = [self.role_mapping]
 
-        # Role message ID to be receiving reacts
-        self.role_mapping_file = os.path.join(bot_dir, "src/secrets/role_mappings.json")
+        # Mapping sessions in progress, by guild ID
+        self.role_collector = {}
 
-        if not os.path.exists(self.role_mapping_file):
-            self._write_json({}, self.role_mapping_file)
+    async def migrate_legacy_state(self):
+        await asyncio.get_event_loop().run_in_executor(
+            None,
+            self.role_mapping.migrate_legacy,
+            ROLE_MAPPINGS_FILENAME,
+            self._split_legacy_mapping,
+        )
 
-        try:
-            with open(self.role_mapping_file, "r") as f:
-                self.role_mapping = json.loads(f.read())
-        except JSONDecodeError:
-            # Self-repair the file, but this means the mapping will be lost
-            self._write_json({}, self.role_mapping_file)
-            self.role_mapping = {}
+    def _split_legacy_mapping(self, role_mapping):
+        # Messages belong to the guild that has their roles
+        payloads = {}
+        for message_id, message_mapping in role_mapping.items():
+            role_ids = [int(role_id) for role_id in message_mapping["mapping"].values()]
+            guild = discord.utils.find(
+                lambda guild: any(guild.get_role(role_id) for role_id in role_ids),
+                self.client.guilds,
+            )
+            payloads.setdefault(guild.id if guild else None, {})[
+                message_id
+            ] = message_mapping
+        return payloads
 
-        self.role_collector = None
+    async def guild_state_unloaded(self, guild_id):
+        self.role_collector.pop(guild_id, None)
 
     @commands.command()
     @commands.is_owner()
@@ -59,7 +75,10 @@ class RoleDistributor(commands.Cog):
 
         Note that you can have as many messages mapped as you'd like.
         """
-        if self.role_collector is not None:
+        if ctx.guild is None:
+            return await ctx.send("Mapping sessions have to be started in a guild.")
+
+        if ctx.guild.id in self.role_collector:
             return await ctx.send(
                 "You're already in a mapping session. Finalize it with `!finalize_role_mapping`"
             )
@@ -67,7 +86,7 @@ class RoleDistributor(commands.Cog):
         if ctx.guild.id != message.guild.id:
             return await ctx.send("This message isn't in this guild.")
 
-        if str(message.id) in self.role_mapping:
+        if str(message.id) in self.role_mapping[ctx.guild.id]:
             await ctx.send(
                 "The current message already has a mapping. Do you want to overwrite it? (y/n)"
             )
@@ -79,7 +98,7 @@ class RoleDistributor(commands.Cog):
             if not reply or reply.content.lower() != "y":
                 return await ctx.send("Mapping cancelled.")
 
-        self.role_collector = {
+        self.role_collector[ctx.guild.id] = {
             "message": message,
             "mapping": {},
             "unique": "unique" in options,
@@ -97,7 +116,8 @@ class RoleDistributor(commands.Cog):
         """
         Adds an emote to role mapping to the current interactive session.
         """
-        if self.role_collector is None:
+        role_collector = self.role_collector.get(getattr(ctx.guild, "id", None))
+        if role_collector is None:
             return await ctx.send(
                 "You're not in a mapping session. Start one with `!initialize_role_mapping`"
             )
@@ -112,20 +132,20 @@ class RoleDistributor(commands.Cog):
             emote_str = str(emote.id)
 
         # Verify that we didn't already map the role
-        if str(role.id) in self.role_collector["mapping"].values():
+        if str(role.id) in role_collector["mapping"].values():
             return await ctx.send("This role is already mapped to an emote. Try again.")
 
         # Verify that the role isn't mapped to another message already
-        for message, mapping in self.role_mapping.items():
+        for message, mapping in self.role_mapping[ctx.guild.id].items():
             mapping = mapping["mapping"]
-            if message == str(self.role_collector["message"].id):
+            if message == str(role_collector["message"].id):
                 continue
             if str(role.id) in mapping.values():
                 return await ctx.send(
                     f"This role is already mapped to an emote in another message. Try again. (message_id: `{message}`)"
                 )
 
-        self.role_collector["mapping"][emote_str] = str(role.id)
+        role_collector["mapping"][emote_str] = str(role.id)
         await ctx.send(
             f"Successfully added `{emote}` for {role.mention}",
             allowed_mentions=discord.AllowedMentions.none(),
@@ -137,42 +157,44 @@ class RoleDistributor(commands.Cog):
         """
         Finalizes the role mapping.
         """
-        if self.role_collector is None:
+        role_collector = self.role_collector.pop(getattr(ctx.guild, "id", None), None)
+        if role_collector is None:
             return await ctx.send(
                 "You're not in a mapping session. Start one with `!initialize_role_mapping`"
             )
 
-        if not self.role_collector["mapping"]:
+        if not role_collector["mapping"]:
             await ctx.send("No mappings were added. Cancelling.")
         else:
-            self.role_mapping[str(self.role_collector["message"].id)] = {
-                "mapping": self.role_collector["mapping"],
-                "unique": self.role_collector["unique"],
+            self.role_mapping[ctx.guild.id][str(role_collector["message"].id)] = {
+                "mapping": role_collector["mapping"],
+                "unique": role_collector["unique"],
             }
-            self._write_json(self.role_mapping, self.role_mapping_file)
-            message = self.role_collector["message"]
-            await message.clear_reactions()
-            for eid in self.role_collector["mapping"].keys():
-                try:
-                    emoji = discord.utils.get(self.client.emojis, id=int(eid))
-                except ValueError:
-                    emoji = eid
-                await message.add_reaction(emoji)
-            await ctx.send("Done!")
-
-        self.role_collector = None
+            self.role_mapping.write(ctx.guild.id)
+            added, removed, missing = await self._sync_reactions(
+                role_collector["message"],
+                list(role_collector["mapping"].keys()),
+            )
+            message: str = f"Done! Added {added} and removed {removed} reactions."
+            if missing:
+                message += (
+                    f" Couldn't find {len(missing)} emojis, so they weren't added: "
+                    + ", ".join(f"`{key}`" for key in missing)
+                )
+            await ctx.send(message)
 
     @commands.command()
     @commands.is_owner()
     async def list_role_mappings(self, ctx):
         """
-        Lists the role mapping to your internal console.
+        Lists the guild's role mapping, or to your internal console if it's too long.
         """
-        if len(str(self.role_mapping)) > 2000:
-            print(self.role_mapping)
+        role_mapping = self.role_mapping.get(getattr(ctx.guild, "id", None)) or {}
+        if len(str(role_mapping)) > 2000:
+            print(role_mapping)
             await ctx.send("Output too long. Check your console output for the log.")
         else:
-            await ctx.send(f"```{self.role_mapping}```")
+            await ctx.send(f"```{role_mapping}```")
 
     @commands.command()
     @commands.is_owner()
@@ -183,19 +205,73 @@ class RoleDistributor(commands.Cog):
         Deletes a role mapping.
         """
         message_id = message if isinstance(message, str) else message.id
-        if str(message_id) not in self.role_mapping:
+        role_mapping = self.role_mapping.get(getattr(ctx.guild, "id", None)) or {}
+        if str(message_id) not in role_mapping:
             return await ctx.send("That message doesn't have a registered listener.")
 
-        del self.role_mapping[str(message_id)]
-        self._write_json(self.role_mapping, self.role_mapping_file)
+        del role_mapping[str(message_id)]
+        self.role_mapping.write(ctx.guild.id)
         if isinstance(message, discord.Message):
             await message.clear_reactions()
         await ctx.send("Done!")
 
     @staticmethod
-    def _write_json(payload, file):
-        with open(file, "w") as f:
-            json.dump(payload, f)
+    def _emoji_key(emoji: typing.Union[discord.Emoji, discord.PartialEmoji, str]):
+        # Mappings key unicode emojis by themselves and custom emojis by their ID
+        return emoji if isinstance(emoji, str) else str(emoji.id)
+
+    async def _sync_reactions(
+        self, message: discord.Message, emoji_keys: typing.List[str]
+    ) -> typing.Tuple[int, int, typing.List[str]]:
+        """
+        Makes the bot's reactions on the message match the mapped emojis, only adding
+        and removing the difference. Reactions are added in the mapping's order, while
+        removals run alongside; both go through the REST budget so they're paced by
+        the rate limits rather than running into them. Returns (added, removed,
+        missing), where missing are the keys of custom emojis the bot can't find.
+        """
+        # The message was fetched when the session started; get its current reactions
+        message = await message.channel.fetch_message(message.id)
+        existing: typing.Dict[str, discord.Reaction] = {
+            self._emoji_key(reaction.emoji): reaction for reaction in message.reactions
+        }
+        to_add: typing.List[str] = [
+            key for key in emoji_keys if key not in existing or not existing[key].me
+        ]
+        to_remove: typing.List[str] = [key for key in existing if key not in emoji_keys]
+        reactions_path: str = (
+            f"/channels/{message.channel.id}/messages/{message.id}/reactions"
+        )
+
+        added: typing.List[str] = []
+        missing: typing.List[str] = []
+
+        async def add_reactions():
+            for key in to_add:
+                try:
+                    emoji = self.client.get_emoji(int(key))
+                except ValueError:
+                    emoji = key
+                if emoji is None:
+                    logging.warning(f"Emoji {key} not found; skipping its reaction.")
+                    missing.append(key)
+                    continue
+                async with self.client.rest_budget.throttle(
+                    "PUT", f"{reactions_path}/{key}/@me"
+                ):
+                    await message.add_reaction(emoji)
+                added.append(key)
+
+        async def remove_reaction(key: str):
+            async with self.client.rest_budget.throttle(
+                "DELETE", f"{reactions_path}/{key}"
+            ):
+                await message.clear_reaction(existing[key].emoji)
+
+        await asyncio.gather(
+            add_reactions(), *[remove_reaction(key) for key in to_remove]
+        )
+        return len(added), len(to_remove), missing
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
@@ -205,6 +281,14 @@ class RoleDistributor(commands.Cog):
         """
         if payload.user_id == self.client.user.id:
             return
+        with REACTION_EVENT_LATENCY.time(event="add"):
+            await self._reaction_added(payload)
+
+    async def _reaction_added(self, payload):
+        if payload.guild_id is None:
+            return
+        await self.wait_for_state()
+        await self.load_guild(payload.guild_id)
         # Convert all the IDs to strings since our loaded JSON keys will be strings
         message_id_str = str(payload.message_id)
         emoji_id_str = (
@@ -213,11 +297,13 @@ class RoleDistributor(commands.Cog):
             else str(payload.emoji.id)
         )
 
-        if message_id_str in self.role_mapping:
-            mapping = self.role_mapping[message_id_str]["mapping"]
-            unique = self.role_mapping[message_id_str]["unique"]
+        role_mapping = self.role_mapping[payload.guild_id]
+        if message_id_str in role_mapping:
+            mapping = role_mapping[message_id_str]["mapping"]
+            unique = role_mapping[message_id_str]["unique"]
             guild = self.client.get_guild(payload.guild_id)
-            member = guild.get_member(payload.user_id)
+            # The event carries the member, so it works without the member cache
+            member = payload.member or await get_or_fetch_member(guild, payload.user_id)
             message = await self.client.get_channel(payload.channel_id).fetch_message(
                 payload.message_id
             )
@@ -237,7 +323,12 @@ class RoleDistributor(commands.Cog):
                             if str(r) != str(payload.emoji):
                                 await message.remove_reaction(r.emoji, member)
                     await member.add_roles(role)
-                    logging.info(f"Role {role} assigned to {member}!")
+                    logging.info(
+                        "Role %s assigned to %s!",
+                        role,
+                        member,
+                        extra={"sample": "reaction_role"},
+                    )
                 else:
                     logging.info("Member not found, or role was invalid.")
             else:
@@ -251,6 +342,14 @@ class RoleDistributor(commands.Cog):
         """
         if payload.user_id == self.client.user.id:
             return
+        with REACTION_EVENT_LATENCY.time(event="remove"):
+            await self._reaction_removed(payload)
+
+    async def _reaction_removed(self, payload):
+        if payload.guild_id is None:
+            return
+        await self.wait_for_state()
+        await self.load_guild(payload.guild_id)
 
         message_id_str = str(payload.message_id)
         emoji_id_str = (
@@ -259,17 +358,24 @@ class RoleDistributor(commands.Cog):
             else str(payload.emoji.id)
         )
 
-        if message_id_str in self.role_mapping:
-            mapping = self.role_mapping[message_id_str]["mapping"]
+        role_mapping = self.role_mapping[payload.guild_id]
+        if message_id_str in role_mapping:
+            mapping = role_mapping[message_id_str]["mapping"]
             guild = self.client.get_guild(payload.guild_id)
-            member = guild.get_member(payload.user_id)
 
             if emoji_id_str in mapping:
                 role = discord.utils.get(guild.roles, id=int(mapping[emoji_id_str]))
+                # Removals don't carry the member; with a lean cache it's fetched
+                member = await get_or_fetch_member(guild, payload.user_id)
 
                 if member is not None and role is not None:
                     await member.remove_roles(role)
-                    logging.info(f"Role {role} removed from {member}!")
+                    logging.info(
+                        "Role %s removed from %s!",
+                        role,
+                        member,
+                        extra={"sample": "reaction_role"},
+                    )
                 else:
                     logging.info("Member not found.")
 
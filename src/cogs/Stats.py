@@ -0,0 +1,274 @@
+"""
+Runtime metrics for the bot's owner
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from discord.ext import commands
+
+from utils.CacheProfile import ensure_chunked, format_cache_report
+from utils.Metrics import (
+    COMMAND_ERRORS,
+    COMMAND_LATENCY,
+    COURSE_LOOKUPS,
+    DISCORD_BACKGROUND_WAIT,
+    DISCORD_RATE_LIMITS,
+    DISCORD_REQUEST_LATENCY,
+    DISCORD_REQUESTS,
+    EVENT_LOOP_LAG,
+    JOB_RUNS,
+    LOOP_TICK_DURATION,
+    METRICS_PORT,
+    REACTION_EVENT_LATENCY,
+    REGISTRY,
+    UBC_REQUEST_LATENCY,
+    UBC_REQUEST_RETRIES,
+    Histogram,
+    monitor_event_loop_lag,
+    start_metrics_server,
+)
+from utils.Paginator import Paginator
+
+# Routes listed by `!stats`, busiest first
+MAX_STATS_ROUTES: int = 5
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+
+def _latency(histogram: Histogram, key: Tuple[str, ...]) -> str:
+    count, _, longest = histogram.summary(key)
+    return (
+        f"{count}x, p50 {_ms(histogram.quantile(0.5, key))}, "
+        f"p95 {_ms(histogram.quantile(0.95, key))}, max {_ms(longest)}"
+    )
+
+
+class Stats(commands.Cog):
+    """
+    Cog that records command latencies, runs the event loop lag monitor and serves
+    the metrics endpoint (see `utils.Metrics`)
+    """
+
+    def __init__(self, client: commands.Bot):
+        self.client: commands.Bot = client
+        self._lag_monitor: Optional[asyncio.Future] = None
+        self._server: Optional[Any] = None
+
+    def cog_unload(self):
+        if self._lag_monitor is not None:
+            self._lag_monitor.cancel()
+        if self._server is not None:
+            asyncio.ensure_future(self._server.cleanup())
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self._lag_monitor is None:
+            self._lag_monitor = asyncio.ensure_future(monitor_event_loop_lag())
+        if self._server is None:
+            try:
+                # Shard processes on the same host serve on consecutive ports
+                self._server = await start_metrics_server(
+                    port=METRICS_PORT + (self.client.shard_id or 0)
+                )
+            except OSError as e:
+                # Keep recording; `!stats` still works without the endpoint
+                logging.warning(f"Failed to start the metrics endpoint: {e}")
+
+    @commands.Cog.listener()
+    async def on_command(self, ctx: commands.Context):
+        ctx.metrics_started_at = time.perf_counter()
+
+    def _observe_command(self, ctx: commands.Context) -> None:
+        started_at: Optional[float] = getattr(ctx, "metrics_started_at", None)
+        if ctx.command is not None and started_at is not None:
+            COMMAND_LATENCY.observe(
+                time.perf_counter() - started_at, command=ctx.command.qualified_name
+            )
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx: commands.Context):
+        self._observe_command(ctx)
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx: commands.Context, error: Exception):
+        # Unknown commands (including FAQs) don't have a command to attribute
+        if ctx.command is None:
+            return
+        self._observe_command(ctx)
+        if isinstance(error, commands.errors.CommandInvokeError):
+            error = error.original
+        COMMAND_ERRORS.inc(
+            command=ctx.command.qualified_name, error=type(error).__name__
+        )
+
+    def _format_stats(self) -> List[str]:
+        uptime: int = int(time.time() - REGISTRY.started_at)
+        entries: List[str] = [
+            f"**Uptime:** {uptime // 3600}h {uptime % 3600 // 60}m",
+            f"**Event loop lag:** {_latency(EVENT_LOOP_LAG, ())}",
+            "**Commands**",
+        ]
+        errors: Dict[str, float] = {}
+        for command, error in COMMAND_ERRORS.series():
+            errors[command] = errors.get(command, 0.0) + COMMAND_ERRORS.value(
+                command=command, error=error
+            )
+        for key in sorted(
+            COMMAND_LATENCY.series(), key=lambda key: -COMMAND_LATENCY.summary(key)[0]
+        ):
+            entries.append(
+                f"`{key[0]}` {_latency(COMMAND_LATENCY, key)}"
+                + (f", {errors[key[0]]:.0f} failed" if key[0] in errors else "")
+            )
+
+        entries.append("**Background jobs**")
+        job_runs: Dict[Tuple[str, ...], float] = {
+            key: JOB_RUNS.value(job=key[0], outcome=key[1]) for key in JOB_RUNS.series()
+        }
+        for key in sorted(LOOP_TICK_DURATION.series()):
+            skipped: float = job_runs.get((key[0], "skipped"), 0.0)
+            failed: float = job_runs.get((key[0], "error"), 0.0)
+            entries.append(
+                f"`{key[0]}` {_latency(LOOP_TICK_DURATION, key)}"
+                + (f", {skipped:.0f} skipped" if skipped else "")
+                + (f", {failed:.0f} failed" if failed else "")
+            )
+        entries.append("**Reaction roles**")
+        entries += [
+            f"`{key[0]}` {_latency(REACTION_EVENT_LATENCY, key)}"
+            for key in sorted(REACTION_EVENT_LATENCY.series())
+        ]
+
+        requests: Dict[str, float] = {}
+        for method, route, status in DISCORD_REQUESTS.series():
+            requests[route] = requests.get(route, 0.0) + DISCORD_REQUESTS.value(
+                method=method, route=route, status=status
+            )
+        rate_limits: Dict[str, float] = {}
+        for route, scope in DISCORD_RATE_LIMITS.series():
+            rate_limits[route] = rate_limits.get(route, 0.0)
+            rate_limits[route] += DISCORD_RATE_LIMITS.value(route=route, scope=scope)
+        entries.append(
+            f"**Discord REST:** {sum(requests.values()):.0f} requests, "
+            f"{sum(rate_limits.values()):.0f} rate limited"
+        )
+        for route in sorted(requests, key=lambda route: -requests[route])[
+            :MAX_STATS_ROUTES
+        ]:
+            entries.append(
+                f"`{route}` {_latency(DISCORD_REQUEST_LATENCY, (route,))}"
+                + (f", {rate_limits[route]:.0f}x 429" if route in rate_limits else "")
+            )
+
+        throttled: List[Tuple[int, float, float]] = [
+            DISCORD_BACKGROUND_WAIT.summary(key)
+            for key in DISCORD_BACKGROUND_WAIT.series()
+        ]
+        entries.append(
+            f"**Background jobs throttled:** {sum(wait[0] for wait in throttled)}x, "
+            f"{sum(wait[1] for wait in throttled):.1f}s in total"
+        )
+        entries.append(f"**UBC calendar:** {UBC_REQUEST_RETRIES.value():.0f} retries")
+        entries += [
+            f"`{key[0]}` {_latency(UBC_REQUEST_LATENCY, key)}"
+            for key in sorted(UBC_REQUEST_LATENCY.series())
+        ]
+        lookups: Dict[str, float] = {
+            key[0]: COURSE_LOOKUPS.value(source=key[0])
+            for key in COURSE_LOOKUPS.series()
+        }
+        if lookups:
+            entries.append(
+                f"**Course lookups:** {sum(lookups.values()):.0f}, "
+                f"{lookups.get('catalogue', 0.0) / sum(lookups.values()):.0%} "
+                "answered by the catalogue"
+            )
+        return entries
+
+    @commands.command()
+    @commands.is_owner()
+    async def stats(self, ctx: commands.Context):
+        """
+        Shows latencies and request counts since the bot started. The same metrics
+        are served in the Prometheus format on the local metrics endpoint.
+
+        **Example(s)**
+          `[p]stats` - shows the current metrics
+        """
+        await Paginator(
+            title="Bot Stats", entries=self._format_stats(), entries_per_page=20
+        ).paginate(ctx)
+
+    @commands.command()
+    @commands.is_owner()
+    async def shards(self, ctx: commands.Context):
+        """
+        Shows the shard processes' health, as seen by their supervisor. Only
+        available when the bot was started with `--shards`.
+
+        **Example(s)**
+          `[p]shards` - lists every shard's status, guilds and last heartbeat
+        """
+        if self.client.shard_store is None:
+            return await ctx.send("The bot isn't running as shard processes.")
+        rows: List[Dict[str, Any]] = await asyncio.get_event_loop().run_in_executor(
+            None, self.client.shard_store.shards
+        )
+        now: float = time.time()
+        await Paginator(
+            title="Shards",
+            entries=[
+                f"**Shard {row['shard_id']}** (pid {row['pid']}): {row['status']}, "
+                f"{row['guild_count']} guilds, {row['restarts']} restarts, "
+                + (
+                    f"heartbeat {now - row['heartbeat_at']:.0f}s ago"
+                    if row["heartbeat_at"] is not None
+                    else "no heartbeat yet"
+                )
+                for row in rows
+            ],
+        ).paginate(ctx)
+
+    @commands.group()
+    @commands.is_owner()
+    async def cache(self, ctx: commands.Context):
+        """
+        Inspect discord.py's cache, whose size is set by the cache profile the bot
+        was started with (`--cache-profile`).
+        """
+        if ctx.invoked_subcommand is None:
+            raise commands.errors.BadArgument
+
+    @cache.command(name="report")
+    async def cache_report(self, ctx: commands.Context):
+        """
+        Shows how many guilds, members, messages, etc. are cached, and roughly how
+        much memory they take.
+
+        **Example(s)**
+          `[p]cache report` - shows the cache's contents and estimated size
+        """
+        await Paginator(
+            title="Discord Cache", entries=format_cache_report(self.client)
+        ).paginate(ctx)
+
+    @cache.command(name="chunk")
+    @commands.guild_only()
+    async def cache_chunk(self, ctx: commands.Context):
+        """
+        Caches every member of this server, eg. to look through its members. The
+        lean cache profile doesn't, so that memory doesn't grow with every server.
+
+        **Example(s)**
+          `[p]cache chunk` - requests and caches this server's member list
+        """
+        async with ctx.typing():
+            await ensure_chunked(ctx.guild)
+        await ctx.send(f"Cached {len(ctx.guild.members)} members.")
+
+
+def setup(client):
+    client.add_cog(Stats(client))
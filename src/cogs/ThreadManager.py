@@ -1,28 +1,35 @@
+import asyncio
 import logging
-from typing import Dict, Union, List
+from typing import Any, Dict, Optional, Union, List, Tuple
 import discord
-from discord.ext import commands, tasks
-from utils.JsonTools import read_json, write_json
+from discord.ext import commands
+from utils.GuildState import GuildStateCog, GuildStateStore
 from utils.Checks import ban_members_check
 from utils.Paginator import Paginator
+from utils.Scheduler import IntervalTrigger
 
 """
-The JSON schema of this file should be:
+Each guild has its own file (see `GuildStateStore`). The JSON schema of this file
+should be:
 {
-    "<guild_id: str>": [
+    "pinned_threads": [
         <thread_id: int>,
         <thread_id: int>,
         ...
-    ],
-    ...
+    ]
 }
+Before that, a single file was keyed by "<guild_id: str>"; it's migrated on startup.
 """
 THREAD_MANAGER_FILENAME: str = "thread_manager.json"
+PINNED_THREADS_KEY: str = "pinned_threads"
 
 AUTO_ARCHIVE_DURATION: int = 1440
+# How often archived pinned threads are looked for (see `_refresh_threads`)
+REFRESH_INTERVAL: float = 1.0
+REFRESH_JOB: str = "thread_manager.refresh"
 
 
-class ThreadManager(commands.Cog):
+class ThreadManager(GuildStateCog):
     """
     Cog for general thread management. Currently, only supports pinning threads.
     (unarchiving them when they get archived)
@@ -30,9 +37,33 @@ class ThreadManager(commands.Cog):
     """
 
     def __init__(self, client: commands.Bot):
-        self.client: commands.Bot = client
-        self.thread_mappings: Dict[str, List[int]] = read_json(THREAD_MANAGER_FILENAME)
-        self.thread_refresher_task.start()
+        super().__init__(client)
+        self.thread_mappings: GuildStateStore = GuildStateStore(THREAD_MANAGER_FILENAME)
+        self.guild_stores = [self.thread_mappings]
+
+    async def load_state(self):
+        await super().load_state()
+        self.client.scheduler.add_job(
+            REFRESH_JOB, self._refresh_threads, IntervalTrigger(REFRESH_INTERVAL)
+        )
+
+    async def migrate_legacy_state(self):
+        await asyncio.get_event_loop().run_in_executor(
+            None,
+            self.thread_mappings.migrate_legacy,
+            THREAD_MANAGER_FILENAME,
+            lambda mappings: {
+                int(guild_id_str): {PINNED_THREADS_KEY: thread_ids}
+                for guild_id_str, thread_ids in mappings.items()
+            },
+        )
+
+    def _pinned_threads(self, guild_id: int) -> List[int]:
+        return self.thread_mappings[guild_id].setdefault(PINNED_THREADS_KEY, [])
+
+    def cog_unload(self):
+        self.client.scheduler.remove_job(REFRESH_JOB)
+        super().cog_unload()
 
     @commands.group(aliases=["t"])
     @commands.guild_only()
@@ -54,14 +85,12 @@ class ThreadManager(commands.Cog):
         **Example(s)**
           `[p]thread pin #some-thread` - pin the thread #some-thread to unarchive automatically.
         """
-        guild_id_str: str = str(ctx.guild.id)
-        if thread.id in self.thread_mappings.get(guild_id_str, []):
+        pinned_threads: List[int] = self._pinned_threads(ctx.guild.id)
+        if thread.id in pinned_threads:
             return await ctx.reply(f"{thread.mention} is already pinned.")
         else:
-            if guild_id_str not in self.thread_mappings:
-                self.thread_mappings[guild_id_str] = []
-            self.thread_mappings[guild_id_str].append(thread.id)
-            write_json(THREAD_MANAGER_FILENAME, self.thread_mappings)
+            pinned_threads.append(thread.id)
+            self.thread_mappings.write(ctx.guild.id)
             return await ctx.reply(f"Done! Pinned {thread.mention}")
 
     @threads.command(aliases=["u"])
@@ -74,10 +103,10 @@ class ThreadManager(commands.Cog):
         **Example(s)**
           `[p]thread unpin #some-thread` - unpins the thread #some-thread.
         """
-        guild_id_str: str = str(ctx.guild.id)
-        if thread.id in self.thread_mappings[guild_id_str]:
-            self.thread_mappings[guild_id_str].remove(thread.id)
-            write_json(THREAD_MANAGER_FILENAME, self.thread_mappings)
+        pinned_threads: List[int] = self._pinned_threads(ctx.guild.id)
+        if thread.id in pinned_threads:
+            pinned_threads.remove(thread.id)
+            self.thread_mappings.write(ctx.guild.id)
             return await ctx.reply(
                 f"Done! Removed {thread.mention} from pinned threads."
             )
@@ -93,7 +122,7 @@ class ThreadManager(commands.Cog):
         """
         guild_id_str: str = str(ctx.guild.id)
         thread_listing: List[str] = []
-        for thread_id in self.thread_mappings.get(guild_id_str, []):
+        for thread_id in self._pinned_threads(ctx.guild.id):
             thread: discord.Thread = self.client.get_channel(thread_id)
             if not thread:
                 thread_listing.append(f" - `{thread_id}` (error getting thread)")
@@ -107,24 +136,24 @@ class ThreadManager(commands.Cog):
             entries_per_page=25,
         ).paginate(ctx)
 
-    @tasks.loop(seconds=1)
-    async def thread_refresher_task(self):
+    async def _refresh_threads(self):
         """
         Threads automatically archive after inactivity. We'll iterate over all the threads
         and unarchive the ones that are archived. This shouldn't be expensive since it doesn't
         make any API calls unless the thread is archived (which was pushed to us by the gateway).
 
-        This task is also equivalent to the one from {CourseThreads.py} but whatever.
+        This job is also equivalent to the one from {CourseThreads.py} but whatever.
+        Only the threads of the loaded guilds (ie. this process's shards) are checked.
         """
         try:
             if self.client.is_ready():
-                thread_ids: List[int] = [
-                    thread_id
-                    for threads in self.thread_mappings.values()
-                    for thread_id in threads
+                thread_ids: List[Tuple[int, int]] = [
+                    (guild_id, thread_id)
+                    for guild_id, mappings in self.thread_mappings.items()
+                    for thread_id in mappings.get(PINNED_THREADS_KEY, [])
                 ]
 
-                for thread_id in thread_ids:
+                for guild_id, thread_id in thread_ids:
                     thread: Union[discord.Thread, None] = self.client.get_channel(
                         thread_id
                     )
@@ -132,34 +161,40 @@ class ThreadManager(commands.Cog):
                     # getter will return None and we'll have to make an API call
                     if thread is None:
                         try:
-                            thread: discord.Thread = await self.client.fetch_channel(
-                                thread_id
-                            )
+                            async with self.client.rest_budget.throttle(
+                                "GET", f"/channels/{thread_id}"
+                            ):
+                                thread: discord.Thread = (
+                                    await self.client.fetch_channel(thread_id)
+                                )
                         except discord.errors.NotFound:
                             # Thrown if the thread isn't found, which should only happen
                             # if the thread was manually deleted; clean this thread up
 
                             # NOTE: this should _rarely_ be called. It's a user error if
                             # we ever get to this catch, but we do this defensively.
-                            # Also, since it shouldn't get called at all, it's extremely inefficient
-                            guild_id_str: Union[None, str] = None
-                            for guild, threads in self.thread_mappings.items():
-                                if thread_id in threads:
-                                    guild_id_str = guild
-                                    break
-                            if guild_id_str:
-                                self.thread_mappings[guild_id_str].remove(thread_id)
-                            write_json(THREAD_MANAGER_FILENAME, self.thread_mappings)
+                            mappings: Optional[
+                                Dict[str, Any]
+                            ] = self.thread_mappings.get(guild_id)
+                            # The guild may have been unloaded meanwhile
+                            if mappings is not None and thread_id in mappings.get(
+                                PINNED_THREADS_KEY, []
+                            ):
+                                mappings[PINNED_THREADS_KEY].remove(thread_id)
+                                self.thread_mappings.write(guild_id)
                             continue
 
                     if thread.archived:
                         logging.info(
                             f"Unarchived thread with thread ID: {thread_id}, name: {thread.name}"
                         )
-                        await thread.edit(
-                            archived=False,
-                            auto_archive_duration=AUTO_ARCHIVE_DURATION,
-                        )
+                        async with self.client.rest_budget.throttle(
+                            "PATCH", f"/channels/{thread_id}"
+                        ):
+                            await thread.edit(
+                                archived=False,
+                                auto_archive_duration=AUTO_ARCHIVE_DURATION,
+                            )
         except Exception as e:
             logging.info(f"Thread manager refresher error: {e}")
 
@@ -0,0 +1,127 @@
+import sys
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+import discord
+from discord.ext import commands
+from discord.state import ConnectionState
+
+# Members are looked up as needed rather than cached (see `CACHE_PROFILES`)
+DEFAULT_CACHE_PROFILE: str = "lean"
+
+# Objects measured per kind by `format_cache_report`, which extrapolates the rest
+CACHE_SAMPLE_SIZE: int = 200
+
+
+class CacheProfile(NamedTuple):
+    """How much of the gateway state discord.py keeps in memory."""
+
+    member_cache_flags: Callable[[discord.Intents], discord.MemberCacheFlags]
+    # Messages kept for edit/delete events and `client.cached_messages`
+    max_messages: Optional[int]
+    # Whether every guild's member list is requested when the bot connects
+    chunk_guilds_at_startup: bool
+
+    def client_options(self, intents: discord.Intents) -> Dict[str, Any]:
+        return {
+            "intents": intents,
+            "member_cache_flags": self.member_cache_flags(intents),
+            "max_messages": self.max_messages,
+            "chunk_guilds_at_startup": self.chunk_guilds_at_startup,
+        }
+
+
+CACHE_PROFILES: Dict[str, CacheProfile] = {
+    # discord.py's defaults: every member of every guild, and the last 1000 messages
+    "full": CacheProfile(discord.MemberCacheFlags.from_intents, 1000, True),
+    # Members are cached as events bring them in, but guilds aren't chunked up front
+    # and no messages are kept; no cog listens to message edits or deletes
+    "members": CacheProfile(discord.MemberCacheFlags.from_intents, None, False),
+    # Only the bot itself is cached; reaction roles get the member from the event or
+    # fetch it, and guilds are chunked on demand (see `ensure_chunked`)
+    "lean": CacheProfile(lambda intents: discord.MemberCacheFlags.none(), None, False),
+}
+
+
+async def get_or_fetch_member(
+    guild: discord.Guild, user_id: int
+) -> Optional[discord.Member]:
+    """The cached member, or with a lean cache, the member fetched over REST."""
+    member: Optional[discord.Member] = guild.get_member(user_id)
+    if member is not None:
+        return member
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
+
+
+async def ensure_chunked(guild: discord.Guild) -> None:
+    """Requests and caches the guild's whole member list, if it isn't already."""
+    if not guild.chunked:
+        await guild.chunk(cache=True)
+
+
+def _is_shared(value: Any) -> bool:
+    # Other models (which have IDs) are measured as their own kind, and the
+    # connection state is shared by everything
+    return isinstance(value, ConnectionState) or (
+        not isinstance(value, (int, str))
+        and getattr(type(value), "id", None) is not None
+    )
+
+
+def _size(obj: Any, seen: Set[int]) -> int:
+    """The size of an object with the containers and values it holds."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size: int = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        children: Iterable[Any] = [*obj.keys(), *obj.values()]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        children = obj
+    else:
+        children = [
+            getattr(obj, slot, None)
+            for cls in type(obj).__mro__
+            for slot in getattr(cls, "__slots__", ())
+        ] + list(getattr(obj, "__dict__", {}).values())
+    return size + sum(_size(child, seen) for child in children if not _is_shared(child))
+
+
+def _estimate(objects: List[Any]) -> int:
+    """Bytes held by the objects, extrapolated from a sample of them."""
+    if not objects:
+        return 0
+    step: int = max(1, len(objects) // CACHE_SAMPLE_SIZE)
+    sample: List[Any] = objects[::step][:CACHE_SAMPLE_SIZE]
+    seen: Set[int] = set()
+    return sum(_size(obj, seen) for obj in sample) * len(objects) // len(sample)
+
+
+def format_cache_report(client: commands.Bot) -> List[str]:
+    """
+    Counts what discord.py has cached and estimates the memory it takes; blocks
+    for a few milliseconds per kind, regardless of how much is cached.
+    """
+    guilds: List[discord.Guild] = client.guilds
+    kinds: Dict[str, List[Any]] = {
+        "Guilds": guilds,
+        "Members": [member for guild in guilds for member in guild.members],
+        "Users": client.users,
+        "Channels": [channel for guild in guilds for channel in guild.channels],
+        "Threads": [thread for guild in guilds for thread in guild.threads],
+        "Roles": [role for guild in guilds for role in guild.roles],
+        "Emojis": list(client.emojis),
+        "Messages": list(client.cached_messages),
+    }
+    sizes: Dict[str, int] = {
+        kind: _estimate(objects) for kind, objects in kinds.items()
+    }
+    chunked: int = sum(guild.chunked for guild in guilds)
+    return [
+        f"**Estimated total:** {sum(sizes.values()) / 1024:.0f} KiB, "
+        f"{chunked}/{len(guilds)} guilds chunked"
+    ] + [
+        f"**{kind}:** {len(objects)}, ~{sizes[kind] / 1024:.0f} KiB"
+        for kind, objects in kinds.items()
+    ]
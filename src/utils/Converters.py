@@ -1,16 +1,43 @@
 from __future__ import annotations
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
+from weakref import WeakValueDictionary
 from discord.ext import commands
 import re
 
 
 MAX_COURSE_STR_LENGTH = 9
 
+# Eg. "CPEN 211", "cpen211" or "CPEN 491A"
+COURSE_PATTERN = re.compile(r"\b([A-Za-z]{4})(?:\s*)([0-9]{3}[A-Za-z]{0,1})\b")
+# The calendar always writes courses in upper case, while prose like "with 120
+# credits" would match the case-insensitive pattern
+STRICT_COURSE_PATTERN = re.compile(r"\b([A-Z]{4})(?:\s*)([0-9]{3}[A-Z]{0,1})\b")
+
 
 class Course:
-    def __init__(self, *, dept: str, course: str):
-        self._dept: str = dept.upper()
-        self._course: str = course.upper()
+    """
+    Immutable course value. Instances are interned, so equal courses are the same
+    object and can be compared and hashed cheaply.
+    """
+
+    __slots__ = ("_dept", "_course", "_key", "__weakref__")
+
+    _interned: WeakValueDictionary = WeakValueDictionary()
+
+    def __new__(cls, *, dept: str, course: str) -> Course:
+        dept, course = dept.upper(), course.upper()
+        key: str = f"{dept} {course}"
+        instance: Optional[Course] = cls._interned.get(key)
+        if instance is None:
+            instance = super().__new__(cls)
+            instance._dept = dept
+            instance._course = course
+            instance._key = key
+            cls._interned[key] = instance
+        return instance
+
+    def __getnewargs_ex__(self) -> Tuple[Tuple[Any, ...], Dict[str, str]]:
+        return (), {"dept": self._dept, "course": self._course}
 
     @property
     def dept(self) -> str:
@@ -25,11 +52,25 @@ class Course:
         return self._course[0]
 
     def __str__(self) -> str:
-        return f"{self.dept} {self.course}"
+        return self._key
+
+    def __repr__(self) -> str:
+        return f"Course({self._key!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Course):
+            return NotImplemented
+        return self._key == other._key
+
+    def __lt__(self, other: Course) -> bool:
+        return self._key < other._key
+
+    def __hash__(self) -> int:
+        return hash(self._key)
 
     @classmethod
     def parse(cls, raw: str) -> Optional[Course]:
-        match = re.search(r"\b([A-Za-z]{4})(?:\s*)([0-9]{3}[A-Za-z]{0,1})\b", raw)
+        match = COURSE_PATTERN.search(raw)
         if not match:
             return None
         dept, course = match.groups()
@@ -37,6 +78,20 @@ class Course:
             return None
         return Course(dept=dept, course=course)
 
+    @classmethod
+    def find_all(cls, text: str, strict: bool = False) -> List[Course]:
+        """
+        Returns every distinct course in the text in order of first appearance, in a
+        single scan. With `strict`, only upper case codes (as in the calendar) match.
+        """
+        pattern = STRICT_COURSE_PATTERN if strict else COURSE_PATTERN
+        found: Dict[str, Course] = {}
+        for dept, course in pattern.findall(text):
+            key: str = f"{dept} {course}".upper()
+            if key not in found:
+                found[key] = Course(dept=dept, course=course)
+        return list(found.values())
+
     @classmethod
     async def convert(cls, ctx: commands.Context, argument: str) -> Course:
         if len(argument) > MAX_COURSE_STR_LENGTH:
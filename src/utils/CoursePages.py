@@ -0,0 +1,268 @@
+import html
+import pickle
+import re
+import sys
+from html.parser import HTMLParser
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Parsing of the UBC calendar's department pages. Run as a module, this is also the
+# parser processes' entry point (see `UBCCourseInfo.ParserProcessPool`), so it must
+# not import discord code; courses are passed around as keys (eg. "CPEN 211")
+# rather than `Course`s. bs4 is imported by the backends that use it, so that
+# neither the bot nor the parser processes load it unless a soup backend is picked
+
+# Size of the chunks fed into the streaming extractor
+STREAM_CHUNK_SIZE: int = 16 * 1024
+
+# The reference backend; others are only picked if they agree with it
+DEFAULT_PARSER_BACKEND: str = "html.parser"
+
+# Whole-page parses use this backend unless one has been pinned; it only uses the
+# standard library and doesn't rely on the page layout like the regex extractor
+DEFAULT_BULK_PARSER_BACKEND: str = "stream"
+
+# (title text, description text) of a single course block
+CourseBlock = Tuple[str, str]
+
+# Yields the course blocks of a department page in document order
+BlockExtractor = Callable[[str], Iterator[CourseBlock]]
+
+# Titles look like "CPEN 211 (4) Introduction to Microcomputers"; the whole code is
+# matched so that CPEN 211 doesn't match CPEN 211A
+_TITLE_COURSE_PATTERN = re.compile(r"\s*([A-Z]{4}) ([0-9]{3}[A-Z]?)(?![0-9A-Za-z])")
+
+
+def _is_title_for(title: str, course_key: str) -> bool:
+    return re.match(rf"\s*{re.escape(course_key)}(?![0-9A-Za-z])", title) is not None
+
+
+def _soup_extractor(features: str) -> BlockExtractor:
+    def extract(content: str) -> Iterator[CourseBlock]:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(content, features)
+        for container in soup.find_all("div", class_="text-formatted"):
+            title = container.find("h3")
+            if title is None:
+                continue
+            description = container.find("p")
+            yield title.text, description.text if description else ""
+
+    return extract
+
+
+_BLOCK_PATTERN = re.compile(
+    r"<div\b[^>]*\bclass=\"[^\"]*\btext-formatted\b[^\"]*\"[^>]*>(.*?)</div>",
+    re.DOTALL | re.IGNORECASE,
+)
+_TITLE_PATTERN = re.compile(r"<h3\b[^>]*>(.*?)</h3>", re.DOTALL | re.IGNORECASE)
+_PARAGRAPH_PATTERN = re.compile(r"<p\b[^>]*>(.*?)</p>", re.DOTALL | re.IGNORECASE)
+_TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+def _strip_tags(fragment: str) -> str:
+    return html.unescape(_TAG_PATTERN.sub("", fragment))
+
+
+def _regex_extractor(content: str) -> Iterator[CourseBlock]:
+    """
+    Extracts the course blocks without building a DOM. This relies on the course
+    blocks not containing nested divs, which holds for the UBC calendar.
+    """
+    for block in _BLOCK_PATTERN.finditer(content):
+        title_match = _TITLE_PATTERN.search(block.group(1))
+        if title_match is None:
+            continue
+        description_match = _PARAGRAPH_PATTERN.search(block.group(1))
+        yield (
+            _strip_tags(title_match.group(1)),
+            _strip_tags(description_match.group(1)) if description_match else "",
+        )
+
+
+class CourseBlockStream(HTMLParser):
+    """
+    Incremental extractor for course blocks. Feed it the page in chunks; every
+    `div.text-formatted` block is appended to `blocks` as soon as it closes, so
+    callers can stop reading once they've found what they need. Only the text of
+    the block being read is kept in memory.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[CourseBlock] = []
+        # Depth of divs inside the current block; 0 when outside of a block
+        self._div_depth: int = 0
+        # Tag ("h3" or "p") whose text is currently being captured
+        self._capture: Optional[str] = None
+        self._capture_depth: int = 0
+        self._title: Optional[List[str]] = None
+        self._paragraph: Optional[List[str]] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if tag == "div":
+            if self._div_depth:
+                self._div_depth += 1
+            elif "text-formatted" in (dict(attrs).get("class") or "").split():
+                self._div_depth = 1
+                self._title, self._paragraph = None, None
+            return
+        if not self._div_depth:
+            return
+        if self._capture is not None:
+            if tag == self._capture:
+                self._capture_depth += 1
+        elif tag == "h3" and self._title is None:
+            self._capture, self._capture_depth, self._title = "h3", 1, []
+        elif tag == "p" and self._paragraph is None:
+            self._capture, self._capture_depth, self._paragraph = "p", 1, []
+
+    def handle_endtag(self, tag: str):
+        if not self._div_depth:
+            return
+        if tag == self._capture:
+            self._capture_depth -= 1
+            if not self._capture_depth:
+                self._capture = None
+        elif tag == "div":
+            self._div_depth -= 1
+            if not self._div_depth and self._title is not None:
+                self.blocks.append(
+                    ("".join(self._title), "".join(self._paragraph or []))
+                )
+
+    def handle_data(self, data: str):
+        if self._capture == "h3":
+            self._title.append(data)
+        elif self._capture == "p":
+            self._paragraph.append(data)
+
+
+def _stream_extractor(content: str) -> Iterator[CourseBlock]:
+    # Feed the buffered page in chunks too, so a lookup can stop at its course
+    stream: CourseBlockStream = CourseBlockStream()
+    for start in range(0, len(content), STREAM_CHUNK_SIZE):
+        stream.feed(content[start : start + STREAM_CHUNK_SIZE])
+        yield from stream.blocks
+        stream.blocks.clear()
+    stream.close()
+    yield from stream.blocks
+
+
+PARSER_BACKENDS: Dict[str, BlockExtractor] = {
+    "html.parser": _soup_extractor("html.parser"),
+    "lxml": _soup_extractor("lxml"),
+    "regex": _regex_extractor,
+    "stream": _stream_extractor,
+}
+
+
+def build_course_info(
+    course_key: str, block: CourseBlock, url: str
+) -> Optional[Dict[str, str]]:
+    """The course info of a block; `url` is its department page."""
+    title, desc = block
+    prereqs, coreqs = "None", "None"
+    title_parse = re.search(r"(?:[\S\s]+?)\(([0-9]+?)\)([\S\s]+)", title)
+    if not title_parse:
+        return None
+    pres = re.search(r"(?:Prerequisite\:)([\S\s]+?\.)", desc)
+    cos = re.search(r"(?:Corequisite\:)([\S\s]+?\.)", desc)
+    credits, name = title_parse.groups()
+    desc = desc.replace("This course is not eligible for Credit/D/Fail grading.", "")
+    if pres:
+        prereqs = pres.group(1)
+        desc = desc.replace(pres.group(0), "")
+    if cos:
+        coreqs = cos.group(1)
+        desc = desc.replace(cos.group(0), "")
+    return {
+        "url": url,
+        "name": f"{course_key} {name.strip()}",
+        "description": desc.strip(),
+        "prerequisites": prereqs.strip(),
+        "corequisites": coreqs.strip(),
+        "credits": str(credits),
+        "footer": "Source: UBC Course Schedule (Vancouver)",
+    }
+
+
+def find_course_block(
+    blocks: Iterator[CourseBlock], course_key: str
+) -> Optional[CourseBlock]:
+    for block in blocks:
+        if _is_title_for(block[0], course_key):
+            return block
+    return None
+
+
+def parse_course_page(
+    content: str, course_key: str, url: str, backend: str = DEFAULT_PARSER_BACKEND
+) -> Optional[Dict[str, str]]:
+    """Parses a course's info out of its department page with the given backend."""
+    block: Optional[CourseBlock] = find_course_block(
+        PARSER_BACKENDS[backend](content), course_key
+    )
+    return build_course_info(course_key, block, url) if block is not None else None
+
+
+def parse_department_page(
+    content: str, url: str, backend: str = DEFAULT_BULK_PARSER_BACKEND
+) -> Dict[str, Dict[str, str]]:
+    """
+    Parses every course on a department page, keyed by course (eg. "CPEN 211").
+    """
+    courses: Dict[str, Dict[str, str]] = {}
+    for block in PARSER_BACKENDS[backend](content):
+        match = _TITLE_COURSE_PATTERN.match(block[0])
+        if match is None:
+            continue
+        course_key: str = " ".join(match.groups())
+        course_info: Optional[Dict[str, str]] = build_course_info(
+            course_key, block, url
+        )
+        if course_info is not None:
+            courses.setdefault(course_key, course_info)
+    return courses
+
+
+# What the parser processes can be asked to run, by name
+PARSER_FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "parse_course_page": parse_course_page,
+    "parse_department_page": parse_department_page,
+}
+
+
+def read_message(stream: BinaryIO) -> Optional[Any]:
+    """Reads a length-prefixed pickle; None once the stream is closed."""
+    header: bytes = stream.read(4)
+    if len(header) < 4:
+        return None
+    return pickle.loads(stream.read(int.from_bytes(header, "big")))
+
+
+def encode_message(message: Any) -> bytes:
+    payload: bytes = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return len(payload).to_bytes(4, "big") + payload
+
+
+def serve_parser_requests(requests: BinaryIO, responses: BinaryIO) -> None:
+    """
+    A parser process' loop: answers (function name, args) requests with (True,
+    result) or (False, error), one at a time, until the requests are closed.
+    """
+    while True:
+        request: Optional[Tuple[str, Tuple[Any, ...]]] = read_message(requests)
+        if request is None:
+            return
+        name, args = request
+        try:
+            response: Tuple[bool, Any] = (True, PARSER_FUNCTIONS[name](*args))
+        except Exception as e:
+            response = (False, f"{type(e).__name__}: {e}")
+        responses.write(encode_message(response))
+        responses.flush()
+
+
+if __name__ == "__main__":
+    serve_parser_requests(sys.stdin.buffer, sys.stdout.buffer)
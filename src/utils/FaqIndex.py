@@ -0,0 +1,168 @@
+from typing import Dict, Iterable, List, Optional, Set
+from utils.SearchIndex import SearchIndex
+
+# Prefixes shorter than this are never expanded; `!a` shouldn't resolve to an FAQ
+MIN_PREFIX_LENGTH: int = 3
+
+
+class FaqEntry:
+    """A single FAQ; the name is the canonical key, aliases resolve to it."""
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        content: str,
+        description: Optional[str] = None,
+        aliases: Iterable[str] = (),
+    ):
+        self.name: str = name
+        self.content: str = content
+        self.description: str = description if description is not None else content
+        self.aliases: List[str] = [alias for alias in aliases if alias != name]
+
+    @property
+    def short_doc(self) -> str:
+        return f"{self.description[:40]}{'...' if len(self.description) > 40 else ''}"
+
+    @property
+    def searchable_text(self) -> str:
+        return " ".join([self.name, *self.aliases, self.description, self.content])
+
+
+class _TrieNode:
+    __slots__ = ("children", "key", "count")
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        # The full key if a key terminates at this node
+        self.key: Optional[str] = None
+        # Number of keys terminating in this subtree
+        self.count: int = 0
+
+
+class FaqIndex:
+    """
+    Name index for FAQs, kept separately from the bot's command registry.
+    Lookups are exact (name or alias) with a fallback to unambiguous prefix matching.
+    Adding or removing an entry only touches the keys of that entry.
+    Contents and descriptions are also kept in a full-text index for searching.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, FaqEntry] = {}
+        # Lowercased name/alias -> canonical name
+        self._keys: Dict[str, str] = {}
+        self._trie: _TrieNode = _TrieNode()
+        self._search_index: SearchIndex = SearchIndex()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._keys
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def get(self, name: str) -> Optional[FaqEntry]:
+        """Exact lookup by name or alias (case-insensitive)."""
+        canonical: Optional[str] = self._keys.get(name.lower())
+        return self._entries[canonical] if canonical is not None else None
+
+    def add(self, entry: FaqEntry) -> None:
+        """
+        Adds an entry to the index. Raises a ValueError if the name or any alias
+        is already taken by another entry.
+        """
+        keys: Set[str] = self._entry_keys(entry)
+        for key in keys:
+            if key in self._keys:
+                raise ValueError(f"`{key}` is already used by `{self._keys[key]}`.")
+        self._entries[entry.name] = entry
+        for key in keys:
+            self._keys[key] = entry.name
+            self._trie_insert(key)
+        self._search_index.add(entry.name, entry.searchable_text)
+
+    def remove(self, name: str) -> Optional[FaqEntry]:
+        """Removes the entry (and its aliases) that the name resolves to."""
+        entry: Optional[FaqEntry] = self.get(name)
+        if entry is None:
+            return None
+        del self._entries[entry.name]
+        for key in self._entry_keys(entry):
+            del self._keys[key]
+            self._trie_remove(key)
+        self._search_index.remove(entry.name)
+        return entry
+
+    def resolve(self, name: str) -> Optional[FaqEntry]:
+        """
+        Resolves a name to an entry: exact name or alias first, then a prefix that
+        only matches a single entry.
+        """
+        entry: Optional[FaqEntry] = self.get(name)
+        if entry is not None or len(name) < MIN_PREFIX_LENGTH:
+            return entry
+        candidates: Set[str] = self._prefix_candidates(name.lower(), limit=2)
+        if len(candidates) == 1:
+            return self._entries[candidates.pop()]
+        return None
+
+    def suggest(self, prefix: str, limit: int = 5) -> List[FaqEntry]:
+        """Returns up to `limit` entries with a name or alias starting with the prefix."""
+        return [
+            self._entries[name]
+            for name in sorted(self._prefix_candidates(prefix.lower(), limit=limit))
+        ]
+
+    def search(self, query: str, limit: int = 25) -> List[FaqEntry]:
+        """Full-text search over names, descriptions and contents, best match first."""
+        return [
+            self._entries[name] for name, _ in self._search_index.search(query, limit)
+        ]
+
+    @staticmethod
+    def _entry_keys(entry: FaqEntry) -> Set[str]:
+        # Aliases can repeat each other or the name in another case; every key must
+        # only be inserted (and removed) once
+        return {entry.name.lower(), *(alias.lower() for alias in entry.aliases)}
+
+    def _trie_insert(self, key: str) -> None:
+        node: _TrieNode = self._trie
+        node.count += 1
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            node.count += 1
+        node.key = key
+
+    def _trie_remove(self, key: str) -> None:
+        node: _TrieNode = self._trie
+        node.count -= 1
+        for char in key:
+            child: _TrieNode = node.children[char]
+            child.count -= 1
+            if not child.count:
+                # Nothing else lives below here, so drop the whole branch
+                del node.children[char]
+                return
+            node = child
+        node.key = None
+
+    def _prefix_candidates(self, prefix: str, limit: int) -> Set[str]:
+        node: Optional[_TrieNode] = self._trie
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+
+        # Depth-first walk of the subtree, stopping once we have enough distinct entries
+        found: Set[str] = set()
+        stack: List[_TrieNode] = [node]
+        while stack and len(found) < limit:
+            current: _TrieNode = stack.pop()
+            if current.key is not None:
+                found.add(self._keys[current.key])
+            stack.extend(current.children.values())
+        return found
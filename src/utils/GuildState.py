@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import discord
+from discord.ext import commands
+
+from utils.JsonTools import SECRETS_PATH, read_json, write_json
+from utils.Startup import DeferredStateCog
+
+# Per-guild state lives in secrets/guilds/<guild_id>/<filename>
+GUILD_STATE_DIR: str = "guilds"
+# Suffix of legacy (bot-wide) state files once they're fully migrated
+MIGRATED_SUFFIX: str = ".migrated"
+
+
+def _merge_state(existing: Any, payload: Any) -> Any:
+    """
+    Merges `payload` into `existing`: dicts key by key and lists by appending what's
+    missing; otherwise `existing` is kept.
+    """
+    if isinstance(existing, dict) and isinstance(payload, dict):
+        merged: Dict[str, Any] = dict(existing)
+        for key, value in payload.items():
+            merged[key] = (
+                _merge_state(existing[key], value) if key in existing else value
+            )
+        return merged
+    if isinstance(existing, list) and isinstance(payload, list):
+        return existing + [value for value in payload if value not in existing]
+    return existing
+
+
+class GuildStateStore:
+    """
+    One JSON file per guild for a cog's state, held in memory only for the guilds
+    that are loaded. With sharding, a process only loads the guilds of its shards,
+    so memory and the work of loops over the state scale with those guilds rather
+    than with every guild the bot is in.
+    """
+
+    def __init__(self, filename: str):
+        self.filename: str = filename
+        self._states: Dict[int, Dict[str, Any]] = {}
+
+    def _relative_path(self, guild_id: int) -> str:
+        return os.path.join(GUILD_STATE_DIR, str(guild_id), self.filename)
+
+    def _exists(self, guild_id: int) -> bool:
+        return os.path.exists(os.path.join(SECRETS_PATH, self._relative_path(guild_id)))
+
+    def _read(self, guild_id: int) -> Dict[str, Any]:
+        # Guilds without state don't get an empty file until they write something
+        if not self._exists(guild_id):
+            return {}
+        return read_json(self._relative_path(guild_id))
+
+    async def load(self, guild_id: int) -> Dict[str, Any]:
+        if guild_id not in self._states:
+            state: Dict[str, Any] = await asyncio.get_event_loop().run_in_executor(
+                None, self._read, guild_id
+            )
+            self._states.setdefault(guild_id, state)
+        return self._states[guild_id]
+
+    def unload(self, guild_id: int) -> Optional[Dict[str, Any]]:
+        return self._states.pop(guild_id, None)
+
+    def is_loaded(self, guild_id: int) -> bool:
+        return guild_id in self._states
+
+    def __getitem__(self, guild_id: int) -> Dict[str, Any]:
+        return self._states[guild_id]
+
+    def get(self, guild_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        return self._states.get(guild_id)
+
+    def items(self) -> List[Tuple[int, Dict[str, Any]]]:
+        # A copy, so callers can await while guilds are loaded and unloaded
+        return list(self._states.items())
+
+    def _write(self, guild_id: int, state: Dict[str, Any]) -> None:
+        os.makedirs(
+            os.path.join(SECRETS_PATH, GUILD_STATE_DIR, str(guild_id)), exist_ok=True
+        )
+        write_json(self._relative_path(guild_id), state)
+
+    def write(self, guild_id: int) -> None:
+        """Persists the guild's state; blocking, like `write_json`."""
+        self._write(guild_id, self._states[guild_id])
+
+    def migrate_legacy(
+        self,
+        legacy_filename: str,
+        split: Callable[[Dict[str, Any]], Dict[Optional[int], Dict[str, Any]]],
+    ) -> None:
+        """
+        Moves a bot-wide state file into per-guild files. `split` maps the legacy
+        payload to each guild's payload; whatever it can't place yet (eg. the guild
+        is on another shard or unavailable) goes under `None` and stays in the
+        legacy file for the next startup. Payloads are merged into existing
+        per-guild files, whose entries win. Blocking; call it from an executor, so
+        it doesn't touch the loaded states.
+        """
+        if not os.path.exists(os.path.join(SECRETS_PATH, legacy_filename)):
+            return
+        payloads: Dict[Optional[int], Dict[str, Any]] = split(
+            read_json(legacy_filename)
+        )
+        leftover: Dict[str, Any] = payloads.pop(None, {})
+        failed: int = 0
+        for guild_id, payload in payloads.items():
+            try:
+                self._write(guild_id, _merge_state(self._read(guild_id), payload))
+            except (OSError, ValueError) as e:
+                failed += 1
+                logging.error(
+                    f"Failed to migrate {legacy_filename} for guild {guild_id}: {e}"
+                )
+        logging.info(
+            "Migrated %s to %d guilds, %d failed, %d entries left",
+            legacy_filename,
+            len(payloads) - failed,
+            failed,
+            len(leftover),
+        )
+        if failed:
+            # Keep the whole legacy file; merging it again next startup is harmless
+            return
+        if leftover:
+            write_json(legacy_filename, leftover)
+        else:
+            legacy_path: str = os.path.join(SECRETS_PATH, legacy_filename)
+            os.replace(legacy_path, legacy_path + MIGRATED_SUFFIX)
+
+
+class GuildStateCog(DeferredStateCog):
+    """
+    Base cog for cogs whose state is partitioned by guild (see `GuildStateStore`).
+    A guild's state is loaded when the guild becomes available, or when a command
+    is used in it first, and dropped when the guild goes away; so with
+    `AutoShardedBot` or separate shard processes, state follows the shards.
+
+    Subclasses list their stores in `guild_stores`, and can override
+    `migrate_legacy_state`, `guild_state_loaded` and `guild_state_unloaded`.
+    """
+
+    def __init__(self, client: commands.Bot):
+        super().__init__(client)
+        self.guild_stores: List[GuildStateStore] = []
+        self._loaded_guilds: Set[int] = set()
+        self._guild_loads: Dict[int, asyncio.Future] = {}
+
+    async def load_state(self):
+        if self.client.shard_store is None:
+            await self.migrate_legacy_state()
+        else:
+            # Shard processes migrate the parts of a legacy file they can see, one
+            # process at a time
+            async with self.client.shard_store.lock(f"migrate:{self.qualified_name}"):
+                await self.migrate_legacy_state()
+        await asyncio.gather(
+            *[
+                self.load_guild(guild.id)
+                for guild in self.client.guilds
+                if not guild.unavailable
+            ]
+        )
+
+    async def migrate_legacy_state(self) -> None:
+        """Overridden to move the cog's bot-wide state into its guild stores."""
+
+    async def guild_state_loaded(self, guild_id: int) -> None:
+        """Overridden to start per-guild work once the guild's state is loaded."""
+
+    async def guild_state_unloaded(self, guild_id: int) -> None:
+        """
+        Overridden to drop anything else the cog holds for the guild; its state is
+        still in the stores at this point.
+        """
+
+    def is_guild_loaded(self, guild_id: Optional[int]) -> bool:
+        return guild_id in self._loaded_guilds
+
+    async def load_guild(self, guild_id: int) -> None:
+        if guild_id in self._loaded_guilds:
+            return
+        # Commands and events for a guild can arrive while it's loading; they all
+        # wait on the same load
+        load: Optional[asyncio.Future] = self._guild_loads.get(guild_id)
+        if load is None:
+            load = self._guild_loads[guild_id] = asyncio.ensure_future(
+                self._load_guild(guild_id)
+            )
+            load.add_done_callback(lambda _: self._guild_loads.pop(guild_id, None))
+        await asyncio.shield(load)
+
+    async def _load_guild(self, guild_id: int) -> None:
+        await asyncio.gather(*[store.load(guild_id) for store in self.guild_stores])
+        self._loaded_guilds.add(guild_id)
+        await self.guild_state_loaded(guild_id)
+
+    async def unload_guild(self, guild_id: int) -> None:
+        if guild_id not in self._loaded_guilds:
+            return
+        self._loaded_guilds.discard(guild_id)
+        try:
+            await self.guild_state_unloaded(guild_id)
+        finally:
+            for store in self.guild_stores:
+                store.unload(guild_id)
+
+    @commands.Cog.listener("on_guild_available")
+    async def _guild_available(self, guild: discord.Guild):
+        # Guilds that are up on startup are loaded by `load_state`
+        await self.wait_for_state()
+        await self.load_guild(guild.id)
+
+    @commands.Cog.listener("on_guild_join")
+    async def _guild_joined(self, guild: discord.Guild):
+        await self.wait_for_state()
+        await self.load_guild(guild.id)
+
+    @commands.Cog.listener("on_guild_unavailable")
+    async def _guild_unavailable(self, guild: discord.Guild):
+        await self.unload_guild(guild.id)
+
+    @commands.Cog.listener("on_guild_remove")
+    async def _guild_removed(self, guild: discord.Guild):
+        await self.unload_guild(guild.id)
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        await super().cog_before_invoke(ctx)
+        if ctx.guild is not None:
+            await self.load_guild(ctx.guild.id)
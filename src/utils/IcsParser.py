@@ -0,0 +1,221 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+import aiohttp
+import codecs
+import re
+
+# Workday exports are a few dozen KiB; anything much larger isn't a schedule
+MAX_ICS_BYTES: int = 1024 * 1024
+ICS_CHUNK_SIZE: int = 8 * 1024
+
+# Content lines are NAME[;PARAM=...]:VALUE, where quoted parameters may contain ':'
+_CONTENT_LINE = re.compile(
+    r'([A-Za-z0-9-]+)((?:;(?:[^:;"]|"[^"]*")*)*):(.*)', re.DOTALL
+)
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+_TEXT_ESCAPE = re.compile(r"\\([\\;,nN])")
+
+_FALLBACK_ENCODING: str = "cp1252"
+
+
+def _fallback_decode(error: UnicodeDecodeError):
+    """Decodes bytes that aren't valid UTF-8 as cp1252 instead of failing outright."""
+    invalid: bytes = error.object[error.start : error.end]
+    return invalid.decode(_FALLBACK_ENCODING, errors="replace"), error.end
+
+
+codecs.register_error("ics_fallback", _fallback_decode)
+
+
+class IcsError(ValueError):
+    """The file can't be read as a calendar."""
+
+
+class IcsTooLargeError(IcsError):
+    """The file is over the byte budget."""
+
+
+class IcsEvent(NamedTuple):
+    summary: str
+    dtstart: Optional[str]
+    rrule: Optional[str]
+
+
+def _unescape_text(value: str) -> str:
+    return _TEXT_ESCAPE.sub(
+        lambda match: "\n" if match.group(1) in "nN" else match.group(1), value
+    )
+
+
+class IcsStreamParser:
+    """
+    Incremental RFC 5545 parser that only keeps what's needed for course import.
+    Bytes are fed in chunks as they arrive, and each call to `feed` returns the
+    VEVENTs completed so far. Lines may end in CRLF, LF or CR, folded lines are
+    unfolded, and input that isn't UTF-8 falls back to cp1252 (UTF-16 is detected
+    by its byte order mark). Feeding more than `max_bytes` raises IcsTooLargeError.
+    """
+
+    def __init__(self, max_bytes: int = MAX_ICS_BYTES):
+        self.max_bytes: int = max_bytes
+        self.bytes_read: int = 0
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+        self._head: bytes = b""
+        self._buffer: str = ""
+        self._logical_line: Optional[str] = None
+        self._components: List[str] = []
+        self._properties: Dict[str, str] = {}
+        self._events: List[IcsEvent] = []
+
+    def _decode(self, chunk: bytes, final: bool = False) -> str:
+        if self._decoder is None:
+            # Wait for enough bytes to pick the encoding from the byte order mark
+            chunk, self._head = self._head + chunk, b""
+            if len(chunk) < len(codecs.BOM_UTF16) and not final:
+                self._head = chunk
+                return ""
+            if chunk.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+                self._decoder = codecs.getincrementaldecoder("utf-16")()
+            else:
+                self._decoder = codecs.getincrementaldecoder("utf-8-sig")(
+                    errors="ics_fallback"
+                )
+        try:
+            text: str = self._decoder.decode(chunk, final=final)
+        except UnicodeDecodeError:
+            raise IcsError("The file isn't text.")
+        if "\x00" in text:
+            raise IcsError("The file isn't text.")
+        return text
+
+    def feed(self, chunk: bytes) -> List[IcsEvent]:
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self.max_bytes:
+            raise IcsTooLargeError(f"The file is larger than {self.max_bytes} bytes.")
+        text: str = self._buffer + self._decode(chunk)
+        # A trailing CR may be the first half of a CRLF split across chunks
+        held_cr: bool = text.endswith("\r")
+        lines: List[str] = _LINE_BREAK.split(text[:-1] if held_cr else text)
+        # The last piece is a partial line
+        self._buffer = lines.pop() + ("\r" if held_cr else "")
+        for line in lines:
+            self._physical_line(line)
+        return self._take_events()
+
+    def close(self) -> List[IcsEvent]:
+        """Flushes whatever is left once the whole file has been fed."""
+        self._buffer += self._decode(b"", final=True)
+        for line in _LINE_BREAK.split(self._buffer):
+            self._physical_line(line)
+        self._buffer = ""
+        if self._logical_line is not None:
+            self._content_line(self._logical_line)
+            self._logical_line = None
+        return self._take_events()
+
+    def _take_events(self) -> List[IcsEvent]:
+        events, self._events = self._events, []
+        return events
+
+    def _physical_line(self, line: str) -> None:
+        # A line starting with whitespace continues the previous one (RFC 5545 3.1)
+        if line[:1] in (" ", "\t") and self._logical_line is not None:
+            self._logical_line += line[1:]
+            return
+        if self._logical_line is not None:
+            self._content_line(self._logical_line)
+        self._logical_line = line if line else None
+
+    def _content_line(self, line: str) -> None:
+        match = _CONTENT_LINE.match(line)
+        if not match:
+            return
+        name: str = match.group(1).upper()
+        value: str = match.group(3)
+        if name == "BEGIN":
+            self._components.append(value.strip().upper())
+            if self._components[-1] == "VEVENT":
+                self._properties = {}
+        elif name == "END":
+            component: str = value.strip().upper()
+            if component in self._components:
+                # Tolerate unbalanced components by unwinding to the matching BEGIN
+                while self._components.pop() != component:
+                    pass
+            if component == "VEVENT" and "SUMMARY" in self._properties:
+                self._events.append(
+                    IcsEvent(
+                        summary=_unescape_text(self._properties["SUMMARY"]),
+                        dtstart=self._properties.get("DTSTART"),
+                        rrule=self._properties.get("RRULE"),
+                    )
+                )
+        elif self._components and self._components[-1] == "VEVENT":
+            # Properties of nested components (eg. VALARM) are ignored above
+            self._properties.setdefault(name, value)
+
+
+def course_string(event: IcsEvent) -> str:
+    """
+    Returns the raw course string of an event (eg. "CPEN491").
+    Example of a summary from Workday is "CPEN 491 001"; the section/tutorial number
+    _should_ be at the end, but it shouldn't matter here.
+    """
+    return "".join(event.summary.strip().split()[:2])
+
+
+def _collect_courses(
+    events: List[IcsEvent], courses: Set[str], max_courses: Optional[int]
+) -> bool:
+    """Adds the events' courses; returns True once there are over `max_courses`."""
+    for event in events:
+        course: str = course_string(event)
+        if course:
+            courses.add(course)
+        if max_courses is not None and len(courses) > max_courses:
+            return True
+    return False
+
+
+def parse_ics_courses(
+    data: bytes, max_courses: Optional[int] = None, max_bytes: int = MAX_ICS_BYTES
+) -> Set[str]:
+    """Same as `read_attachment_courses`, for a file that's already in memory."""
+    parser: IcsStreamParser = IcsStreamParser(max_bytes)
+    courses: Set[str] = set()
+    for start in range(0, len(data), ICS_CHUNK_SIZE):
+        if _collect_courses(
+            parser.feed(data[start : start + ICS_CHUNK_SIZE]), courses, max_courses
+        ):
+            return courses
+    _collect_courses(parser.close(), courses, max_courses)
+    return courses
+
+
+async def read_attachment_courses(
+    attachment: Any,
+    max_courses: Optional[int] = None,
+    max_bytes: int = MAX_ICS_BYTES,
+) -> Set[str]:
+    """
+    Streams a Discord attachment through the parser and returns the raw course
+    strings of its events. Reading stops as soon as more than `max_courses` distinct
+    courses have been found, so the result is then only a sample of the file.
+    Raises IcsTooLargeError if the attachment is over the byte budget, and IcsError
+    if it can't be read as a calendar.
+    """
+    if attachment.size > max_bytes:
+        raise IcsTooLargeError(f"The file is larger than {max_bytes} bytes.")
+
+    parser: IcsStreamParser = IcsStreamParser(max_bytes)
+    courses: Set[str] = set()
+    try:
+        async with aiohttp.request("GET", attachment.url) as resp:
+            if resp.status != 200:
+                raise IcsError(f"Failed to download the file: {resp.status}")
+            async for chunk in resp.content.iter_chunked(ICS_CHUNK_SIZE):
+                if _collect_courses(parser.feed(chunk), courses, max_courses):
+                    return courses
+    except aiohttp.ClientError as e:
+        raise IcsError(f"Failed to download the file: {e}")
+    _collect_courses(parser.close(), courses, max_courses)
+    return courses
@@ -1,4 +1,5 @@
 from typing import Dict, Any, Set
+import asyncio
 import json
 import os
 
@@ -33,4 +34,9 @@ def read_json(filename: str) -> Dict[Any, Any]:
     except (FileNotFoundError, json.JSONDecodeError):
         default_payload = {}
         write_json(filename, default_payload)
-        return default_payload
\ No newline at end of file
+        return default_payload
+
+
+async def read_json_async(filename: str) -> Dict[Any, Any]:
+    """Reads a JSON file in the secrets directory without blocking the event loop."""
+    return await asyncio.get_event_loop().run_in_executor(None, read_json, filename)
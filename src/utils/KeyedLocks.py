@@ -0,0 +1,91 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, Optional
+
+
+class _LockState:
+    __slots__ = ("condition", "readers", "writer", "waiting_writers", "users")
+
+    def __init__(self):
+        self.condition: asyncio.Condition = asyncio.Condition()
+        self.readers: int = 0
+        self.writer: bool = False
+        self.waiting_writers: int = 0
+        # Tasks holding or waiting on the lock; the state is dropped at zero
+        self.users: int = 0
+
+
+class KeyedLocks:
+    """
+    Shared/exclusive locks striped by key (eg. a year level or a course). Holders of
+    the same key in shared mode run concurrently, while an exclusive holder runs
+    alone; waiting exclusive holders go first so they aren't starved. Locks are
+    created on first use and dropped once nobody holds or waits on them, so the
+    table only grows with the number of keys in use at the same time.
+    """
+
+    def __init__(self):
+        self._states: Dict[Hashable, _LockState] = {}
+
+    def _enter(self, key: Hashable) -> _LockState:
+        state: Optional[_LockState] = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _LockState()
+        state.users += 1
+        return state
+
+    def _exit(self, key: Hashable, state: _LockState) -> None:
+        state.users -= 1
+        if not state.users:
+            del self._states[key]
+
+    def locked(self, key: Hashable) -> bool:
+        """Whether the key is held in either mode."""
+        state: Optional[_LockState] = self._states.get(key)
+        return state is not None and (state.writer or state.readers > 0)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    @asynccontextmanager
+    async def exclusive(self, key: Hashable) -> AsyncIterator[None]:
+        state: _LockState = self._enter(key)
+        try:
+            async with state.condition:
+                state.waiting_writers += 1
+                try:
+                    await state.condition.wait_for(
+                        lambda: not state.writer and not state.readers
+                    )
+                finally:
+                    state.waiting_writers -= 1
+                    # Readers queued behind us may be able to go if we gave up
+                    state.condition.notify_all()
+                state.writer = True
+            try:
+                yield
+            finally:
+                async with state.condition:
+                    state.writer = False
+                    state.condition.notify_all()
+        finally:
+            self._exit(key, state)
+
+    @asynccontextmanager
+    async def shared(self, key: Hashable) -> AsyncIterator[None]:
+        state: _LockState = self._enter(key)
+        try:
+            async with state.condition:
+                await state.condition.wait_for(
+                    lambda: not state.writer and not state.waiting_writers
+                )
+                state.readers += 1
+            try:
+                yield
+            finally:
+                async with state.condition:
+                    state.readers -= 1
+                    if not state.readers:
+                        state.condition.notify_all()
+        finally:
+            self._exit(key, state)
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import signal
+import time
+from typing import List, Optional, Set
+from discord.ext import commands
+
+from utils.Startup import DeferredStateCog
+
+# In-flight work gets this long to finish, and then the cogs' shutdown hooks get
+# this long; together under the supervisor's `SHUTDOWN_TIMEOUT`, so shard processes
+# are done before they're killed
+DRAIN_TIMEOUT: float = 15.0
+CLOSE_TIMEOUT: float = 5.0
+
+
+class ShuttingDown(commands.CheckFailure):
+    """Raised for commands invoked after a shutdown has started."""
+
+
+class Lifecycle:
+    """
+    Stops the bot gracefully on SIGTERM (eg. a container stop or the shard
+    supervisor) and SIGINT:
+    1. new commands are refused and the scheduler stops starting job runs
+    2. commands and job runs in progress get until the deadline to finish, so
+       their REST calls and state writes complete; whatever is left is cancelled
+    3. each cog's `shutdown` hook persists its state and closes its sessions
+    4. the client closes its gateway connection and HTTP session
+    """
+
+    def __init__(self, client: commands.Bot):
+        self.client: commands.Bot = client
+        self.stopping: bool = False
+        self._in_flight: Set[asyncio.Future] = set()
+        self._shutdown: Optional[asyncio.Future] = None
+
+    def install_signal_handlers(self) -> None:
+        """Must be called from the event loop."""
+        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.request_shutdown, signum)
+            except NotImplementedError:
+                # Not supported on Windows; the bot is stopped abruptly there
+                return
+
+    def request_shutdown(self, signum: Optional[int] = None) -> None:
+        if self._shutdown is None:
+            if signum is not None:
+                logging.info(f"Received {signal.Signals(signum).name}")
+            self._shutdown = asyncio.ensure_future(self.shutdown())
+
+    def check(self, ctx: commands.Context) -> bool:
+        """Global command check that refuses new commands once stopping."""
+        if self.stopping:
+            raise ShuttingDown()
+        return True
+
+    def track(self, future: asyncio.Future) -> None:
+        """Lets `future` (eg. a command's task) finish before the bot stops."""
+        self._in_flight.add(future)
+        future.add_done_callback(self._in_flight.discard)
+
+    async def shutdown(self) -> None:
+        self.stopping = True
+        logging.info("Shutting down")
+        deadline: float = time.monotonic() + DRAIN_TIMEOUT
+        pending: Set[asyncio.Future] = set(self.client.scheduler.stop())
+        while True:
+            # Commands that passed the check just before we started are tracked late
+            pending.update(self._in_flight)
+            # This may be running from a command's task; don't wait on ourselves
+            pending.discard(asyncio.current_task())
+            pending = {future for future in pending if not future.done()}
+            remaining: float = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+        for future in pending:
+            future.cancel()
+        if pending:
+            logging.warning(f"Cancelled {len(pending)} tasks at the deadline")
+
+        cogs: List[DeferredStateCog] = [
+            cog
+            for cog in self.client.cogs.values()
+            if isinstance(cog, DeferredStateCog)
+        ]
+        results: List[object] = await asyncio.gather(
+            *[asyncio.wait_for(cog.shutdown(), CLOSE_TIMEOUT) for cog in cogs],
+            return_exceptions=True,
+        )
+        for cog, result in zip(cogs, results):
+            if isinstance(result, BaseException):
+                logging.error(f"Failed to shut down {cog.qualified_name}: {result!r}")
+
+        logging.info("Closing the connection")
+        await self.client.close()
@@ -0,0 +1,121 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+LOG_FILENAME: str = "bot_info.log"
+
+# The log is rotated once it reaches this size, keeping this many old files
+LOG_MAX_BYTES: int = 10 * 1024 * 1024
+LOG_BACKUP_COUNT: int = 5
+# Set to eg. "midnight" to rotate by time instead of by size
+LOG_ROTATE_WHEN: Optional[str] = None
+
+# Records tagged with `extra={"sample": <key>}` are only written 1 in N times;
+# warnings and errors are always written
+SAMPLE_RATES: Dict[str, int] = {
+    "reaction_role": 10,
+}
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON, including `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps 1 in N of the records tagged with a sample key (see `SAMPLE_RATES`). Kept
+    records are annotated with the rate, so counts can be scaled back up.
+    """
+
+    def __init__(self, rates: Dict[str, int]):
+        super().__init__()
+        self.rates: Dict[str, int] = rates
+        self._seen: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key: Optional[str] = getattr(record, "sample", None)
+        rate: int = self.rates.get(key, 1) if key is not None else 1
+        if rate <= 1 or record.levelno >= logging.WARNING:
+            return True
+        seen: int = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the default, keep the record structured for the JSON formatter;
+        # only what can't be pickled or outlive the call is rendered here
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _file_handler(filename: str) -> logging.Handler:
+    if LOG_ROTATE_WHEN is not None:
+        return logging.handlers.TimedRotatingFileHandler(
+            filename, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT
+        )
+    return logging.handlers.RotatingFileHandler(
+        filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT
+    )
+
+
+def setup_logging(
+    filename: str = LOG_FILENAME, level: int = logging.INFO
+) -> logging.handlers.QueueListener:
+    """
+    Routes the root logger through a queue to a background thread that writes
+    rotated JSON lines, so logging calls on the event loop never touch the file.
+    Call `stop` on the returned listener on shutdown to flush what's queued.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler: logging.Handler = _QueueHandler(log_queue)
+    # Sampled records are dropped before they're copied and queued
+    queue_handler.addFilter(SamplingFilter(SAMPLE_RATES))
+
+    file_handler: logging.Handler = _file_handler(filename)
+    file_handler.setFormatter(JsonFormatter())
+
+    root: logging.Logger = logging.getLogger()
+    root.setLevel(level)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
@@ -0,0 +1,436 @@
+import asyncio
+import bisect
+import logging
+import math
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import aiohttp
+
+# The metrics endpoint only listens locally; scrape it from the same host
+METRICS_HOST: str = "127.0.0.1"
+METRICS_PORT: int = 9464
+
+# How often the event loop lag monitor wakes up
+LOOP_LAG_INTERVAL: float = 0.5
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+LOOP_LAG_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+DISCORD_API_HOSTS: Tuple[str, ...] = ("discord.com", "discordapp.com")
+# Resources whose ID is part of the rate limit bucket ("major parameters")
+MAJOR_PARAMETERS: Tuple[str, ...] = ("channels", "guilds", "webhooks")
+
+# Labels are stored as tuples of values in the order of the metric's label names
+LabelValues = Tuple[str, ...]
+
+_API_VERSION_PREFIX = re.compile(r"^/api(?:/v\d+)?")
+_SNOWFLAKE = re.compile(r"^\d{15,21}$")
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{_escape_label_value(value)}"'
+            for name, value in zip(names, values)
+        )
+        + "}"
+    )
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Base class of the metric types; a metric holds one series per label set."""
+
+    kind: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.label_names: Tuple[str, ...] = tuple(label_names)
+
+    def _label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} expects labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def series(self) -> List[LabelValues]:
+        raise NotImplementedError
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Yields (sample name, formatted labels, value) in exposition order."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key: LabelValues = self._label_values(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._label_values(labels), 0.0)
+
+    def series(self) -> List[LabelValues]:
+        return list(self._values)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, value in self._values.items():
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._label_values(labels)] = value
+
+
+class _HistogramSeries:
+    __slots__ = ("bucket_counts", "count", "sum", "max")
+
+    def __init__(self, bucket_count: int):
+        # Non-cumulative; the last bucket is +Inf
+        self.bucket_counts: List[int] = [0] * (bucket_count + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.max: float = 0.0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key: LabelValues = self._label_values(labels)
+        series: Optional[_HistogramSeries] = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets))
+        series.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.count += 1
+        series.sum += value
+        series.max = max(series.max, value)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observes how long the block took, whether or not it raised."""
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def series(self) -> List[LabelValues]:
+        return list(self._series)
+
+    def summary(self, key: LabelValues) -> Tuple[int, float, float]:
+        """(count, sum, max) of a series, as returned by `series`."""
+        series: Optional[_HistogramSeries] = self._series.get(key)
+        if series is None:
+            return 0, 0.0, 0.0
+        return series.count, series.sum, series.max
+
+    def quantile(self, q: float, key: LabelValues) -> Optional[float]:
+        """
+        Estimates a quantile by interpolating within its bucket, like Prometheus'
+        `histogram_quantile`; values past the last bucket are capped at the max.
+        """
+        series: Optional[_HistogramSeries] = self._series.get(key)
+        if series is None or not series.count:
+            return None
+        rank: float = q * series.count
+        seen: int = 0
+        lower: float = 0.0
+        for upper, count in zip(self.buckets + (series.max,), series.bucket_counts):
+            if count and seen + count >= rank:
+                upper = min(upper, series.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return series.max
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, series in self._series.items():
+            cumulative: int = 0
+            for bound, count in zip(self.buckets + (math.inf,), series.bucket_counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(
+                        self.label_names + ("le",), key + (_format_value(bound),)
+                    ),
+                    cumulative,
+                )
+            labels: str = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum", labels, series.sum
+            yield f"{self.name}_count", labels, series.count
+
+
+class MetricsRegistry:
+    """
+    In-process metrics in the Prometheus data model. Metrics are registered once
+    at import time and live for the whole process, so they survive cog reloads.
+    """
+
+    def __init__(self):
+        self.started_at: float = time.time()
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing: Optional[Metric] = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"{metric.name} is already registered")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY: MetricsRegistry = MetricsRegistry()
+
+COMMAND_LATENCY: Histogram = REGISTRY.histogram(
+    "ecess_command_duration_seconds",
+    "Time from a command being invoked to it completing or failing.",
+    ["command"],
+)
+COMMAND_ERRORS: Counter = REGISTRY.counter(
+    "ecess_command_errors_total",
+    "Commands that raised, by error type.",
+    ["command", "error"],
+)
+LOOP_TICK_DURATION: Histogram = REGISTRY.histogram(
+    "ecess_loop_tick_duration_seconds",
+    "Duration of one run of a scheduled background job.",
+    ["loop"],
+)
+JOB_RUNS: Counter = REGISTRY.counter(
+    "ecess_job_runs_total",
+    "Scheduled job runs, by outcome ('skipped' if the last run was still going).",
+    ["job", "outcome"],
+)
+REACTION_EVENT_LATENCY: Histogram = REGISTRY.histogram(
+    "ecess_reaction_event_duration_seconds",
+    "Time spent handling a reaction role event.",
+    ["event"],
+)
+DISCORD_REQUESTS: Counter = REGISTRY.counter(
+    "ecess_discord_requests_total",
+    "Discord REST requests, by route and status ('error' if none was received).",
+    ["method", "route", "status"],
+)
+DISCORD_RATE_LIMITS: Counter = REGISTRY.counter(
+    "ecess_discord_rate_limits_total",
+    "Discord REST responses with status 429, by route and scope.",
+    ["route", "scope"],
+)
+DISCORD_REQUEST_LATENCY: Histogram = REGISTRY.histogram(
+    "ecess_discord_request_duration_seconds",
+    "Latency of Discord REST requests.",
+    ["route"],
+)
+DISCORD_BACKGROUND_WAIT: Histogram = REGISTRY.histogram(
+    "ecess_discord_background_wait_seconds",
+    "Time background jobs waited on the REST budget before a request.",
+    ["route"],
+)
+UBC_REQUEST_LATENCY: Histogram = REGISTRY.histogram(
+    "ecess_ubc_request_duration_seconds",
+    "Latency of UBC calendar requests, including reading and parsing the page.",
+    ["outcome"],
+)
+UBC_REQUEST_RETRIES: Counter = REGISTRY.counter(
+    "ecess_ubc_request_retries_total",
+    "UBC calendar requests retried after a connection error.",
+)
+COURSE_LOOKUPS: Counter = REGISTRY.counter(
+    "ecess_course_lookups_total",
+    "Course lookups, by whether the cached catalogue answered them.",
+    ["source"],
+)
+EVENT_LOOP_LAG: Histogram = REGISTRY.histogram(
+    "ecess_event_loop_lag_seconds",
+    "How late the event loop ran a callback scheduled by the lag monitor.",
+    (),
+    LOOP_LAG_BUCKETS,
+)
+
+
+def normalize_route(path: str, keep_major: bool = False) -> str:
+    """
+    Turns a request path into its route, so that eg. every message fetch is counted
+    under "/channels/{id}/messages/{id}" rather than once per message. With
+    `keep_major`, the leading channel, guild or webhook ID is kept, since Discord
+    rate limits each of those separately.
+    """
+    segments: List[str] = _API_VERSION_PREFIX.sub("", path).split("/")
+    for i, segment in enumerate(segments):
+        if _SNOWFLAKE.match(segment):
+            if not (keep_major and i == 2 and segments[1] in MAJOR_PARAMETERS):
+                segments[i] = "{id}"
+        elif i > 0 and segments[i - 1] == "reactions" and segment:
+            segments[i] = "{emoji}"
+    return "/".join(segments)
+
+
+def discord_http_trace() -> Any:
+    """
+    Returns an aiohttp trace config that counts the bot's Discord REST requests,
+    for the client's `http_trace` option. Gateway and CDN traffic isn't counted.
+    """
+
+    def route_of(params: Any) -> Optional[str]:
+        if params.url.host not in DISCORD_API_HOSTS:
+            return None
+        return normalize_route(params.url.path)
+
+    async def on_request_start(session: Any, context: Any, params: Any) -> None:
+        context.started_at = time.perf_counter()
+
+    async def on_request_end(session: Any, context: Any, params: Any) -> None:
+        route: Optional[str] = route_of(params)
+        if route is None:
+            return
+        status: int = params.response.status
+        DISCORD_REQUESTS.inc(method=params.method, route=route, status=status)
+        DISCORD_REQUEST_LATENCY.observe(
+            time.perf_counter() - context.started_at, route=route
+        )
+        if status == 429:
+            DISCORD_RATE_LIMITS.inc(
+                route=route,
+                scope=params.response.headers.get("X-RateLimit-Scope", "unknown"),
+            )
+
+    async def on_request_exception(session: Any, context: Any, params: Any) -> None:
+        route: Optional[str] = route_of(params)
+        if route is not None:
+            DISCORD_REQUESTS.inc(method=params.method, route=route, status="error")
+
+    trace: aiohttp.TraceConfig = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """
+    Sleeps for `interval` in a loop and records how much later than that it woke
+    up; anything blocking the event loop shows up as lag.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+    while True:
+        scheduled: float = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - scheduled))
+
+
+async def start_metrics_server(
+    registry: MetricsRegistry = REGISTRY,
+    host: str = METRICS_HOST,
+    port: int = METRICS_PORT,
+) -> Any:
+    """
+    Serves the registry at `http://host:port/metrics`. Returns the aiohttp runner;
+    call its `cleanup` to stop the server.
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app: web.Application = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner: web.AppRunner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics at http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,376 @@
+from __future__ import annotations
+from collections import deque
+from typing import (
+    AbstractSet,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+import re
+
+from utils.Converters import Course
+
+_COUNT_WORDS: Dict[str, int] = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+_COUNT_PATTERN = re.compile(r"\b(one|two|three|four|five|all)\s+of\b", re.IGNORECASE)
+_ALTERNATIVE_MARKER = re.compile(r"\([a-z]\)")
+
+
+def find_course_keys(text: str) -> List[str]:
+    """Returns the course keys (eg. "CPEN 211") mentioned in the text, in order."""
+    return [str(course) for course in Course.find_all(text, strict=True)]
+
+
+class Requirement:
+    """A node of a prerequisite/corequisite expression."""
+
+    __slots__ = ()
+
+    def courses(self) -> Set[str]:
+        raise NotImplementedError
+
+    def is_satisfied(self, taken: AbstractSet[str]) -> bool:
+        raise NotImplementedError
+
+    def unmet(self, taken: AbstractSet[str]) -> Optional[Requirement]:
+        """Returns what's left to satisfy given the taken courses, or None."""
+        return None if self.is_satisfied(taken) else self
+
+
+class CourseRequirement(Requirement):
+    __slots__ = ("course",)
+
+    def __init__(self, course: str):
+        self.course: str = course
+
+    def courses(self) -> Set[str]:
+        return {self.course}
+
+    def is_satisfied(self, taken: AbstractSet[str]) -> bool:
+        return self.course in taken
+
+    def __str__(self) -> str:
+        return self.course
+
+
+class Condition(Requirement):
+    """
+    A requirement that isn't a course (eg. "fourth-year standing"). We can't check
+    these, so they're never satisfied and are surfaced to the user instead.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text: str = text
+
+    def courses(self) -> Set[str]:
+        return set()
+
+    def is_satisfied(self, taken: AbstractSet[str]) -> bool:
+        return False
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class AllOf(Requirement):
+    __slots__ = ("children",)
+
+    def __init__(self, children: List[Requirement]):
+        self.children: List[Requirement] = children
+
+    def courses(self) -> Set[str]:
+        return set().union(*[child.courses() for child in self.children])
+
+    def is_satisfied(self, taken: AbstractSet[str]) -> bool:
+        return all(child.is_satisfied(taken) for child in self.children)
+
+    def unmet(self, taken: AbstractSet[str]) -> Optional[Requirement]:
+        remaining: List[Requirement] = [
+            child_unmet
+            for child_unmet in (child.unmet(taken) for child in self.children)
+            if child_unmet is not None
+        ]
+        if not remaining:
+            return None
+        return remaining[0] if len(remaining) == 1 else AllOf(remaining)
+
+    def __str__(self) -> str:
+        return " and ".join(_wrap(child) for child in self.children)
+
+
+class AtLeast(Requirement):
+    """At least `count` of the children; "one of" is `AtLeast(1, ...)`."""
+
+    __slots__ = ("count", "children")
+
+    def __init__(self, count: int, children: List[Requirement]):
+        self.count: int = count
+        self.children: List[Requirement] = children
+
+    def courses(self) -> Set[str]:
+        return set().union(*[child.courses() for child in self.children])
+
+    def is_satisfied(self, taken: AbstractSet[str]) -> bool:
+        return sum(child.is_satisfied(taken) for child in self.children) >= self.count
+
+    def __str__(self) -> str:
+        joined: str = ", ".join(_wrap(child) for child in self.children)
+        if self.count == 1:
+            return " or ".join(_wrap(child) for child in self.children)
+        return f"{self.count} of {joined}"
+
+
+def _wrap(requirement: Requirement) -> str:
+    if isinstance(requirement, (AllOf, AtLeast)) and len(requirement.children) > 1:
+        return f"({requirement})"
+    return str(requirement)
+
+
+def _all_of(children: List[Requirement]) -> Optional[Requirement]:
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else AllOf(children)
+
+
+def _any_of(children: List[Requirement]) -> Optional[Requirement]:
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else AtLeast(1, children)
+
+
+def _parse_segment(segment: str) -> Optional[Requirement]:
+    courses: List[Requirement] = [
+        CourseRequirement(course) for course in find_course_keys(segment)
+    ]
+    count_match = _COUNT_PATTERN.search(segment)
+    if not courses:
+        segment = segment.strip(" ,;")
+        return Condition(segment) if segment else None
+    if count_match:
+        word: str = count_match.group(1).lower()
+        if word == "all":
+            return _all_of(courses)
+        return AtLeast(min(_COUNT_WORDS[word], len(courses)), courses)
+    if re.search(r"\bor\b", segment) and len(courses) > 1:
+        return _any_of(courses)
+    return _all_of(courses)
+
+
+def _parse_clause(clause: str) -> Optional[Requirement]:
+    """Parses "One of A, B and one of C, D"-style clauses joined by "and"."""
+    groups: List[str] = []
+    for segment in re.split(r"\s+and\s+", clause):
+        # "One of A, B and C" continues the list, "One of A and one of B" doesn't
+        if (
+            groups
+            and _COUNT_PATTERN.search(groups[-1])
+            and not _COUNT_PATTERN.search(segment)
+            and find_course_keys(segment)
+            and not segment.strip().lower().startswith("either")
+        ):
+            groups[-1] = f"{groups[-1]}, {segment}"
+        else:
+            groups.append(segment)
+    return _all_of(
+        [
+            requirement
+            for requirement in (_parse_segment(group) for group in groups)
+            if requirement is not None
+        ]
+    )
+
+
+def parse_requirement(text: Optional[str]) -> Optional[Requirement]:
+    """
+    Parses the prerequisite or corequisite sentence from the UBC calendar into a
+    requirement expression. Returns None if there's no requirement.
+    """
+    if not text:
+        return None
+    text = text.strip().rstrip(".").strip()
+    if not text or text.lower() == "none":
+        return None
+
+    # "Either (a) A or (b) B"
+    if _ALTERNATIVE_MARKER.search(text):
+        alternatives: List[str] = [
+            re.sub(r"(?:[;,]?\s*\bor\b)?[\s;,]*$", "", piece).strip()
+            for piece in _ALTERNATIVE_MARKER.split(text)[1:]
+        ]
+        return _any_of(
+            [
+                requirement
+                for requirement in (parse_requirement(piece) for piece in alternatives)
+                if requirement is not None
+            ]
+        )
+
+    # "A; or B" are alternatives, while "A; B" are both required
+    if re.search(r";\s*or\b", text):
+        return _any_of(
+            [
+                requirement
+                for requirement in (
+                    parse_requirement(piece) for piece in re.split(r";\s*or\b", text)
+                )
+                if requirement is not None
+            ]
+        )
+    return _all_of(
+        [
+            requirement
+            for requirement in (_parse_clause(clause) for clause in text.split(";"))
+            if requirement is not None
+        ]
+    )
+
+
+class PrerequisiteGraph:
+    """
+    Prerequisite graph over a course catalogue (course key -> course info, as
+    returned by `CoursePages.parse_department_page`). Transitive closures and a
+    topological ordering are computed up front, so queries are answered from memory.
+    """
+
+    def __init__(self, catalogue: Dict[str, Dict[str, str]]):
+        self.catalogue: Dict[str, Dict[str, str]] = catalogue
+        self.prerequisites: Dict[str, Requirement] = {}
+        self.corequisites: Dict[str, Requirement] = {}
+        for course, info in catalogue.items():
+            prerequisite = parse_requirement(info.get("prerequisites"))
+            if prerequisite is not None:
+                self.prerequisites[course] = prerequisite
+            corequisite = parse_requirement(info.get("corequisites"))
+            if corequisite is not None:
+                self.corequisites[course] = corequisite
+
+        # Edges go from a prerequisite to the courses it's required for
+        self._requires: Dict[str, Set[str]] = {
+            course: requirement.courses() - {course}
+            for course, requirement in self.prerequisites.items()
+        }
+        self._unlocks: Dict[str, Set[str]] = {}
+        for course, prerequisites in self._requires.items():
+            for prerequisite in prerequisites:
+                self._unlocks.setdefault(prerequisite, set()).add(course)
+
+        self._order: Dict[str, int] = self._topological_order()
+        self._ancestors: Dict[str, FrozenSet[str]] = self._closure(
+            self._requires, reverse=False
+        )
+        self._descendants: Dict[str, FrozenSet[str]] = self._closure(
+            self._unlocks, reverse=True
+        )
+
+    def _nodes(self) -> Set[str]:
+        return set(self.catalogue) | set(self._unlocks) | set(self._requires)
+
+    def _topological_order(self) -> Dict[str, int]:
+        in_degree: Dict[str, int] = {
+            node: len(self._requires.get(node, ())) for node in self._nodes()
+        }
+        queue: Deque[str] = deque(
+            sorted(node for node, degree in in_degree.items() if not degree)
+        )
+        order: List[str] = []
+        while queue:
+            node: str = queue.popleft()
+            order.append(node)
+            for dependent in sorted(self._unlocks.get(node, ())):
+                in_degree[dependent] -= 1
+                if not in_degree[dependent]:
+                    queue.append(dependent)
+        # Anything left is part of a cycle; keep them at the end in a stable order
+        order.extend(sorted(node for node, degree in in_degree.items() if degree))
+        return {node: index for index, node in enumerate(order)}
+
+    def _closure(
+        self, edges: Dict[str, Set[str]], reverse: bool
+    ) -> Dict[str, FrozenSet[str]]:
+        """
+        Transitive closure along the edges. Nodes are visited in topological order
+        (reversed for descendants) so every neighbour's closure is already known;
+        nodes on cycles fall back to a search.
+        """
+        closure: Dict[str, FrozenSet[str]] = {}
+        for node in sorted(self._order, key=self._order.get, reverse=reverse):
+            neighbours: Set[str] = edges.get(node, set())
+            if all(neighbour in closure for neighbour in neighbours):
+                reachable: Set[str] = set(neighbours)
+                for neighbour in neighbours:
+                    reachable |= closure[neighbour]
+            else:
+                reachable = self._search(node, edges)
+            reachable.discard(node)
+            closure[node] = frozenset(reachable)
+        return closure
+
+    @staticmethod
+    def _search(start: str, edges: Dict[str, Set[str]]) -> Set[str]:
+        seen: Set[str] = set()
+        stack: List[str] = list(edges.get(start, ()))
+        while stack:
+            node: str = stack.pop()
+            if node not in seen:
+                seen.add(node)
+                stack.extend(edges.get(node, ()))
+        return seen
+
+    def __contains__(self, course: str) -> bool:
+        return course in self.catalogue
+
+    def __len__(self) -> int:
+        return len(self.catalogue)
+
+    def _sorted(self, courses: Iterable[str]) -> List[str]:
+        return sorted(courses, key=lambda course: (self._order.get(course, 0), course))
+
+    def needs(self, course: str) -> List[str]:
+        """Every course in the prerequisite chain, in an order they can be taken."""
+        return self._sorted(self._ancestors.get(course, ()))
+
+    def unlocks(self, course: str, transitive: bool = False) -> List[str]:
+        """Courses that require this course directly (or further down the chain)."""
+        if transitive:
+            return self._sorted(self._descendants.get(course, ()))
+        return self._sorted(self._unlocks.get(course, ()))
+
+    def unmet_prerequisites(
+        self, course: str, taken: AbstractSet[str]
+    ) -> Optional[Requirement]:
+        requirement: Optional[Requirement] = self.prerequisites.get(course)
+        return requirement.unmet(taken) if requirement is not None else None
+
+    def unmet_corequisites(
+        self, course: str, taken: AbstractSet[str]
+    ) -> Optional[Requirement]:
+        """Corequisites can be taken before or alongside the course."""
+        requirement: Optional[Requirement] = self.corequisites.get(course)
+        return requirement.unmet(taken) if requirement is not None else None
+
+    def check_plan(
+        self, term: Iterable[str], completed: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Requirement], Optional[Requirement]]]:
+        """
+        Checks a whole term at once. Prerequisites must be met by the completed
+        courses, while corequisites can also be met by the other courses in the term.
+        Maps each term course in the catalogue to its unmet (prerequisites,
+        corequisites); courses that aren't in the catalogue are left out.
+        """
+        term_courses: Set[str] = set(term)
+        taken: Set[str] = set(completed)
+        taken_or_concurrent: Set[str] = taken | term_courses
+        return {
+            course: (
+                self.unmet_prerequisites(course, taken),
+                self.unmet_corequisites(course, taken_or_concurrent),
+            )
+            for course in self._sorted(term_courses)
+            if course in self.catalogue
+        }
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from discord.ext import commands
+
+from utils.Scheduler import Job
+
+# asyncio reports callbacks (ie. task steps) that hold the event loop longer than this
+DEFAULT_SLOW_CALLBACK_MS: int = 100
+# The watchdog samples the event loop's stack while it's been stalled for this long
+DEFAULT_STALL_MS: int = 250
+
+# Frames kept from the innermost end of each sampled stack
+STACK_DEPTH: int = 6
+# Entries of each section of the report
+REPORT_TOP_N: int = 5
+
+# Parts of a handle's repr that differ between otherwise identical callbacks
+_HANDLE_NOISE = re.compile(r" at 0x[0-9a-fA-F]+|, defined at [^>]+| created at [^>]+")
+
+
+class _Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+
+    def add(self, duration: float) -> None:
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def format(self, name: str) -> str:
+        return (
+            f"`{name}` {self.count}x, total {self.total * 1000:.0f}ms, "
+            f"mean {self.total / self.count * 1000:.1f}ms, max {self.max * 1000:.0f}ms"
+        )
+
+
+def _top(timings: Dict[str, _Timing]) -> List[str]:
+    return [
+        timing.format(name)
+        for name, timing in sorted(
+            timings.items(), key=lambda item: item[1].total, reverse=True
+        )[:REPORT_TOP_N]
+    ]
+
+
+class _TimedListener:
+    """
+    Stands in for a cog listener while profiling. It compares equal to the listener
+    it wraps, so `remove_listener` still works if the cog is unloaded meanwhile.
+    """
+
+    def __init__(self, listener: Callable, timings: Dict[str, _Timing], name: str):
+        self.listener: Callable = listener
+        self.__name__: str = listener.__name__
+        self._timings: Dict[str, _Timing] = timings
+        self._name: str = name
+
+    async def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        start: float = time.perf_counter()
+        try:
+            return await self.listener(*args, **kwargs)
+        finally:
+            self._timings.setdefault(self._name, _Timing()).add(
+                time.perf_counter() - start
+            )
+
+    def __eq__(self, other: object) -> bool:
+        return other is self or other == self.listener
+
+    def __hash__(self) -> int:
+        return hash(self.listener)
+
+
+class EventLoopProfiler:
+    """
+    Profiling that can be switched on while the bot is running (see `!profile`).
+    While it's on:
+    - asyncio's debug mode reports callbacks that block the loop for longer than
+      the slow callback threshold; the reports are collected instead of logged
+    - a watchdog thread samples the loop's stack whenever it's been stalled for
+      longer than the stall threshold, which points at the blocking code itself
+    - every cog listener and scheduled job run is timed
+    Debug mode slows the event loop down, so leave it off outside of an incident.
+    """
+
+    def __init__(self, client: commands.Bot):
+        self.client: commands.Bot = client
+        self.started_at: Optional[float] = None
+        self.slow_callbacks: Dict[str, _Timing] = {}
+        self.stalls: Dict[Tuple[str, ...], int] = {}
+        self.listeners: Dict[str, _Timing] = {}
+        self.loops: Dict[str, _Timing] = {}
+
+        self._stall_threshold: float = DEFAULT_STALL_MS / 1000
+        self._heartbeat: float = 0.0
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped: threading.Event = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._previous_debug: Tuple[bool, float] = (False, 0.1)
+        self._patched_loops: List[Tuple[Job, Callable]] = []
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None
+
+    def start(
+        self,
+        slow_callback_ms: int = DEFAULT_SLOW_CALLBACK_MS,
+        stall_ms: int = DEFAULT_STALL_MS,
+    ) -> None:
+        """Starts a profiling session; must be called from the event loop."""
+        if self.running:
+            raise RuntimeError("The profiler is already running.")
+        self.slow_callbacks, self.stalls = {}, {}
+        self.listeners, self.loops = {}, {}
+        self.started_at = time.perf_counter()
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        self._previous_debug = (loop.get_debug(), loop.slow_callback_duration)
+        loop.slow_callback_duration = slow_callback_ms / 1000
+        loop.set_debug(True)
+        logging.getLogger("asyncio").addFilter(self._capture_slow_callback)
+
+        self._stall_threshold = stall_ms / 1000
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._heartbeat_task = asyncio.ensure_future(self._beat())
+        self._stopped.clear()
+        self._watchdog = threading.Thread(
+            target=self._watch, name="event-loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+        self._wrap_listeners()
+        self._wrap_loops()
+
+    def stop(self) -> List[str]:
+        """Ends the session, restoring everything it changed; returns the report."""
+        if not self.running:
+            raise RuntimeError("The profiler isn't running.")
+        self._unwrap_loops()
+        self._unwrap_listeners()
+
+        self._stopped.set()
+        self._watchdog.join()
+        self._heartbeat_task.cancel()
+
+        logging.getLogger("asyncio").removeFilter(self._capture_slow_callback)
+        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        debug, loop.slow_callback_duration = self._previous_debug
+        loop.set_debug(debug)
+
+        report: List[str] = self.report()
+        self.started_at = None
+        return report
+
+    def report(self) -> List[str]:
+        """Top offenders of the current session, for `!profile`."""
+        lines: List[str] = [
+            f"**Profiled for {time.perf_counter() - self.started_at:.1f}s**",
+            "**Slow callbacks**",
+        ]
+        lines += _top(self.slow_callbacks) or ["None"]
+        lines.append("**Stalled event loop (stack samples)**")
+        # The watchdog thread may be adding samples; copying the dict is atomic
+        samples: List[Tuple[Tuple[str, ...], int]] = sorted(
+            dict(self.stalls).items(), key=lambda item: item[1], reverse=True
+        )[:REPORT_TOP_N]
+        lines += [
+            f"{count} samples ({count * self._stall_threshold:.1f}s+):\n```"
+            + "\n".join(stack)
+            + "```"
+            for stack, count in samples
+        ] or ["None"]
+        lines.append("**Listeners**")
+        lines += _top(self.listeners) or ["None"]
+        lines.append("**Scheduled jobs**")
+        lines += _top(self.loops) or ["None"]
+        return lines
+
+    def _capture_slow_callback(self, record: logging.LogRecord) -> bool:
+        # Logged by the event loop as ("Executing %s took %.3f seconds", handle, dt)
+        if not str(record.msg).startswith("Executing") or len(record.args or ()) != 2:
+            return True
+        handle, duration = record.args
+        self.slow_callbacks.setdefault(
+            _HANDLE_NOISE.sub("", str(handle)), _Timing()
+        ).add(duration)
+        return False
+
+    async def _beat(self) -> None:
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self._stall_threshold / 4)
+
+    def _watch(self) -> None:
+        # Runs in its own thread, so it keeps going while the event loop is blocked
+        while not self._stopped.wait(self._stall_threshold):
+            if time.monotonic() - self._heartbeat < self._stall_threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack: Tuple[str, ...] = tuple(
+                f"{os.path.basename(summary.filename)}:{summary.lineno} "
+                f"in {summary.name}"
+                for summary in traceback.extract_stack(frame)[-STACK_DEPTH:]
+            )
+            self.stalls[stack] = self.stalls.get(stack, 0) + 1
+
+    def _wrap_listeners(self) -> None:
+        for cog_name, cog in self.client.cogs.items():
+            for event_name, method in cog.get_listeners():
+                listeners: List[Callable] = self.client.extra_events.get(event_name, [])
+                for i, listener in enumerate(listeners):
+                    if listener == method and not isinstance(listener, _TimedListener):
+                        listeners[i] = _TimedListener(
+                            listener, self.listeners, f"{cog_name}.{event_name}"
+                        )
+
+    def _unwrap_listeners(self) -> None:
+        for listeners in self.client.extra_events.values():
+            for i, listener in enumerate(listeners):
+                if isinstance(listener, _TimedListener):
+                    listeners[i] = listener.listener
+
+    def _wrap_loops(self) -> None:
+        for job in self.client.scheduler.jobs():
+            original: Callable = job.func
+
+            async def timed(func=original, name=job.name):
+                start: float = time.perf_counter()
+                try:
+                    await func()
+                finally:
+                    self.loops.setdefault(name, _Timing()).add(
+                        time.perf_counter() - start
+                    )
+
+            job.func = timed
+            self._patched_loops.append((job, original))
+
+    def _unwrap_loops(self) -> None:
+        for job, original in self._patched_loops:
+            job.func = original
+        self._patched_loops = []
@@ -0,0 +1,171 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from utils.Metrics import DISCORD_API_HOSTS, DISCORD_BACKGROUND_WAIT, normalize_route
+
+# Discord allows 50 requests per second across all routes
+GLOBAL_RATE_LIMIT: int = 50
+# Background jobs leave the rest of the global limit to interactive commands
+GLOBAL_BACKGROUND_LIMIT: int = GLOBAL_RATE_LIMIT - 15
+# Calls per bucket that background jobs leave to interactive commands
+BACKGROUND_RESERVE: int = 1
+
+# Expired buckets are dropped once this many routes are tracked
+MAX_TRACKED_ROUTES: int = 2000
+
+# Set inside `throttle` blocks, whose first request was already counted
+_counted: ContextVar[bool] = ContextVar("rest_budget_counted", default=False)
+
+
+class _Bucket:
+    __slots__ = ("limit", "remaining", "reset_at")
+
+    def __init__(self, limit: int, remaining: int, reset_at: float):
+        self.limit: int = limit
+        self.remaining: int = remaining
+        self.reset_at: float = reset_at
+
+
+class RestBudget:
+    """
+    Client-side view of Discord's REST rate limits, shared by every cog. Buckets are
+    learned from the rate limit headers of each response (see `attach`).
+
+    Interactive commands send their requests as usual. Background jobs (refreshers,
+    bulk reactions) make each request in a `throttle` block, which waits while the
+    request's bucket is down to its last `BACKGROUND_RESERVE` calls or background
+    requests have used `GLOBAL_BACKGROUND_LIMIT` of the last second, so they back
+    off before a 429 and leave headroom for commands.
+    """
+
+    def __init__(self):
+        # Route (with its major parameter) -> Discord's bucket hash
+        self._routes: Dict[str, str] = {}
+        self._buckets: Dict[str, _Bucket] = {}
+        # Send times of the requests in the last second
+        self._recent: Deque[float] = deque()
+        self._global_reset_at: float = 0.0
+
+    def attach(self, trace: Any) -> None:
+        """Feeds the budget from an aiohttp trace config (the client's `http_trace`)."""
+
+        async def on_request_start(session: Any, context: Any, params: Any) -> None:
+            if params.url.host not in DISCORD_API_HOSTS:
+                return
+            # Background requests were already counted by `throttle`
+            if _counted.get():
+                _counted.set(False)
+            else:
+                self._recent.append(time.monotonic())
+
+        async def on_request_end(session: Any, context: Any, params: Any) -> None:
+            if params.url.host in DISCORD_API_HOSTS:
+                self.record(
+                    params.method,
+                    params.url.path,
+                    params.response.status,
+                    params.response.headers,
+                )
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+
+    @staticmethod
+    def _route(method: str, path: str) -> str:
+        return f"{method.upper()} {normalize_route(path, keep_major=True)}"
+
+    def record(self, method: str, path: str, status: int, headers: Any) -> None:
+        """Updates the route's bucket from the rate limit headers of a response."""
+        now: float = time.monotonic()
+        if status == 429 and headers.get("X-RateLimit-Global"):
+            self._global_reset_at = now + float(headers.get("Retry-After", 1))
+        bucket_hash: Optional[str] = headers.get("X-RateLimit-Bucket")
+        if bucket_hash is None:
+            return
+        if len(self._routes) >= MAX_TRACKED_ROUTES:
+            self._prune(now)
+        self._routes[self._route(method, path)] = bucket_hash
+        try:
+            bucket: _Bucket = _Bucket(
+                int(headers.get("X-RateLimit-Limit", 1)),
+                int(headers.get("X-RateLimit-Remaining", 1)),
+                now + float(headers.get("X-RateLimit-Reset-After", 0)),
+            )
+        except ValueError:
+            return
+        if status == 429:
+            bucket.remaining = 0
+        self._buckets[bucket_hash] = bucket
+
+    def _prune(self, now: float) -> None:
+        expired = {
+            bucket_hash
+            for bucket_hash, bucket in self._buckets.items()
+            if bucket.reset_at <= now
+        }
+        for bucket_hash in expired:
+            del self._buckets[bucket_hash]
+        self._routes = {
+            route: bucket_hash
+            for route, bucket_hash in self._routes.items()
+            if bucket_hash not in expired
+        }
+
+    def _bucket(self, route: str) -> Optional[_Bucket]:
+        bucket_hash: Optional[str] = self._routes.get(route)
+        return None if bucket_hash is None else self._buckets.get(bucket_hash)
+
+    def delay(self, method: str, path: str) -> float:
+        """How long a background request to the route should wait right now."""
+        now: float = time.monotonic()
+        if self._global_reset_at > now:
+            return self._global_reset_at - now
+        while self._recent and self._recent[0] <= now - 1:
+            self._recent.popleft()
+        if len(self._recent) >= GLOBAL_BACKGROUND_LIMIT:
+            return self._recent[0] + 1 - now
+        bucket: Optional[_Bucket] = self._bucket(self._route(method, path))
+        if bucket is None:
+            return 0.0
+        if bucket.reset_at <= now:
+            bucket.remaining = bucket.limit
+            return 0.0
+        if bucket.remaining <= BACKGROUND_RESERVE:
+            return bucket.reset_at - now
+        return 0.0
+
+    @asynccontextmanager
+    async def throttle(self, method: str, path: str) -> AsyncIterator[float]:
+        """
+        Waits until a background request to `path` (eg. f"/channels/{thread.id}") fits
+        in the budget, then counts it against the budget; make the request in the
+        block. Yields how long it waited.
+        """
+        start: float = time.monotonic()
+        delay: float = self.delay(method, path)
+        throttled: bool = delay > 0
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay(method, path)
+
+        # Count the request now, so waiters woken together don't all go at once;
+        # the response's headers correct the bucket afterwards
+        now: float = time.monotonic()
+        self._recent.append(now)
+        bucket: Optional[_Bucket] = self._bucket(self._route(method, path))
+        if bucket is not None:
+            bucket.remaining -= 1
+        waited: float = now - start if throttled else 0.0
+        if throttled:
+            DISCORD_BACKGROUND_WAIT.observe(waited, route=normalize_route(path))
+        token = _counted.set(True)
+        try:
+            yield waited
+        finally:
+            # Otherwise a request that was cancelled or never sent would leave the
+            # task's next request uncounted
+            _counted.reset(token)
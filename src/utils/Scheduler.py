@@ -0,0 +1,286 @@
+import asyncio
+import datetime
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from utils.Metrics import JOB_RUNS, LOOP_TICK_DURATION
+
+# Cron fields: (name, lowest value, highest value)
+_CRON_FIELDS: List[Tuple[str, int, int]] = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    # 0 and 7 are both Sunday
+    ("weekday", 0, 7),
+]
+
+# `CronTrigger` stops looking for a matching minute this far ahead (eg. "0 0 31 2 *")
+MAX_CRON_LOOKAHEAD: datetime.timedelta = datetime.timedelta(days=366 * 4)
+
+
+class IntervalTrigger:
+    """Runs a job every `seconds`, counted from when its last run was due."""
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("The interval must be positive.")
+        self.seconds: float = seconds
+
+    def next_run(self, after: float) -> float:
+        return after + self.seconds
+
+    def __str__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+class CronTrigger:
+    """
+    Runs a job on a cron schedule in local time: "minute hour day month weekday",
+    where each field is `*`, a number, a range (`1-5`), a step (`*/15`, `1-30/2`) or
+    a comma separated list of those. As in cron, a job whose day and weekday are
+    both restricted runs when either matches.
+    """
+
+    def __init__(self, expression: str):
+        self.expression: str = expression
+        fields: List[str] = expression.split()
+        if len(fields) != len(_CRON_FIELDS):
+            raise ValueError(f"Expected {len(_CRON_FIELDS)} cron fields: {expression}")
+        self._values: List[Set[int]] = [
+            self._parse_field(field, name, low, high)
+            for field, (name, low, high) in zip(fields, _CRON_FIELDS)
+        ]
+        self.minutes, self.hours, self.days, self.months, weekdays = self._values
+        # Python counts weekdays from Monday; cron from Sunday
+        self.weekdays: Set[int] = {(weekday - 1) % 7 for weekday in weekdays}
+        self._any_day: bool = fields[2] == "*"
+        self._any_weekday: bool = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, name: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            range_part, _, step_part = part.partition("/")
+            try:
+                step: int = int(step_part) if step_part else 1
+                if range_part == "*":
+                    start, end = low, high
+                elif "-" in range_part:
+                    start, end = (int(value) for value in range_part.split("-", 1))
+                else:
+                    start = int(range_part)
+                    end = high if step_part else start
+            except ValueError:
+                raise ValueError(f"Invalid cron {name}: {field}") from None
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Invalid cron {name}: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime.datetime) -> bool:
+        day: bool = moment.day in self.days
+        weekday: bool = moment.weekday() in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_run(self, after: float) -> float:
+        moment: datetime.datetime = datetime.datetime.fromtimestamp(after).replace(
+            second=0, microsecond=0
+        ) + datetime.timedelta(minutes=1)
+        give_up_at: datetime.datetime = moment + MAX_CRON_LOOKAHEAD
+        # Skip whole months, days and hours that don't match before checking minutes
+        while moment < give_up_at:
+            if moment.month not in self.months:
+                next_month: datetime.datetime = moment.replace(
+                    day=1, hour=0, minute=0
+                ) + datetime.timedelta(days=32)
+                moment = next_month.replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"The cron expression never matches: {self.expression}")
+
+    def __str__(self) -> str:
+        return f"cron `{self.expression}`"
+
+
+Trigger = Union[IntervalTrigger, CronTrigger]
+
+
+class Job:
+    """A named coroutine function run by the `Scheduler`."""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[None]],
+        trigger: Trigger,
+        jitter: float,
+    ):
+        self.name: str = name
+        self.func: Callable[[], Awaitable[None]] = func
+        self.trigger: Trigger = trigger
+        # Runs start up to this many seconds late, so jobs due at the same time (or
+        # the same job on several shards) don't all hit the APIs at once
+        self.jitter: float = jitter
+        self.paused: bool = False
+        # When the next run is due, before and after jitter
+        self.due_at: float = 0.0
+        self.next_run_at: float = 0.0
+        self.running: Optional[asyncio.Future] = None
+        self.last_run_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.runs: int = 0
+        # Runs that were due while the previous one was still going
+        self.skipped: int = 0
+
+    def schedule(self, now: float) -> None:
+        due_at: float = self.trigger.next_run(self.due_at or now)
+        if due_at <= now:
+            # Behind (eg. after a pause or a slow run); don't run the missed ones
+            due_at = self.trigger.next_run(now)
+        self.due_at = due_at
+        self.next_run_at = due_at + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    """
+    Runs the bot's background jobs from one task, instead of each cog running its
+    own timer. Jobs never overlap themselves: a run that's due while the previous
+    one is still going is skipped (and counted). Run durations and outcomes are
+    recorded per job (see `!stats`), and jobs can be paused and resumed at runtime
+    (see `!jobs`).
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._driver: Optional[asyncio.Future] = None
+        # Wakes the driver when jobs change; created with it, on the event loop
+        self._changed: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._driver is not None
+
+    def _reschedule(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+
+    def add_job(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[None]],
+        trigger: Trigger,
+        *,
+        jitter: float = 0.0,
+    ) -> Job:
+        if name in self._jobs:
+            raise ValueError(f"A job named {name} already exists.")
+        job: Job = Job(name, func, trigger, jitter)
+        job.schedule(time.time())
+        self._jobs[name] = job
+        self._reschedule()
+        return job
+
+    def remove_job(self, name: str) -> None:
+        """Removes the job, cancelling its run if it's running; eg. on cog unload."""
+        job: Optional[Job] = self._jobs.pop(name, None)
+        if job is not None and job.running is not None:
+            job.running.cancel()
+        self._reschedule()
+
+    def get_job(self, name: str) -> Optional[Job]:
+        return self._jobs.get(name)
+
+    def jobs(self) -> List[Job]:
+        return sorted(self._jobs.values(), key=lambda job: job.name)
+
+    def pause(self, name: str) -> None:
+        """Stops scheduling the job; a run in progress finishes."""
+        self._jobs[name].paused = True
+        self._reschedule()
+
+    def resume(self, name: str) -> None:
+        job: Job = self._jobs[name]
+        if job.paused:
+            job.paused = False
+            job.schedule(time.time())
+            self._reschedule()
+
+    def run_now(self, name: str) -> bool:
+        """Starts a run of the job out of schedule, unless it's already running."""
+        job: Job = self._jobs[name]
+        if job.running is not None:
+            return False
+        self._start_run(job)
+        return True
+
+    def start(self) -> None:
+        if self._driver is None:
+            self._changed = asyncio.Event()
+            self._driver = asyncio.ensure_future(self._drive())
+
+    def stop(self) -> List[asyncio.Future]:
+        """Stops scheduling new runs; returns the runs still in progress."""
+        if self._driver is not None:
+            self._driver.cancel()
+            self._driver = None
+        return [job.running for job in self._jobs.values() if job.running is not None]
+
+    async def _drive(self) -> None:
+        while True:
+            self._changed.clear()
+            now: float = time.time()
+            for job in list(self._jobs.values()):
+                if job.paused or job.next_run_at > now:
+                    continue
+                if job.running is not None:
+                    job.skipped += 1
+                    JOB_RUNS.inc(job=job.name, outcome="skipped")
+                else:
+                    self._start_run(job)
+                job.schedule(now)
+
+            next_run_at: Optional[float] = min(
+                (job.next_run_at for job in self._jobs.values() if not job.paused),
+                default=None,
+            )
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait(),
+                    None if next_run_at is None else max(0.0, next_run_at - now),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def _start_run(self, job: Job) -> None:
+        job.running = asyncio.ensure_future(self._run(job))
+
+    async def _run(self, job: Job) -> None:
+        job.last_run_at = time.time()
+        started_at: float = time.perf_counter()
+        outcome: str = "ok"
+        try:
+            await job.func()
+            job.last_error = None
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "error"
+            job.last_error = f"{type(e).__name__}: {e}"
+            logging.exception(f"Job {job.name} failed")
+        finally:
+            job.running = None
+            job.runs += 1
+            LOOP_TICK_DURATION.observe(time.perf_counter() - started_at, loop=job.name)
+            JOB_RUNS.inc(job=job.name, outcome=outcome)
@@ -0,0 +1,114 @@
+from typing import Dict, Hashable, List, Set, Tuple
+import math
+import re
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Mostly English filler plus URL noise, since a lot of the indexed content is links
+STOP_WORDS: Set[str] = {
+    "a",
+    "an",
+    "and",
+    "are",
+    "as",
+    "at",
+    "be",
+    "by",
+    "com",
+    "for",
+    "from",
+    "how",
+    "http",
+    "https",
+    "in",
+    "is",
+    "it",
+    "of",
+    "on",
+    "or",
+    "the",
+    "this",
+    "to",
+    "up",
+    "use",
+    "what",
+    "with",
+    "www",
+}
+
+# Standard BM25 tuning parameters
+BM25_K1: float = 1.5
+BM25_B: float = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOP_WORDS
+    ]
+
+
+class SearchIndex:
+    """
+    Inverted index with BM25 ranking. Documents can be added and removed
+    incrementally; only the postings of the affected document's terms are touched.
+    """
+
+    def __init__(self):
+        # term -> {doc_id -> term frequency}
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        # doc_id -> (document length, distinct terms)
+        self._documents: Dict[Hashable, Tuple[int, Set[str]]] = {}
+        self._total_length: int = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add(self, doc_id: Hashable, text: str) -> None:
+        """Indexes a document, replacing any previous document with the same ID."""
+        if doc_id in self._documents:
+            self.remove(doc_id)
+        tokens: List[str] = tokenize(text)
+        frequencies: Dict[str, int] = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+        self._documents[doc_id] = (len(tokens), set(frequencies))
+        self._total_length += len(tokens)
+
+    def remove(self, doc_id: Hashable) -> None:
+        if doc_id not in self._documents:
+            return
+        length, terms = self._documents.pop(doc_id)
+        self._total_length -= length
+        for term in terms:
+            postings: Dict[Hashable, int] = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query: str, limit: int = 25) -> List[Tuple[Hashable, float]]:
+        """Returns up to `limit` (doc_id, score) pairs, best match first."""
+        if not self._documents:
+            return []
+        document_count: int = len(self._documents)
+        average_length: float = (self._total_length / document_count) or 1.0
+        scores: Dict[Hashable, float] = {}
+        for term in set(tokenize(query)):
+            postings: Dict[Hashable, int] = self._postings.get(term)
+            if not postings:
+                continue
+            idf: float = math.log(
+                1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for doc_id, frequency in postings.items():
+                length: int = self._documents[doc_id][0]
+                norm: float = frequency + BM25_K1 * (
+                    1 - BM25_B + BM25_B * length / average_length
+                )
+                scores[doc_id] = (
+                    scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / norm
+                )
+        return sorted(scores.items(), key=lambda item: (-item[1], str(item[0])))[:limit]
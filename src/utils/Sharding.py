@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import signal
+import sqlite3
+import subprocess
+import threading
+import time
+from contextlib import asynccontextmanager, closing
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from discord.ext import commands
+
+from utils.JsonTools import SECRETS_PATH
+
+SHARD_DB_FILENAME: str = "shards.db"
+SHARD_LOG_FILENAME: str = "bot_info.shard{shard_id}.log"
+SUPERVISOR_LOG_FILENAME: str = "bot_supervisor.log"
+
+# Shards write a heartbeat this often once they're ready...
+HEARTBEAT_INTERVAL: float = 10.0
+# ...and are restarted when it's this old, eg. because their event loop is stuck
+HEARTBEAT_TIMEOUT: float = 60.0
+# Shards that haven't become ready this long after starting are restarted
+STARTUP_TIMEOUT: float = 300.0
+
+HEALTH_CHECK_INTERVAL: float = 5.0
+# Discord allows one gateway identify per 5 seconds, so shards start staggered
+SPAWN_INTERVAL: float = 5.0
+# Restarts back off exponentially, unless the shard was up for `STABLE_AFTER`
+RESTART_BACKOFF: float = 5.0
+MAX_RESTART_BACKOFF: float = 300.0
+STABLE_AFTER: float = 600.0
+# Shards get this long to exit after SIGTERM before they're killed (see `Lifecycle`)
+SHUTDOWN_TIMEOUT: float = 30.0
+
+# Locks whose owner died are taken over after this long
+LOCK_TTL: float = 60.0
+LOCK_POLL_INTERVAL: float = 0.5
+
+
+class ShardStore:
+    """
+    State shared by the shard processes and their supervisor, in a SQLite database
+    in WAL mode so that readers don't wait on the writer. Every call opens its own
+    connection and blocks briefly; on the event loop, call it from an executor.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path: str = path or os.path.join(SECRETS_PATH, SHARD_DB_FILENAME)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS shards ("
+                " shard_id INTEGER PRIMARY KEY, pid INTEGER, status TEXT,"
+                " started_at REAL, heartbeat_at REAL, guild_count INTEGER,"
+                " restarts INTEGER DEFAULT 0)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS locks ("
+                " name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = sqlite3.connect(self.path, timeout=10)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def register(self, shard_id: int, pid: int, restarts: int) -> None:
+        """Records a newly started shard process; called by the supervisor."""
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO shards (shard_id, pid, status, started_at,"
+                " heartbeat_at, guild_count, restarts)"
+                " VALUES (?, ?, 'starting', ?, NULL, 0, ?)",
+                (shard_id, pid, time.time(), restarts),
+            )
+
+    def heartbeat(self, shard_id: int, status: str, guild_count: int) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE shards SET status = ?, heartbeat_at = ?, guild_count = ?"
+                " WHERE shard_id = ?",
+                (status, time.time(), guild_count, shard_id),
+            )
+
+    def mark(self, shard_id: int, status: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE shards SET status = ? WHERE shard_id = ?", (status, shard_id)
+            )
+
+    def shards(self) -> List[Dict[str, Any]]:
+        with closing(self._connect()) as connection:
+            return [
+                dict(row)
+                for row in connection.execute("SELECT * FROM shards ORDER BY shard_id")
+            ]
+
+    def acquire(self, name: str, owner: str, ttl: float = LOCK_TTL) -> bool:
+        """Takes the named lock if it's free, expired or already ours."""
+        now: float = time.time()
+        with closing(self._connect()) as connection, connection:
+            cursor: sqlite3.Cursor = connection.execute(
+                "INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET"
+                " owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE locks.owner = excluded.owner OR locks.expires_at <= ?",
+                (name, owner, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name: str, owner: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner)
+            )
+
+    @asynccontextmanager
+    async def lock(self, name: str) -> AsyncIterator[None]:
+        """Holds the named lock across all shard processes, eg. for a migration."""
+        owner: str = str(os.getpid())
+        loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+        while not await loop.run_in_executor(None, self.acquire, name, owner):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            await loop.run_in_executor(None, self.release, name, owner)
+
+
+async def send_heartbeats(client: commands.Bot, store: ShardStore) -> None:
+    """Reports the shard as alive for as long as its event loop keeps running."""
+    loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
+    while True:
+        try:
+            await loop.run_in_executor(
+                None,
+                store.heartbeat,
+                client.shard_id,
+                "ready" if client.is_ready() else "connecting",
+                len(client.guilds),
+            )
+        except sqlite3.Error as e:
+            logging.warning(f"Failed to write the shard heartbeat: {e}")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+class _ShardProcess:
+    def __init__(self, shard_id: int):
+        self.shard_id: int = shard_id
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at: float = 0.0
+        # When the process should be (re)started
+        self.start_at: float = 0.0
+        self.restarts: int = 0
+        self.failures: int = 0
+
+
+class ShardSupervisor:
+    """
+    Runs each shard in its own process and keeps them up. A shard is restarted,
+    with exponential backoff, when its process exits, when it doesn't become ready
+    within `STARTUP_TIMEOUT`, or when its heartbeat goes stale. SIGTERM and SIGINT
+    stop every shard and then the supervisor.
+    """
+
+    def __init__(
+        self,
+        shard_count: int,
+        command: Callable[[int], List[str]],
+        store: ShardStore,
+    ):
+        self.shard_count: int = shard_count
+        self.command: Callable[[int], List[str]] = command
+        self.store: ShardStore = store
+        self._shards: List[_ShardProcess] = [
+            _ShardProcess(shard_id) for shard_id in range(shard_count)
+        ]
+        self._last_spawn_at: float = 0.0
+        self._stopping: threading.Event = threading.Event()
+
+    def run(self) -> None:
+        """Supervises the shards until a stop signal; blocks the calling thread."""
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self._stopping.set())
+        logging.info("Supervising %d shards", self.shard_count)
+        while not self._stopping.is_set():
+            try:
+                self._check()
+            except sqlite3.Error as e:
+                logging.warning(f"Failed to read the shard heartbeats: {e}")
+            self._stopping.wait(HEALTH_CHECK_INTERVAL)
+        self._stop_all()
+
+    def _spawn(self, shard: _ShardProcess) -> None:
+        shard.process = subprocess.Popen(self.command(shard.shard_id))
+        shard.started_at = self._last_spawn_at = time.time()
+        self.store.register(shard.shard_id, shard.process.pid, shard.restarts)
+        logging.info("Started shard %d (pid %d)", shard.shard_id, shard.process.pid)
+
+    def _check(self) -> None:
+        now: float = time.time()
+        heartbeats: Dict[int, Optional[float]] = {
+            row["shard_id"]: row["heartbeat_at"] for row in self.store.shards()
+        }
+        for shard in self._shards:
+            if shard.process is None:
+                spawn_due: bool = now - self._last_spawn_at >= SPAWN_INTERVAL
+                if now >= shard.start_at and spawn_due:
+                    self._spawn(shard)
+                continue
+
+            exit_code: Optional[int] = shard.process.poll()
+            heartbeat: Optional[float] = heartbeats.get(shard.shard_id)
+            problem: Optional[str] = None
+            if exit_code is not None:
+                problem = f"exited with code {exit_code}"
+            elif heartbeat is None or heartbeat < shard.started_at:
+                if now - shard.started_at > STARTUP_TIMEOUT:
+                    problem = f"didn't become ready in {STARTUP_TIMEOUT:.0f}s"
+            elif now - heartbeat > HEARTBEAT_TIMEOUT:
+                problem = f"missed heartbeats for {now - heartbeat:.0f}s"
+            if problem is not None:
+                self._restart(shard, problem, now)
+
+    def _restart(self, shard: _ShardProcess, problem: str, now: float) -> None:
+        self._terminate([shard])
+        if now - shard.started_at >= STABLE_AFTER:
+            shard.failures = 0
+        shard.failures += 1
+        delay: float = min(
+            RESTART_BACKOFF * 2 ** (shard.failures - 1), MAX_RESTART_BACKOFF
+        )
+        shard.start_at = now + delay
+        shard.restarts += 1
+        self.store.mark(shard.shard_id, "restarting")
+        logging.warning(
+            "Shard %d %s; restarting in %.0fs", shard.shard_id, problem, delay
+        )
+
+    def _terminate(self, shards: List[_ShardProcess]) -> None:
+        running: List[_ShardProcess] = [
+            shard
+            for shard in shards
+            if shard.process is not None and shard.process.poll() is None
+        ]
+        for shard in running:
+            shard.process.terminate()
+        deadline: float = time.monotonic() + SHUTDOWN_TIMEOUT
+        for shard in running:
+            try:
+                shard.process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logging.warning("Shard %d didn't stop; killing it", shard.shard_id)
+                shard.process.kill()
+                shard.process.wait()
+        for shard in shards:
+            shard.process = None
+
+    def _stop_all(self) -> None:
+        logging.info("Stopping %d shards", self.shard_count)
+        self._terminate(self._shards)
+        for shard in self._shards:
+            self.store.mark(shard.shard_id, "stopped")
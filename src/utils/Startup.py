@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from discord.ext import commands
+
+# Phases recorded for every cog
+SETUP_PHASE: str = "setup"
+STATE_PHASE: str = "state"
+
+
+class StartupReport:
+    """Per-cog timing of the startup phases, logged once the bot is up."""
+
+    def __init__(self):
+        self.started_at: float = time.perf_counter()
+        self.ready_at: Optional[float] = None
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, phase: str, duration: float) -> None:
+        self.timings.setdefault(name, {})[phase] = duration
+
+    @contextmanager
+    def measure(self, name: str, phase: str):
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, phase, time.perf_counter() - start)
+
+    def mark_ready(self) -> None:
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter()
+
+    def format(self) -> List[str]:
+        lines: List[str] = []
+        if self.ready_at is not None:
+            lines.append(f"Ready after {self.ready_at - self.started_at:.3f}s")
+        for name, phases in sorted(self.timings.items()):
+            lines.append(
+                f"{name}: "
+                + ", ".join(
+                    f"{phase} {duration * 1000:.1f}ms"
+                    for phase, duration in phases.items()
+                )
+            )
+        return lines
+
+
+class StateNotLoaded(commands.CommandError):
+    """Raised for commands of a cog whose state failed to load."""
+
+
+class DeferredStateCog(commands.Cog):
+    """
+    Base cog for cogs with persisted state. Instead of reading files in `__init__`,
+    subclasses implement `load_state`, which runs once the bot is ready, or right
+    away for cogs loaded later (eg. `!load`). Commands wait for the state to be
+    loaded before they run; listeners and loops should call `wait_for_state`
+    themselves. If loading fails, `wait_for_state` raises `StateNotLoaded`, so the
+    cog's commands never write a partial state over the persisted one.
+    """
+
+    def __init__(self, client: commands.Bot):
+        self.client: commands.Bot = client
+        self._state_loaded: Optional[asyncio.Event] = None
+        self._state_loading: bool = False
+        self._state_error: Optional[Exception] = None
+        # A cog loaded after the bot is ready won't see `on_ready`; the load starts
+        # once the subclass is initialized and the cog has been added
+        if client.is_ready():
+            asyncio.ensure_future(self._load_deferred_state())
+
+    async def load_state(self) -> None:
+        """Overridden to load the cog's state; blocking I/O should go to an executor."""
+
+    async def shutdown(self) -> None:
+        """
+        Overridden to persist anything not yet written and release resources (eg.
+        HTTP sessions) when the bot stops (see `Lifecycle`) or the cog is unloaded.
+        Also called when the state failed to load (see `state_failed`); nothing
+        should be persisted then.
+        """
+
+    def cog_unload(self):
+        # Unloading (eg. `!reload`) doesn't go through `Lifecycle`; persist in the
+        # background, since discord.py doesn't await this
+        asyncio.ensure_future(self.shutdown())
+
+    def _state_event(self) -> asyncio.Event:
+        # Created lazily so that it's bound to the running loop
+        if self._state_loaded is None:
+            self._state_loaded = asyncio.Event()
+        return self._state_loaded
+
+    @property
+    def state_loaded(self) -> bool:
+        return self._state_loaded is not None and self._state_loaded.is_set()
+
+    @property
+    def state_failed(self) -> bool:
+        return self._state_error is not None
+
+    async def wait_for_state(self) -> None:
+        """Raises `StateNotLoaded` if the state failed to load."""
+        await self._state_event().wait()
+        if self._state_error is not None:
+            raise StateNotLoaded(
+                f"{self.qualified_name} failed to load its state: {self._state_error}"
+            )
+
+    @commands.Cog.listener("on_ready")
+    async def _load_deferred_state(self):
+        # on_ready can fire again after reconnects; only load once
+        if self._state_loading or self.state_loaded:
+            return
+        self._state_loading = True
+        try:
+            with self.client.startup_report.measure(self.qualified_name, STATE_PHASE):
+                await self.load_state()
+        except Exception as e:
+            logging.error(f"Failed to load state for {self.qualified_name}: {e}")
+            self._state_error = e
+        finally:
+            self._state_loading = False
+            # Set regardless so that waiters fail instead of hanging
+            self._state_event().set()
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        await self.wait_for_state()
@@ -0,0 +1,49 @@
+from typing import Dict, Iterable, Optional, Set
+
+
+class ThreadMembershipCache:
+    """
+    Who is in which thread, fed by the gateway's thread member events and by
+    member lists fetched once per thread. A thread is only authoritative once its
+    member list has been loaded ("primed"); until then, membership is unknown.
+    """
+
+    def __init__(self):
+        self._members: Dict[int, Set[int]] = {}
+        # Reverse index, so a user's threads can be listed without a scan
+        self._threads: Dict[int, Set[int]] = {}
+        self._primed: Set[int] = set()
+
+    def is_primed(self, thread_id: int) -> bool:
+        return thread_id in self._primed
+
+    def prime(self, thread_id: int, member_ids: Iterable[int]) -> None:
+        """Replaces what we know about a thread with its full member list."""
+        for user_id in self._members.pop(thread_id, set()):
+            self._threads.get(user_id, set()).discard(thread_id)
+        for user_id in member_ids:
+            self.add(thread_id, user_id)
+        self._members.setdefault(thread_id, set())
+        self._primed.add(thread_id)
+
+    def add(self, thread_id: int, user_id: int) -> None:
+        self._members.setdefault(thread_id, set()).add(user_id)
+        self._threads.setdefault(user_id, set()).add(thread_id)
+
+    def remove(self, thread_id: int, user_id: int) -> None:
+        self._members.get(thread_id, set()).discard(user_id)
+        self._threads.get(user_id, set()).discard(thread_id)
+
+    def forget(self, thread_id: int) -> None:
+        for user_id in self._members.pop(thread_id, set()):
+            self._threads.get(user_id, set()).discard(thread_id)
+        self._primed.discard(thread_id)
+
+    def is_member(self, thread_id: int, user_id: int) -> Optional[bool]:
+        """Whether the user is in the thread, or None if the thread isn't primed."""
+        if user_id in self._members.get(thread_id, ()):
+            return True
+        return False if thread_id in self._primed else None
+
+    def threads_of(self, user_id: int) -> Set[int]:
+        return set(self._threads.get(user_id, ()))
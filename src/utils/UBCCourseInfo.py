@@ -1,31 +1,308 @@
 import logging
-from typing import Callable, Dict, Optional
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
 from aiohttp.client_exceptions import ClientOSError
 
 from utils.Converters import Course
-from bs4 import BeautifulSoup
-import re
+from utils.CoursePages import (
+    DEFAULT_BULK_PARSER_BACKEND,
+    DEFAULT_PARSER_BACKEND,
+    STREAM_CHUNK_SIZE,
+    CourseBlock,
+    CourseBlockStream,
+    PARSER_FUNCTIONS,
+    build_course_info,
+    encode_message,
+    find_course_block,
+    parse_course_page,
+    parse_department_page,
+)
+from utils.Metrics import UBC_REQUEST_LATENCY, UBC_REQUEST_RETRIES
+import codecs
 import aiohttp
 import asyncio
 
 RETRY_COUNT: int = 3
 
+COURSE_DESCRIPTIONS_URL: str = (
+    "https://vancouver.calendar.ubc.ca/course-descriptions/subject/"
+)
+
+# Max department pages fetched at once by the bulk API; be nice to UBC
+BULK_FETCH_CONCURRENCY: int = 4
+
+# Parsing whole pages is CPU-bound, so it runs in this kind of executor:
+# "process", "thread", or "inline" (on the event loop, mostly for debugging).
+# Every parser process is a separate interpreter, so only a couple are started
+PARSER_EXECUTOR_KIND: str = "process"
+DEFAULT_PARSER_EXECUTOR_WORKERS: int = 2
+PARSER_EXECUTOR_WORKERS: Optional[int] = None  # Defaults to the above
+# Fewer pages than this (eg. a single lookup or department) are parsed in a thread
+# rather than starting the parser processes for them
+PARSER_PROCESS_MIN_PAGES: int = 3
+
+# The parser processes run `utils.CoursePages` from the source directory
+PARSER_WORKER_MODULE: str = "utils.CoursePages"
+_SOURCE_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 
 def get_course_url(dept: str, course: str):
-    return f"https://vancouver.calendar.ubc.ca/course-descriptions/subject/{dept.lower()}v"
+    return f"{COURSE_DESCRIPTIONS_URL}{dept.lower()}v"
+
+
+# When None, single course lookups stream the response through `CourseBlockStream`;
+# otherwise the page is buffered and parsed with this backend
+_parser_backend: Optional[str] = None
+
+
+def available_parser_backends() -> List[str]:
+    backends: List[str] = ["html.parser", "regex", "stream"]
+    try:
+        import lxml  # noqa: F401
+
+        backends.insert(1, "lxml")
+    except ImportError:
+        pass
+    return backends
+
+
+def get_parser_backend() -> Optional[str]:
+    return _parser_backend
+
+
+def set_parser_backend(name: Optional[str]) -> None:
+    """Forces a parser backend; `None` goes back to streaming lookups."""
+    global _parser_backend
+    if name is not None and name not in available_parser_backends():
+        raise ValueError(f"Parser backend {name} isn't available.")
+    _parser_backend = name
+
+
+def select_parser_backend(
+    samples: List[Tuple[str, Course, Optional[Dict[str, str]]]], rounds: int = 3
+) -> str:
+    """
+    Times every available backend over (page content, course, expected result)
+    samples and sets the fastest one that produces the expected results.
+    An expected result of `None` means the course shouldn't be found.
+    """
+    timings: Dict[str, float] = {}
+    for backend in available_parser_backends():
+        start: float = time.perf_counter()
+        correct: bool = True
+        for _ in range(rounds):
+            for content, course, expected in samples:
+                if parse_course_info(content, course, backend=backend) != expected:
+                    correct = False
+        if correct:
+            timings[backend] = time.perf_counter() - start
+        else:
+            logging.warning(f"Parser backend {backend} gave incorrect results.")
+    selected: str = min(timings, key=timings.get) if timings else DEFAULT_PARSER_BACKEND
+    set_parser_backend(selected)
+    logging.info(f"Selected parser backend: {selected}")
+    return selected
+
+
+def parse_course_info(
+    content: str, course: Course, backend: Optional[str] = None
+) -> Optional[Dict[str, str]]:
+    """Parses a course's info out of its department page with the given backend."""
+    return parse_course_page(
+        content,
+        str(course),
+        get_course_url(course.dept, course.course),
+        backend or _parser_backend or DEFAULT_PARSER_BACKEND,
+    )
+
+
+class ParserProcessPool:
+    """
+    Parser processes, started on demand up to `workers`. Each one runs
+    `python -m utils.CoursePages` and answers one request at a time over its
+    stdin/stdout. Unlike a multiprocessing pool, whose spawned workers re-run the
+    bot's main module, they only import the parsing code; not discord.py.
+    """
+
+    def __init__(self, workers: int):
+        self.workers: int = workers
+        self._processes: List[asyncio.subprocess.Process] = []
+        # Processes running or being started
+        self._size: int = 0
+        # Created lazily so that it's bound to the running loop
+        self._idle: Optional[asyncio.Queue] = None
+
+    async def _acquire(self) -> asyncio.subprocess.Process:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty() and self._size < self.workers:
+            self._size += 1
+            try:
+                process: asyncio.subprocess.Process = (
+                    await asyncio.create_subprocess_exec(
+                        sys.executable,
+                        "-m",
+                        PARSER_WORKER_MODULE,
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.PIPE,
+                        cwd=_SOURCE_DIR,
+                    )
+                )
+            except BaseException:
+                self._size -= 1
+                raise
+            self._processes.append(process)
+            return process
+        return await self._idle.get()
+
+    async def run(self, function: Callable[..., Any], *args: Any) -> Any:
+        if function.__name__ not in PARSER_FUNCTIONS:
+            raise ValueError(f"{function.__name__} can't run in a parser process.")
+        process: asyncio.subprocess.Process = await self._acquire()
+        try:
+            process.stdin.write(encode_message((function.__name__, args)))
+            await process.stdin.drain()
+            header: bytes = await process.stdout.readexactly(4)
+            ok, result = pickle.loads(
+                await process.stdout.readexactly(int.from_bytes(header, "big"))
+            )
+        except BaseException:
+            # Eg. cancelled mid-request; the process' pipes are out of step now
+            if process in self._processes:
+                self._processes.remove(process)
+                self._size -= 1
+            process.kill()
+            asyncio.ensure_future(process.wait())
+            raise
+        self._idle.put_nowait(process)
+        if not ok:
+            raise RuntimeError(f"Parser process failed: {result}")
+        return result
+
+    async def close(self) -> None:
+        """Lets the processes exit once their current request is done."""
+        processes: List[asyncio.subprocess.Process] = self._processes
+        self._processes, self._size = [], 0
+        for process in processes:
+            process.stdin.close()
+        await asyncio.gather(*[process.wait() for process in processes])
+
+
+_parser_pool: Optional[ParserProcessPool] = None
+_parser_executor: Optional[ThreadPoolExecutor] = None
+
+
+async def configure_parser_executor(
+    kind: str = PARSER_EXECUTOR_KIND, max_workers: Optional[int] = None
+) -> None:
+    """(Re)configures the executor used for whole-page parsing."""
+    global PARSER_EXECUTOR_KIND, PARSER_EXECUTOR_WORKERS
+    if kind not in {"process", "thread", "inline"}:
+        raise ValueError(f"Unknown parser executor kind {kind}.")
+    await shutdown_parser_executor()
+    PARSER_EXECUTOR_KIND = kind
+    PARSER_EXECUTOR_WORKERS = max_workers
+
+
+def _parser_workers() -> int:
+    return PARSER_EXECUTOR_WORKERS or min(
+        DEFAULT_PARSER_EXECUTOR_WORKERS, os.cpu_count() or 1
+    )
+
+
+async def shutdown_parser_executor() -> None:
+    global _parser_pool, _parser_executor
+    if _parser_pool is not None:
+        pool, _parser_pool = _parser_pool, None
+        await pool.close()
+    if _parser_executor is not None:
+        executor, _parser_executor = _parser_executor, None
+        await asyncio.get_event_loop().run_in_executor(None, executor.shutdown)
+
+
+async def _run_parser(pages: int, function: Callable[..., Any], *args: Any) -> Any:
+    """Runs a parse that's part of a batch of `pages` in the parser executor."""
+    global _parser_pool, _parser_executor
+    if PARSER_EXECUTOR_KIND == "inline":
+        return function(*args)
+    if PARSER_EXECUTOR_KIND == "process" and pages >= PARSER_PROCESS_MIN_PAGES:
+        if _parser_pool is None:
+            _parser_pool = ParserProcessPool(_parser_workers())
+        return await _parser_pool.run(function, *args)
+    executor: Optional[ThreadPoolExecutor] = None
+    if PARSER_EXECUTOR_KIND == "thread":
+        if _parser_executor is None:
+            _parser_executor = ThreadPoolExecutor(
+                max_workers=_parser_workers(), thread_name_prefix="course-parser"
+            )
+        executor = _parser_executor
+    # Otherwise the loop's default executor, ie. a thread
+    return await asyncio.get_event_loop().run_in_executor(executor, function, *args)
+
+
+async def _read_buffered(resp: Any, course: Course) -> Optional[Dict[str, str]]:
+    return await _run_parser(
+        1,
+        parse_course_page,
+        await resp.text(),
+        str(course),
+        get_course_url(course.dept, course.course),
+        _parser_backend,
+    )
+
+
+async def _read_streaming(resp: Any, course: Course) -> Optional[Dict[str, str]]:
+    """Feeds the response into the extractor chunk by chunk, stopping at the course."""
+    decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")(errors="replace")
+    stream: CourseBlockStream = CourseBlockStream()
+    course_key: str = str(course)
+    url: str = get_course_url(course.dept, course.course)
+    async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+        stream.feed(decoder.decode(chunk))
+        block: Optional[CourseBlock] = find_course_block(stream.blocks, course_key)
+        if block is not None:
+            return build_course_info(course_key, block, url)
+        stream.blocks.clear()
+    stream.feed(decoder.decode(b"", final=True))
+    stream.close()
+    block = find_course_block(stream.blocks, course_key)
+    return build_course_info(course_key, block, url) if block is not None else None
 
 
 async def _request_retry_wrapper(
-    url: str, parser: Callable[[str], Dict[str, str]]
+    url: str, reader: Callable[[Any], Awaitable[Optional[Dict[str, str]]]]
 ) -> Optional[Dict[str, str]]:
     for try_count in range(RETRY_COUNT):
+        start: float = time.perf_counter()
         try:
             async with aiohttp.request("GET", url) as resp:
-                return parser(await resp.text())
+                result: Optional[Dict[str, str]] = await reader(resp)
+            UBC_REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                outcome="no_result" if result is None else "ok",
+            )
+            return result
         except ClientOSError as e:
+            UBC_REQUEST_LATENCY.observe(time.perf_counter() - start, outcome="retry")
+            UBC_REQUEST_RETRIES.inc()
             logging.error(f"Error: {e}, try count: {try_count}")
             await asyncio.sleep(0.5)
         except Exception as e:
+            UBC_REQUEST_LATENCY.observe(time.perf_counter() - start, outcome="error")
             logging.error(f"Fatal error, aborting: {e}")
             return None
 
@@ -33,54 +310,45 @@ async def _request_retry_wrapper(
 async def scrape_course_info(course: Course) -> Optional[Dict[str, str]]:
     url: str = get_course_url(course.dept, course.course)
 
-    def parser(content: str):
-        soup = BeautifulSoup(content, "html.parser")
-        course_container = soup.find(
-            lambda predicate: predicate.name == "div" and "text-formatted" in predicate.get("class", [])
-            and all([c.upper() in predicate.text for c in {course.course, course.dept}])
-        )
+    async def reader(resp: Any) -> Optional[Dict[str, str]]:
+        if _parser_backend is None:
+            return await _read_streaming(resp, course)
+        return await _read_buffered(resp, course)
 
-        title = course_container.find(
-            lambda predicate: predicate.name == "h3"
-        )
+    return await _request_retry_wrapper(url, reader)
 
-        if not title:
-            return None
 
-        description = course_container.find(
-            lambda predicate: predicate.name == "p"
-        )
-
-        credits, name, prereqs, coreqs, desc = (
-            None,
-            None,
-            "None",
-            "None",
-            description.text,
-        )
-        title_parse = re.search(r"(?:[\S\s]+?)\(([0-9]+?)\)([\S\s]+)", title.text)
-        if not title_parse:
-            return None
-        pres = re.search(r"(?:Prerequisite\:)([\S\s]+?\.)", desc)
-        cos = re.search(r"(?:Corequisite\:)([\S\s]+?\.)", desc)
-        credits, name = title_parse.groups()
-        desc = desc.replace(
-            "This course is not eligible for Credit/D/Fail grading.", ""
-        )
-        if pres:
-            prereqs = pres.group(1)
-            desc = desc.replace(pres.group(0), "")
-        if cos:
-            coreqs = cos.group(1)
-            desc = desc.replace(cos.group(0), "")
-        return {
-            "url": url,
-            "name": f"{course.dept} {course.course} {name.strip()}",
-            "description": desc.strip(),
-            "prerequisites": prereqs.strip(),
-            "corequisites": coreqs.strip(),
-            "credits": str(credits),
-            "footer": "Source: UBC Course Schedule (Vancouver)",
-        }
-
-    return await _request_retry_wrapper(url, parser)
+async def scrape_departments(
+    depts: Iterable[str],
+) -> Dict[str, Optional[Dict[str, Dict[str, str]]]]:
+    """
+    Fetches and parses the pages of several departments in parallel. Fetches are
+    bounded by `BULK_FETCH_CONCURRENCY` and parsing runs in the parser executor,
+    so the event loop stays responsive. Maps each department to its courses (see
+    `CoursePages.parse_department_page`), or None if the page couldn't be retrieved.
+    """
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(BULK_FETCH_CONCURRENCY)
+    unique_depts: List[str] = sorted({dept.upper() for dept in depts})
+
+    async def scrape(dept: str) -> Optional[Dict[str, Dict[str, str]]]:
+        url: str = get_course_url(dept, "")
+
+        async def read_page(resp: Any) -> Optional[Dict[str, Dict[str, str]]]:
+            if resp.status != 200:
+                logging.error(f"Failed to retrieve {resp.url}: {resp.status}")
+                return None
+            return await _run_parser(
+                len(unique_depts),
+                parse_department_page,
+                await resp.text(),
+                url,
+                _parser_backend or DEFAULT_BULK_PARSER_BACKEND,
+            )
+
+        async with semaphore:
+            return await _request_retry_wrapper(url, read_page)
+
+    results: List[Optional[Dict[str, Dict[str, str]]]] = await asyncio.gather(
+        *[scrape(dept) for dept in unique_depts]
+    )
+    return dict(zip(unique_depts, results))
@@ -0,0 +1,25 @@
+"""
+Shared setup for the tests: the cogs run against the fake bot of the benchmarks
+(see `benchmarks/fakes.py`), with their state files in a temporary directory.
+"""
+import os
+import sys
+import tempfile
+
+REPO_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+import pytest  # noqa: E402
+import utils.JsonTools as JsonTools  # noqa: E402
+
+# Modules bind `SECRETS_PATH` when they're imported, so it's redirected before
+# any test imports them
+JsonTools.SECRETS_PATH = tempfile.mkdtemp(prefix="ecess-secrets-")
+
+from fakes import FakeBot, make_bot_dir  # noqa: E402
+
+
+@pytest.fixture
+def bot(tmp_path) -> FakeBot:
+    return FakeBot(make_bot_dir(str(tmp_path), REPO_DIR))
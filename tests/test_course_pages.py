@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+from conftest import REPO_DIR
+
+# Starts a parser process from a main module that imports discord.py, like
+# EcessClient.py, and has the parser process log its imports
+WORKER_SCRIPT: str = """
+import asyncio
+import os
+import discord
+from utils.CoursePages import parse_department_page
+from utils.UBCCourseInfo import ParserProcessPool
+
+PAGE = '<div class="text-formatted"><h3>CPEN 211 (4) Computing</h3><p>Hi.</p></div>'
+
+async def main():
+    # Read at interpreter startup, so only the parser process logs its imports
+    os.environ["PYTHONPROFILEIMPORTTIME"] = "1"
+    pool = ParserProcessPool(1)
+    courses = await pool.run(parse_department_page, PAGE, "url")
+    await pool.close()
+    assert list(courses) == ["CPEN 211"], courses
+
+asyncio.run(main())
+"""
+
+
+def test_parser_processes_import_no_discord_code():
+    worker = subprocess.run(
+        [sys.executable, "-c", WORKER_SCRIPT],
+        cwd=os.path.join(REPO_DIR, "src"),
+        capture_output=True,
+        text=True,
+    )
+    assert worker.returncode == 0, worker.stderr
+    imported = [
+        line.rsplit("|", 1)[1].strip()
+        for line in worker.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    ]
+    assert "utils" in imported
+    for module in ("discord", "aiohttp", "bs4"):
+        assert not [name for name in imported if name.split(".")[0] == module]
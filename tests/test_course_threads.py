@@ -0,0 +1,56 @@
+import asyncio
+import importlib
+
+import discord
+
+from fakes import FakeBot, FakeResponse
+
+
+async def _setup_course(bot: FakeBot):
+    from cogs.CourseThreads import BASE_CHANNEL_KEY, CURRENT_COURSES_KEY
+    from utils.Converters import Course
+
+    importlib.import_module("cogs.CourseThreads").setup(bot)
+    await bot.dispatch_ready()
+    cog = bot.cogs["CourseThreads"]
+    guild = bot.add_guild()
+    await cog.load_guild(guild.id)
+    base = guild.add_text_channel("2xx-courses")
+    thread = guild.add_thread(base, "CPEN 211")
+    cog.course_mappings[guild.id]["2"] = {
+        BASE_CHANNEL_KEY: base.id,
+        CURRENT_COURSES_KEY: {"CPEN 211": thread.id},
+    }
+
+    async def add_user(user):
+        raise discord.Forbidden(FakeResponse(403, "Forbidden"), "Missing Access")
+
+    thread.add_user = add_user
+    return cog, guild, base, Course.parse("CPEN 211")
+
+
+def test_failed_adds_link_threads_in_an_uncached_base_channel(bot: FakeBot):
+    async def scenario():
+        cog, guild, base, course = await _setup_course(bot)
+        # Not in the guild's cache, but the API still has it
+        del guild.channels[base.id]
+        member = guild.add_member()
+
+        assert await cog._add_user_to_courses(guild.id, member, [course]) == []
+        [message] = base.messages.values()
+        assert member.mention in message.content
+
+    asyncio.run(scenario())
+
+
+def test_failed_adds_skip_links_when_the_base_channel_is_gone(bot: FakeBot):
+    async def scenario():
+        cog, guild, base, course = await _setup_course(bot)
+        del guild.channels[base.id]
+        del bot.channels[base.id]
+
+        member = guild.add_member()
+        assert await cog._add_user_to_courses(guild.id, member, [course]) == []
+        assert not base.messages
+
+    asyncio.run(scenario())
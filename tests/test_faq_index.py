@@ -0,0 +1,20 @@
+from utils.FaqIndex import FaqEntry, FaqIndex
+
+
+def test_duplicate_aliases_are_indexed_once():
+    index = FaqIndex()
+    index.add(
+        FaqEntry(
+            name="leetcode",
+            content="Practice problems",
+            aliases=["LeetCode", "lc", "LC", "lc"],
+        )
+    )
+    index.add(FaqEntry(name="lecture", content="Lecture notes"))
+    assert index.resolve("lc").name == "leetcode"
+
+    assert index.remove("LC").name == "leetcode"
+    assert "lc" not in index and "leetcode" not in index
+    # The shared prefix only leads to the remaining entry now
+    assert index.resolve("lec").name == "lecture"
+    assert [entry.name for entry in index.suggest("le")] == ["lecture"]
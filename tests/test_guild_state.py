@@ -0,0 +1,48 @@
+import os
+import uuid
+
+from utils.GuildState import MIGRATED_SUFFIX, GuildStateStore
+from utils.JsonTools import SECRETS_PATH, read_json, write_json
+
+
+def _split(legacy):
+    # "<guild_id>:<entry>" -> that guild's entries; unknown guilds are left over
+    payloads = {}
+    for key, value in legacy.items():
+        guild, _, entry = key.partition(":")
+        target = payloads.setdefault(int(guild) if guild else None, {})
+        target[key if not guild else entry] = value
+    return payloads
+
+
+def test_migration_merges_into_existing_guild_files():
+    filename = f"{uuid.uuid4().hex}.json"
+    store = GuildStateStore(filename)
+    store._states[1] = {"kept": True}
+    store.write(1)
+    store.unload(1)
+    write_json(filename, {"1:kept": False, "1:new": [1, 2], "2:new": [3]})
+
+    store.migrate_legacy(filename, _split)
+
+    assert store._read(1) == {"kept": True, "new": [1, 2]}
+    assert store._read(2) == {"new": [3]}
+    assert not store.is_loaded(1) and not store.is_loaded(2)
+    assert not os.path.exists(os.path.join(SECRETS_PATH, filename))
+    assert os.path.exists(os.path.join(SECRETS_PATH, filename + MIGRATED_SUFFIX))
+
+
+def test_leftover_entries_are_merged_once_their_guild_is_known():
+    filename = f"{uuid.uuid4().hex}.json"
+    store = GuildStateStore(filename)
+    write_json(filename, {"1:a": 1, ":b": 2})
+
+    store.migrate_legacy(filename, _split)
+    assert read_json(filename) == {":b": 2}
+    assert store._read(1) == {"a": 1}
+
+    # The guild got state of its own before its leftover entry could be placed
+    write_json(filename, {"1:b": 2})
+    store.migrate_legacy(filename, _split)
+    assert store._read(1) == {"a": 1, "b": 2}
+    assert os.path.exists(os.path.join(SECRETS_PATH, filename + MIGRATED_SUFFIX))
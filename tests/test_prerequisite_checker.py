@@ -0,0 +1,40 @@
+import asyncio
+import importlib
+
+from fakes import FakeBot
+from cogs.PrequisiteChecker import CATALOGUE_REFRESH_JOB
+
+TIMEOUT: float = 5.0
+
+
+def test_empty_catalogue_is_refreshed_once_loaded(bot: FakeBot):
+    async def scenario():
+        importlib.import_module("cogs.PrequisiteChecker").setup(bot)
+        cog = bot.cogs["PrerequisiteChecker"]
+        refreshed = asyncio.Event()
+
+        async def scheduled_refresh():
+            refreshed.set()
+
+        # Instead of scraping the calendar
+        cog._scheduled_refresh = scheduled_refresh
+        await bot.dispatch_ready()
+
+        assert not cog.catalogue
+        await asyncio.wait_for(refreshed.wait(), TIMEOUT)
+        assert bot.scheduler.get_job(CATALOGUE_REFRESH_JOB).runs == 1
+
+    asyncio.run(scenario())
+
+
+def test_only_the_first_shard_refreshes_the_catalogue(bot: FakeBot):
+    async def scenario():
+        bot.shard_id = 1
+        importlib.import_module("cogs.PrequisiteChecker").setup(bot)
+        cog = bot.cogs["PrerequisiteChecker"]
+        await bot.dispatch_ready()
+
+        assert cog.state_loaded
+        assert bot.scheduler.get_job(CATALOGUE_REFRESH_JOB) is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import asyncio
+import importlib
+
+from fakes import FakeBot
+
+TIMEOUT: float = 5.0
+
+# Extension -> the cog it adds and the scheduler job the cog registers
+COG_JOBS = {
+    "cogs.CourseThreads": ("CourseThreads", "course_threads.refresh"),
+    "cogs.ThreadManager": ("ThreadManager", "thread_manager.refresh"),
+    "cogs.PrequisiteChecker": ("PrerequisiteChecker", "prereq.catalogue_refresh"),
+}
+
+
+def test_reloaded_cogs_register_their_jobs_again(bot: FakeBot):
+    async def scenario():
+        for extension in COG_JOBS:
+            importlib.import_module(extension).setup(bot)
+        await bot.dispatch_ready()
+
+        for extension, (name, job) in COG_JOBS.items():
+            old = bot.get_cog(name)
+            assert bot.scheduler.get_job(job) is not None
+            shut_down = asyncio.Event()
+            shutdown = old.shutdown
+
+            async def tracked_shutdown():
+                await shutdown()
+                shut_down.set()
+
+            old.shutdown = tracked_shutdown
+            # Like `!reload <module>`
+            bot.remove_cog(name)
+            assert bot.scheduler.get_job(job) is None
+            # Unloading persists the old cog's state like a shutdown would
+            await asyncio.wait_for(shut_down.wait(), TIMEOUT)
+            importlib.import_module(extension).setup(bot)
+            new = bot.get_cog(name)
+
+            await asyncio.wait_for(new.wait_for_state(), TIMEOUT)
+            assert bot.scheduler.get_job(job) is not None
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from utils.RestBudget import RestBudget
+
+
+def _attached_budget():
+    budget = RestBudget()
+    trace = SimpleNamespace(on_request_start=[], on_request_end=[])
+    budget.attach(trace)
+    [on_request_start] = trace.on_request_start
+
+    async def send_request():
+        params = SimpleNamespace(url=SimpleNamespace(host="discord.com"))
+        await on_request_start(None, None, params)
+
+    return budget, send_request
+
+
+def test_throttled_requests_are_counted_once():
+    async def scenario():
+        budget, send_request = _attached_budget()
+        async with budget.throttle("GET", "/channels/1"):
+            await send_request()
+        assert len(budget._recent) == 1
+
+    asyncio.run(scenario())
+
+
+def test_requests_after_an_unsent_throttled_one_are_counted():
+    async def scenario():
+        budget, send_request = _attached_budget()
+        with pytest.raises(asyncio.CancelledError):
+            async with budget.throttle("GET", "/channels/1"):
+                raise asyncio.CancelledError()
+        # An interactive request from the same task
+        await send_request()
+        assert len(budget._recent) == 2
+
+    asyncio.run(scenario())
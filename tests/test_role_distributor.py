@@ -0,0 +1,34 @@
+import asyncio
+import importlib
+
+from fakes import FakeBot, FakeContext, FakeEmoji
+
+
+def test_finalizing_reports_emojis_that_werent_added(bot: FakeBot):
+    async def scenario():
+        importlib.import_module("cogs.RoleDistributor").setup(bot)
+        cog = bot.cogs["RoleDistributor"]
+        guild = bot.add_guild()
+        channel = guild.add_text_channel("roles")
+        await cog.load_guild(guild.id)
+        bot.emojis.append(FakeEmoji("ece", emoji_id=1001))
+        message = await channel.send("React for roles")
+        # 1002 is a custom emoji from a guild the bot has left
+        cog.role_collector[guild.id] = {
+            "message": message,
+            "mapping": {
+                key: str(guild.add_role(f"role-{key}").id)
+                for key in ("🍎", "1001", "1002")
+            },
+            "unique": False,
+        }
+        ctx = FakeContext(bot, author=bot.owner, guild=guild, channel=channel)
+
+        await cog.finalize_role_mapping.callback(cog, ctx)
+        assert len(message.reactions) == 2
+        assert ctx.sent[-1]["content"] == (
+            "Done! Added 2 and removed 0 reactions. "
+            "Couldn't find 1 emojis, so they weren't added: `1002`"
+        )
+
+    asyncio.run(scenario())
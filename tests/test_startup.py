@@ -0,0 +1,52 @@
+import asyncio
+import importlib
+
+import pytest
+
+from fakes import FakeBot, FakeContext
+from utils.Startup import StateNotLoaded
+
+# Commands that wait for state fail the test instead of hanging it
+TIMEOUT: float = 5.0
+
+
+def test_cog_loaded_after_ready_loads_its_state(bot: FakeBot):
+    async def scenario():
+        await bot.dispatch_ready()
+        # Like `!load FaqManager` once the bot is up
+        importlib.import_module("cogs.FaqManager").setup(bot)
+        cog = bot.cogs["FaqManager"]
+        guild = bot.add_guild()
+        ctx = FakeContext(
+            bot, author=bot.owner, guild=guild, channel=guild.add_text_channel("faq")
+        )
+
+        await asyncio.wait_for(cog.cog_before_invoke(ctx), TIMEOUT)
+        await cog.search_faqs.callback(cog, ctx, terms="leetcode")
+        assert cog.state_loaded
+        assert ctx.sent
+
+    asyncio.run(scenario())
+
+
+def test_commands_of_a_cog_whose_state_failed_to_load_fail(bot: FakeBot):
+    async def scenario():
+        importlib.import_module("cogs.FaqManager").setup(bot)
+        cog = bot.cogs["FaqManager"]
+
+        async def load_state():
+            raise OSError("extra_commands.json is unreadable")
+
+        cog.load_state = load_state
+        await bot.dispatch_ready()
+        guild = bot.add_guild()
+        ctx = FakeContext(
+            bot, author=bot.owner, guild=guild, channel=guild.add_text_channel("faq")
+        )
+
+        # Rather than letting `!faq add` save over the unread custom FAQs
+        with pytest.raises(StateNotLoaded):
+            await asyncio.wait_for(cog.cog_before_invoke(ctx), TIMEOUT)
+        assert cog.state_failed
+
+    asyncio.run(scenario())